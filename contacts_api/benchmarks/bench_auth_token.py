@@ -0,0 +1,70 @@
+"""
+Microbenchmark of the per-request cost of the ``Auth.get_current_user`` dependency on a user cache hit.
+
+"before" re-verifies the JWT on every request the way the dependency used to; "cached" runs the current
+dependency, which verifies a token once and then reads its claims from ``services.token_cache``.
+Both are measured for an HMAC key and for RS256 and ES256 key pairs generated on the fly.
+The user cache answers from process memory, so only the token handling differs between the rows.
+
+Usage::
+
+    python -m benchmarks.bench_auth_token --number 20000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+from models import User
+from services.auth import auth_service
+from services.jwt_keys import KeySet
+from services.token_cache import token_cache
+from services.user_cache import user_cache, UserSnapshot
+
+
+def private_pem(key) -> str:
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption()).decode()
+
+
+async def measure(name: str, call, number: int) -> None:
+    for _ in range(100):
+        await call()
+    started = time.perf_counter()
+    for _ in range(number):
+        await call()
+    per_call = (time.perf_counter() - started) / number * 1e6
+    print(f"{name:<16} {per_call:>8.2f} us/request")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    user = User(id=1, username="deadpool", email="deadpool@example.com", created_at=datetime.now(), confirmed=True)
+    user_cache.local_ttl = 3600
+    user_cache._remember(UserSnapshot.from_user(user), user_cache._generation)
+
+    key_sets = {
+        "HS256": KeySet("HS256", auth_service.SECRET_KEY),
+        "RS256": KeySet("RS256", "", private_pem(rsa.generate_private_key(65537, 2048)), key_id="bench"),
+        "ES256": KeySet("ES256", "", private_pem(ec.generate_private_key(ec.SECP256R1())), key_id="bench"),
+    }
+    for algorithm, keys in key_sets.items():
+        auth_service.keys = keys
+        token = await auth_service.create_access_token(data={"sub": user.email})
+
+        async def before():
+            token_cache.clear()
+            return await auth_service.get_current_user(token, db=None)
+
+        await measure(f"{algorithm} before", before, args.number)
+        await measure(f"{algorithm} cached", lambda: auth_service.get_current_user(token, db=None), args.number)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Microbenchmark of the per-request cost of ``Auth.get_current_user`` on a user cache hit.
+
+"before" decodes the JWT and unpickles a whole SQLAlchemy ``User`` the way the dependency used to;
+"local" and "redis" run the current dependency, which loads a ``UserSnapshot`` through ``services.user_cache``,
+answered by the in-process tier and by the Redis tier respectively.
+Redis is replaced by an in-memory dict so only the CPU cost in the worker is measured, and the size
+of the cached value is reported since it is what travels over the network on every request.
+
+Usage::
+
+    python -m benchmarks.bench_auth_user_cache --number 20000
+"""
+import argparse
+import asyncio
+import pickle
+import time
+from datetime import datetime
+
+from jose import jwt
+
+from models import User
+from services.auth import auth_service
+from services.user_cache import user_cache, UserSnapshot
+
+
+class DictRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+
+async def before(token: str, r: DictRedis):
+    payload = jwt.decode(token, auth_service.SECRET_KEY, algorithms=[auth_service.ALGORITHM])
+    return pickle.loads(await r.get(f"user:{payload['sub']}"))
+
+
+async def after(token: str):
+    return await auth_service.get_current_user(token, db=None)
+
+
+async def measure(name: str, call, number: int, size: int) -> None:
+    for _ in range(100):
+        await call()
+    started = time.perf_counter()
+    for _ in range(number):
+        await call()
+    per_call = (time.perf_counter() - started) / number * 1e6
+    print(f"{name:<8} {per_call:>8.2f} us/request   cached value {size:>5} bytes")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    user = User(id=1, username="deadpool", email="deadpool@example.com", password="$2b$12$" + "x" * 53,
+                refresh_token="y" * 200, created_at=datetime.now(), avatar="https://www.gravatar.com/avatar/" + "0" * 32,
+                confirmed=True)
+    token = await auth_service.create_access_token(data={"sub": user.email})
+
+    r = DictRedis()
+    user_cache.r = r
+    await r.set(f"user:{user.email}", pickle.dumps(user))
+    await user_cache.set(UserSnapshot.from_user(user))
+    size = len(r.data[user_cache.key(user.email)])
+
+    await measure("before", lambda: before(token, r), args.number, len(r.data[f"user:{user.email}"]))
+    await measure("local", lambda: after(token), args.number, size)
+    user_cache._local.clear()
+    user_cache.local_size = 0
+    await measure("redis", lambda: after(token), args.number, size)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
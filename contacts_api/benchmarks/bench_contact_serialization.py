@@ -0,0 +1,98 @@
+"""
+Microbenchmark of the per-row cost of reading and serializing a page of contacts, as the list endpoints do.
+
+"before" loads ``models.Contact`` objects and serializes them the way FastAPI handles a
+``response_model=List[schemas.ContactResponse]``: validation from attributes, conversion to JSON-compatible
+data, then the stdlib ``json`` encoder. "after" selects ``repository.contacts.CONTACT_COLUMNS`` as plain
+rows and renders them with ``services.serialization.contacts_body``. The "total" column includes
+the query, the "serialize" column only the rendering of the response body. Contacts live in an in-memory
+SQLite database, so database time is mostly driver overhead.
+
+Usage::
+
+    python -m benchmarks.bench_contact_serialization --rows 100 1000 --number 200
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+import models, schemas
+from repository.contacts import CONTACT_COLUMNS
+from services.serialization import contacts_body
+
+RESPONSE_FIELD = create_model_field(name="Response_read_contacts", type_=List[schemas.ContactResponse],
+                                    mode="serialization")
+
+
+async def seed(db: AsyncSession, count: int) -> None:
+    db.add(models.User(id=1, username="bench", email="bench@example.com", password="-", confirmed=True))
+    db.add_all(models.Contact(first_name=f"First{i}", last_name=f"Last{i}", email=f"bench{i}@example.com",
+                              phone_number="0000000000", birthday=datetime(1990, 1, 1) + timedelta(days=i % 365),
+                              additional_info="note" if i % 2 else None, user_id=1) for i in range(count))
+    await db.commit()
+
+
+async def before_read(db: AsyncSession, rows: int):
+    result = await db.execute(select(models.Contact).filter(models.Contact.user_id == 1).limit(rows))
+    return result.scalars().all()
+
+
+async def before_serialize(contacts) -> bytes:
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=contacts)
+    return JSONResponse(content).body
+
+
+async def after_read(db: AsyncSession, rows: int):
+    result = await db.execute(select(*CONTACT_COLUMNS).filter(models.Contact.user_id == 1).limit(rows))
+    return result.all()
+
+
+async def after_serialize(rows) -> bytes:
+    return contacts_body(rows)
+
+
+async def measure(read, serialize, db: AsyncSession, rows: int, number: int) -> tuple[float, float]:
+    read_seconds = serialize_seconds = 0.0
+    for _ in range(number):
+        db.expunge_all()
+        started = time.perf_counter()
+        page = await read(db, rows)
+        read_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        await serialize(page)
+        serialize_seconds += time.perf_counter() - started
+    per_row = number * rows / 1e6
+    return (read_seconds + serialize_seconds) / per_row, serialize_seconds / per_row
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with AsyncSession(engine, expire_on_commit=False) as db:
+        await seed(db, max(args.rows))
+        for rows in args.rows:
+            for name, read, serialize in (("before", before_read, before_serialize),
+                                          ("after", after_read, after_serialize)):
+                await measure(read, serialize, db, rows, 5)
+                total, serialize_only = await measure(read, serialize, db, rows, args.number)
+                print(f"{rows:>5} rows  {name:<7} total {total:>7.2f} us/row   serialize {serialize_only:>6.2f} us/row")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
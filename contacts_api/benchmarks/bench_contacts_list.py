@@ -0,0 +1,140 @@
+"""
+Load benchmark for ``GET /api/contacts/``.
+
+Compares the blocking ``Session`` implementation the route used to have ("before") with the current
+``AsyncSession`` implementation ("after") against the database configured in ``DATABASE_URL``.
+Both variants are served in-process through ``httpx.ASGITransport`` and hit with the same number of
+concurrent clients, so the numbers show whether DB waits of concurrent requests overlap on one event loop.
+Point it at Postgres: a local SQLite file has no network wait to overlap, so there it only measures
+driver overhead.
+
+Usage::
+
+    python -m benchmarks.bench_contacts_list --requests 2000 --concurrency 50 --seed 1000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+import models
+from db import SQLALCHEMY_DATABASE_URL, SessionLocal, engine
+from main import app
+from services.auth import auth_service
+from services.rate_limit import RateLimit
+
+SYNC_DRIVERS = {"postgresql+asyncpg": "postgresql+psycopg2", "sqlite+aiosqlite": "sqlite"}
+
+BENCH_EMAIL = "bench@example.com"
+
+
+def sync_database_url() -> str:
+    url = make_url(SQLALCHEMY_DATABASE_URL)
+    return url.set(drivername=SYNC_DRIVERS.get(url.drivername, url.drivername)).render_as_string(hide_password=False)
+
+
+async def seed(count: int) -> models.User:
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with SessionLocal() as db:
+        user = models.User(username="bench", email=BENCH_EMAIL, password="-", confirmed=True)
+        db.add(user)
+        await db.flush()
+        db.add_all(models.Contact(first_name=f"First{i}", last_name=f"Last{i}", email=f"bench{i}@example.com",
+                                  phone_number="0000000000", birthday=datetime(1990, 1, 1) + timedelta(days=i % 365),
+                                  user_id=user.id) for i in range(count))
+        await db.commit()
+        return user
+
+
+async def load_user() -> models.User:
+    from repository.users import get_user_by_email
+
+    async with SessionLocal() as db:
+        return await get_user_by_email(BENCH_EMAIL, db)
+
+
+def build_before_app(user: models.User, pool_size: int) -> FastAPI:
+    # A blocking checkout from an exhausted pool would stall the loop the returning requests need, so size it up
+    sync_engine = create_engine(sync_database_url(), pool_size=pool_size)
+    SyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+
+    def get_sync_db():
+        db = SyncSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    before = FastAPI()
+
+    @before.get("/api/contacts/")
+    async def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_sync_db)):
+        # The pre-async implementation: a blocking query inside a coroutine
+        return db.query(models.Contact).filter(models.Contact.user_id == user.id).offset(skip).limit(limit).all()
+
+    return before
+
+
+def build_after_app(user: models.User) -> FastAPI:
+    app.dependency_overrides[auth_service.get_current_user] = lambda: user
+    for route in app.routes:
+        for dependency in getattr(route, "dependencies", []):
+            if isinstance(dependency.dependency, RateLimit):
+                app.dependency_overrides[dependency.dependency] = lambda: None
+    return app
+
+
+async def run_load(target: FastAPI, total: int, concurrency: int) -> list[float]:
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=target), base_url="http://bench") as client:
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                started = time.perf_counter()
+                response = await client.get("/api/contacts/", params={"limit": 100})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def report(name: str, latencies: list[float], elapsed: float) -> None:
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000
+    print(f"{name:<8} {len(latencies) / elapsed:>10.1f} req/s   p50 {p50:>8.2f} ms   p99 {p99:>8.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0, help="create the benchmark user with this many contacts")
+    args = parser.parse_args()
+
+    user = await seed(args.seed) if args.seed else await load_user()
+    if user is None:
+        parser.error("benchmark user not found, run once with --seed")
+
+    for name, target in (("before", build_before_app(user, args.concurrency)), ("after", build_after_app(user))):
+        await run_load(target, args.concurrency, args.concurrency)  # warm up pools
+        started = time.perf_counter()
+        latencies = await run_load(target, args.requests, args.concurrency)
+        report(name, latencies, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+"""
+Microbenchmark of the per-message cost of rendering the confirmation email template.
+
+"before" renders through a new Jinja environment per message, the way ``fastapi_mail.FastMail`` does with
+``ConnectionConfig.template_engine()``, so the template is loaded and compiled every time. "render" calls
+``services.email_templates.email_templates.render`` once per message, and "render_many" renders all the
+messages of a mailing from the compiled template with ``EmailTemplates.render_many``.
+
+Usage::
+
+    python -m benchmarks.bench_email_templates --messages 1000
+"""
+import argparse
+import time
+
+from services.email import conf
+from services.email_templates import email_templates
+
+TEMPLATE = "email_template.html"
+
+
+def before(contexts: list[dict]) -> list[str]:
+    return [conf.template_engine().get_template(TEMPLATE).render(context) for context in contexts]
+
+
+def render(contexts: list[dict]) -> list[str]:
+    return [email_templates.render(TEMPLATE, **context) for context in contexts]
+
+
+def render_many(contexts: list[dict]) -> list[str]:
+    return list(email_templates.render_many(TEMPLATE, contexts, host="https://contacts.example.com/"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    args = parser.parse_args()
+
+    email_templates.precompile()
+    contexts = [{"host": "https://contacts.example.com/", "username": f"user{i}", "token": f"token{i}"}
+                for i in range(args.messages)]
+    for name, run in (("before", before), ("render", render), ("render_many", render_many)):
+        run(contexts[:10])
+        started = time.perf_counter()
+        run(contexts)
+        per_message = (time.perf_counter() - started) / args.messages * 1e6
+        print(f"{name:<12} {per_message:>9.2f} us/message")
+
+
+if __name__ == "__main__":
+    main()
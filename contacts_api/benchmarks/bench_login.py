@@ -0,0 +1,62 @@
+"""
+Benchmark of password verification throughput, as done by ``POST /api/auth/login``, versus worker count.
+
+"inline" calls bcrypt on the event loop the way the login handler used to; the other rows run
+``Auth.verify_password`` on a pool of the given number of hashing threads. While the loop is blocked
+by inline hashing nothing else is served, so the "loop lag" column reports the worst delay seen by a
+ticker coroutine that should wake up every millisecond.
+
+Usage::
+
+    python -m benchmarks.bench_login --logins 64 --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.auth import Auth
+
+
+async def ticker(lags: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def run(name: str, verify, logins: int) -> None:
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await asyncio.gather(*(verify() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    print(f"{name:<10} {logins / elapsed:>8.1f} logins/s   loop lag max {max(lags, default=0) * 1000:>8.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    auth = Auth()
+    hashed = auth.pwd_context.hash("123456789")
+
+    async def inline():
+        return auth.pwd_context.verify("123456789", hashed)
+
+    await run("inline", inline, args.logins)
+    for workers in args.workers:
+        auth.hash_executor = ThreadPoolExecutor(max_workers=workers)
+        auth.hash_queue_limit = args.logins
+        await run(f"{workers} workers", lambda: auth.verify_password("123456789", hashed), args.logins)
+        auth.hash_executor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
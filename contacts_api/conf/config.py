@@ -1,22 +1,81 @@
 from pydantic_settings import BaseSettings
 
-from pydantic import EmailStr, Extra
+from pydantic import EmailStr, Extra, field_validator
+
+# Postgres accepts at most 32767 bind parameters per statement, and a contact row binds 9 (every column but id)
+MAX_CONTACT_IMPORT_BATCH_SIZE = 32767 // 9
 
 class Settings(BaseSettings):
     database_url: str
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = False
+    db_pgbouncer: bool = False
+    database_replica_urls: list[str] = []
+    database_replica_sticky_seconds: float = 5
+    database_replica_check_interval: float = 5
     secret_key: str
     algorithm: str
+    jwt_private_key_file: str | None = None
+    jwt_public_keys_file: str | None = None
+    jwt_key_id: str | None = None
+    token_cache_size: int = 4096
     mail_username: EmailStr
     mail_password: str
     mail_from: EmailStr
     mail_from_name: str
     mail_port: int
     mail_server: str
+    mail_starttls: bool = False
+    mail_ssl_tls: bool = True
+    mail_use_credentials: bool = True
+    mail_validate_certs: bool = True
+    email_template_cache_dir: str | None = None
+    smtp_pool_size: int = 4
+    smtp_max_idle: float = 60
+    email_outbox_batch_size: int = 50
+    email_outbox_poll_interval: float = 5
+    email_outbox_max_attempts: int = 8
+    email_outbox_backoff_seconds: float = 30
+    email_outbox_backoff_max: float = 3600
+    email_outbox_lease_seconds: float = 300
     redis_host: str
     redis_port: int
+    redis_max_connections: int = 50
     cloudinary_name: str
     cloudinary_api_key: str
     cloudinary_api_secret: str
+    avatar_storage: str = "cloudinary"
+    avatar_local_dir: str = "static/avatars"
+    avatar_local_url: str = "/static/avatars/"
+    avatar_size: int = 250
+    avatar_max_bytes: int = 10 * 1024 * 1024
+    avatar_workers: int = 2
+    avatar_queue_size: int = 32
+    prefix_index_enabled: bool = True
+    prefix_index_memory_budget: int = 64 * 1024 * 1024
+    user_cache_local_size: int = 1024
+    user_cache_local_ttl: float = 30
+    result_cache_enabled: bool = True
+    result_cache_ttl: int = 300
+    rate_limit_local_share: float = 0.1
+    rate_limit_user_multipliers: dict[int, float] = {}
+    password_hash_workers: int = 4
+    password_hash_queue_size: int = 32
+    contact_import_batch_size: int = 1000
+    contacts_sync_settle_seconds: float = 5
+    birthday_digest_days: int = 7
+    birthday_digest_chunk_size: int = 500
+    metrics_token: str | None = None
+
+    @field_validator("contact_import_batch_size")
+    @classmethod
+    def check_contact_import_batch_size(cls, value):
+        if not 1 <= value <= MAX_CONTACT_IMPORT_BATCH_SIZE:
+            raise ValueError(f"must be between 1 and {MAX_CONTACT_IMPORT_BATCH_SIZE}")
+        return value
 
     class Config:
         extra = 'allow'
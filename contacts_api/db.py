@@ -1,16 +1,304 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import hashlib
+import itertools
+import time
+from uuid import uuid4
+
+from fastapi import Request
+from sqlalchemy import exc, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
 from conf.config import settings
 
 
 SQLALCHEMY_DATABASE_URL = settings.database_url
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
-    db = SessionLocal()
-    try:
+class PoolMetrics:
+    """
+    Counters of the connection pool checkouts, to see when requests queue for a database connection.
+
+    Attributes:
+        checkouts (int): Number of connections handed out by the pool.
+        timeouts (int): Number of checkouts that gave up after ``DB_POOL_TIMEOUT`` seconds.
+        wait_seconds_total (float): Time spent waiting for a connection, summed over all checkouts.
+        wait_seconds_max (float): Longest wait for a connection.
+        overflow_max (int): Highest number of overflow connections open at the same time.
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.overflow_max = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the counters, with the current state of the pool when it is a queue pool.
+
+        :return: Pool counters.
+        :rtype: dict
+        """
+        stats = {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+            "overflow_max": self.overflow_max,
+        }
+        if self.pool is not None:
+            stats.update(size=self.pool.size(), checked_out=self.pool.checkedout(),
+                         overflow=max(self.pool.overflow(), 0))
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records in its ``metrics`` how long each checkout waited for a connection.
+    Subclasses made by :func:`instrumented_pool` record into their own :class:`PoolMetrics`.
+    """
+    metrics = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics.pool = self
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        self.metrics.checkouts += 1
+        self.metrics.wait_seconds_total += waited
+        self.metrics.wait_seconds_max = max(self.metrics.wait_seconds_max, waited)
+        self.metrics.overflow_max = max(self.metrics.overflow_max, self.overflow())
+        return connection
+
+
+def instrumented_pool(metrics: PoolMetrics) -> type:
+    """
+    Makes a pool class recording into the given metrics, to be passed as ``poolclass`` to an engine.
+
+    :param metrics: The metrics of the engine.
+    :type metrics: PoolMetrics
+    :return: A subclass of :class:`InstrumentedQueuePool`.
+    :rtype: type
+    """
+    return type("InstrumentedQueuePool", (InstrumentedQueuePool,), {"metrics": metrics})
+
+
+def engine_options(settings, url: str | None = None, metrics: PoolMetrics | None = None) -> dict:
+    """
+    Builds the connection pool options of an engine from the application settings.
+
+    SQLite keeps the pool chosen by its driver. With ``DB_PGBOUNCER`` set, asyncpg prepared statement
+    caches are disabled and statements get unique names, as PgBouncer in transaction mode may run
+    consecutive statements of a session on different server connections.
+
+    :param settings: The application settings.
+    :type settings: conf.config.Settings
+    :param url: The database URL, ``settings.database_url`` by default.
+    :type url: str | None
+    :param metrics: Where the pool records its checkouts, :data:`pool_metrics` by default.
+    :type metrics: PoolMetrics | None
+    :return: Keyword arguments for ``create_async_engine``.
+    :rtype: dict
+    """
+    options = {"pool_pre_ping": settings.db_pool_pre_ping, "pool_recycle": settings.db_pool_recycle}
+    if make_url(url or settings.database_url).get_backend_name() != "sqlite":
+        options.update(poolclass=instrumented_pool(metrics or pool_metrics), pool_size=settings.db_pool_size,
+                       max_overflow=settings.db_max_overflow, pool_timeout=settings.db_pool_timeout)
+    if settings.db_pgbouncer:
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    return options
+
+
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, **engine_options(settings))
+
+
+class ReplicaRouter:
+    """
+    Picks the read replica serving the next read-only session: round-robin over the replicas that passed
+    their last health check, or the primary when none did.
+
+    A user who has just written is kept on the primary for ``sticky_seconds``, so they read their own
+    writes despite replication lag. The time of a user's last write is their contacts version
+    (:data:`services.etag.contacts_version`), shared by all workers through Redis, which the read routes pass
+    to :meth:`pick` or :meth:`follow_writes`. Each worker also remembers the clients, told apart by their
+    ``Authorization`` header, whose writes it handled itself, so those are kept on the primary even before
+    the version is read.
+
+    Attributes:
+        engines (list): The replica engines.
+        healthy (list): Whether each replica answered its last health check.
+        metrics (list): Pool metrics of each replica.
+        sticky_seconds (float): How long reads stay on the primary after a write.
+    """
+
+    def __init__(self, urls: list[str], sticky_seconds: float = 5, check_interval: float = 5):
+        self.metrics = [PoolMetrics() for _ in urls]
+        self.engines = [create_async_engine(url, **engine_options(settings, url, metrics))
+                        for url, metrics in zip(urls, self.metrics)]
+        self.healthy = [True] * len(urls)
+        self.sticky_seconds = sticky_seconds
+        self.check_interval = check_interval
+        self._turn = itertools.count()
+        self._sticky = {}
+
+    @staticmethod
+    def client_key(request: Request) -> bytes | None:
+        authorization = request.headers.get("authorization")
+        return hashlib.sha256(authorization.encode()).digest() if authorization else None
+
+    def wrote_recently(self, version: int) -> bool:
+        """
+        Tells whether a user's last write, given by their contacts version, is less than ``sticky_seconds`` old.
+
+        :param version: The contacts version of the user, the time of their last write in nanoseconds.
+        :type version: int
+        :return: Whether the write may not have reached the replicas yet.
+        :rtype: bool
+        """
+        return time.time_ns() - version < self.sticky_seconds * 1e9
+
+    def pick(self, client_key: bytes | None = None, version: int | None = None):
+        """
+        Returns the engine for the next read-only session.
+
+        :param client_key: Identifies the client, see :meth:`client_key`.
+        :type client_key: bytes | None
+        :param version: The contacts version of the user, if known.
+        :type version: int | None
+        :return: A healthy replica engine, or None to read from the primary.
+        :rtype: AsyncEngine | None
+        """
+        if client_key is not None and self._sticky.get(client_key, 0) > time.monotonic():
+            return None
+        if version is not None and self.wrote_recently(version):
+            return None
+        healthy = [engine for engine, ok in zip(self.engines, self.healthy) if ok]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def wrote(self, client_key: bytes | None):
+        """
+        Records that a client wrote to the primary, keeping its reads on the primary for a while.
+
+        :param client_key: Identifies the client, see :meth:`client_key`.
+        :type client_key: bytes | None
+        """
+        if client_key is None or not self.engines:
+            return
+        now = time.monotonic()
+        if len(self._sticky) > 10000:
+            self._sticky = {key: until for key, until in self._sticky.items() if until > now}
+        self._sticky[client_key] = now + self.sticky_seconds
+
+    def follow_writes(self, db: AsyncSession, version: int) -> None:
+        """
+        Moves the reads of a session opened on a replica to the primary if the user wrote within
+        ``sticky_seconds``. Must be called before the session reads anything.
+
+        :param db: The read-only session.
+        :type db: AsyncSession
+        :param version: The contacts version of the user.
+        :type version: int
+        """
+        if db.info.get("replica") is not None and self.wrote_recently(version):
+            db.info["replica"] = None
+
+    async def check(self):
+        """
+        Runs ``SELECT 1`` on every replica and records which ones answered in time.
+        """
+        async def select_one(engine):
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+
+        async def ping(engine):
+            try:
+                await asyncio.wait_for(select_one(engine), self.check_interval)
+                return True
+            except Exception:
+                return False
+
+        self.healthy = list(await asyncio.gather(*(ping(engine) for engine in self.engines)))
+
+    async def monitor(self):
+        """
+        Checks the replicas every ``check_interval`` seconds until cancelled. Meant to run as a background task.
+        """
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def stats(self) -> list[dict]:
+        """
+        Returns the health and pool counters of each replica.
+
+        :return: A dict per replica.
+        :rtype: list[dict]
+        """
+        return [{"healthy": healthy, **metrics.stats()} for healthy, metrics in zip(self.healthy, self.metrics)]
+
+
+replica_router = ReplicaRouter(settings.database_replica_urls, settings.database_replica_sticky_seconds,
+                               settings.database_replica_check_interval)
+
+
+class RoutingSession(Session):
+    """
+    Session that reads from the replica it was given in ``info["replica"]``, if any, and always writes
+    to the primary. Every write marks the client in ``info["client_key"]`` as having just written.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase):
+            replica_router.wrote(self.info.get("client_key"))
+            return engine.sync_engine
+        replica = self.info.get("replica")
+        return replica.sync_engine if replica is not None else engine.sync_engine
+
+
+SessionLocal = async_sessionmaker(class_=AsyncSession, sync_session_class=RoutingSession,
+                                  autoflush=False, expire_on_commit=False)
+
+
+def read_session(client_key: bytes | None = None, version: int | None = None) -> AsyncSession:
+    """
+    Opens a session whose reads go to a read replica, unless the client or user has just written.
+
+    :param client_key: Identifies the client, see :meth:`ReplicaRouter.client_key`.
+    :type client_key: bytes | None
+    :param version: The contacts version of the user, see :meth:`ReplicaRouter.pick`.
+    :type version: int | None
+    :return: The session.
+    :rtype: AsyncSession
+    """
+    return SessionLocal(info={"replica": replica_router.pick(client_key, version), "client_key": client_key})
+
+
+async def get_db(request: Request):
+    async with SessionLocal(info={"client_key": replica_router.client_key(request)}) as db:
+        yield db
+
+
+async def get_read_db(request: Request):
+    async with read_session(replica_router.client_key(request)) as db:
         yield db
-    finally:
-        db.close()
@@ -1,21 +1,50 @@
-import redis.asyncio as redis
-from fastapi import Depends, FastAPI
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
+import asyncio
+import secrets
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException, Security, status
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from fastapi.staticfiles import StaticFiles
 
 
 from repository import contacts
 from routes import contacts, auth, users
 # import models
-from db import engine
+from db import engine, pool_metrics, replica_router
 from conf.config import settings
+from services.avatars import avatar_pipeline
+from services.email import email_worker
+from services.email_templates import email_templates
+from services.jwt_keys import key_set
+from services.pagination import NEXT_CURSOR_HEADER
+from services.rate_limit import IPRateLimit, RateLimitHeadersMiddleware, sliding_window
+from services.result_cache import result_cache
+from services.token_cache import token_cache
+from services.user_cache import user_cache
+from services.redis_client import redis_client
 
 
 # models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    email_templates.precompile()
+    tasks = [asyncio.create_task(user_cache.listen()), asyncio.create_task(email_worker.run())]
+    if replica_router.engines:
+        tasks.append(asyncio.create_task(replica_router.monitor()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await avatar_pipeline.drain()
+    await email_worker.pool.close()
+    await redis_client.aclose(close_connection_pool=True)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 origins = [ 
     "http://localhost:3000"
@@ -27,19 +56,52 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset",
+                    "Retry-After"],
 )
+app.add_middleware(RateLimitHeadersMiddleware)
 
 app.include_router(contacts.router, prefix='/api')
 app.include_router(auth.router, prefix='/api')
 app.include_router(users.router, prefix='/api')
 
+if settings.avatar_storage == "local":
+    app.mount(settings.avatar_local_url.rstrip("/"),
+              StaticFiles(directory=settings.avatar_local_dir, check_dir=False), name="avatars")
+
+
+metrics_security = HTTPBearer(auto_error=False)
+
+
+async def metrics_access(credentials: HTTPAuthorizationCredentials | None = Security(metrics_security)):
+    """
+    Restricts the metrics to holders of the configured metrics token.
+
+    :param credentials: The bearer token sent with the request.
+    :type credentials: HTTPAuthorizationCredentials | None
+    :raises HTTPException: If no metrics token is configured (404), or the token is missing or wrong (401).
+    """
+    if not settings.metrics_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not secrets.compare_digest(credentials.credentials.encode(),
+                                                         settings.metrics_token.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+@app.get("/metrics", dependencies=[Depends(metrics_access)], include_in_schema=False)
+async def metrics():
+    return {"user_cache": user_cache.stats(), "token_cache": token_cache.stats(), "db_pool": pool_metrics.stats(),
+            "db_replicas": replica_router.stats(), "result_cache": result_cache.stats(),
+            "rate_limit": sliding_window.stats(), "email_outbox": email_worker.stats(),
+            "avatars": avatar_pipeline.stats()}
+
 
-@app.on_event("startup")
-async def startup():
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8", decode_responses=True)
-    await FastAPILimiter.init(r)
+@app.get("/.well-known/jwks.json")
+async def jwks():
+    return key_set.jwks()
 
-@app.get("/", dependencies=[Depends(RateLimiter(times=2, seconds=5))])
+@app.get("/", dependencies=[Depends(IPRateLimit(times=2, seconds=5))])
 async def index():
     return {"msg": "Hello World"}
 
@@ -0,0 +1,45 @@
+"""Contacts change tracking and tombstones
+
+Revision ID: 3f8a5c2e7b10
+Revises: 9e2d61f0a8c4
+Create Date: 2026-10-18 16:05:12.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from models import utcnow
+
+
+revision: str = '3f8a5c2e7b10'
+down_revision: Union[str, None] = '9e2d61f0a8c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('created_at', sa.DateTime(), nullable=True))
+    op.add_column('contacts', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    contacts = sa.table('contacts', sa.column('created_at', sa.DateTime()), sa.column('updated_at', sa.DateTime()))
+    now = utcnow()
+    op.execute(contacts.update().values(created_at=now, updated_at=now))
+    op.create_index('ix_contacts_user_id_updated_at', 'contacts', ['user_id', 'updated_at'], unique=False)
+    op.create_table('contact_tombstones',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_contact_tombstones_user_id_deleted_at', 'contact_tombstones', ['user_id', 'deleted_at'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_tombstones_user_id_deleted_at', table_name='contact_tombstones')
+    op.drop_table('contact_tombstones')
+    op.drop_index('ix_contacts_user_id_updated_at', table_name='contacts')
+    op.drop_column('contacts', 'updated_at')
+    op.drop_column('contacts', 'created_at')
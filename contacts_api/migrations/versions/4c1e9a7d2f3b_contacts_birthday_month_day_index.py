@@ -0,0 +1,28 @@
+"""Contacts birthday month-day index
+
+Revision ID: 4c1e9a7d2f3b
+Revises: b7b20e384412
+Create Date: 2026-10-18 11:40:07.503112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from models import month_day
+
+
+revision: str = '4c1e9a7d2f3b'
+down_revision: Union[str, None] = 'b7b20e384412'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_contacts_user_id_birthday_md', 'contacts', ['user_id', month_day(sa.column('birthday'))],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_birthday_md', table_name='contacts')
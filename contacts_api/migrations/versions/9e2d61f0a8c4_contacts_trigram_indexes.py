@@ -0,0 +1,36 @@
+"""Contacts trigram indexes
+
+Revision ID: 9e2d61f0a8c4
+Revises: 4c1e9a7d2f3b
+Create Date: 2026-10-18 13:05:52.114378
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '9e2d61f0a8c4'
+down_revision: Union[str, None] = '4c1e9a7d2f3b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = ('first_name', 'last_name', 'email')
+
+
+def upgrade() -> None:
+    # pg_trgm is Postgres-only, other databases search without these indexes
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in COLUMNS:
+        op.create_index(f'ix_contacts_{column}_trgm', 'contacts', [column], unique=False,
+                        postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    for column in COLUMNS:
+        op.drop_index(f'ix_contacts_{column}_trgm', table_name='contacts')
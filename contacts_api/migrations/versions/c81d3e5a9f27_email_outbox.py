@@ -0,0 +1,44 @@
+"""Email outbox
+
+Revision ID: c81d3e5a9f27
+Revises: 3f8a5c2e7b10
+Create Date: 2026-10-18 18:42:37.581904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'c81d3e5a9f27'
+down_revision: Union[str, None] = '3f8a5c2e7b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('email_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=50), nullable=False),
+    sa.Column('recipient', sa.String(length=250), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('send_after', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(length=500), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    pending = sa.text("status = 'pending'")
+    op.create_index('ix_email_outbox_pending_send_after', 'email_outbox', ['send_after'], unique=False,
+                    postgresql_where=pending, sqlite_where=pending)
+    op.create_index('uq_email_outbox_pending_kind_recipient', 'email_outbox', ['kind', 'recipient'], unique=True,
+                    postgresql_where=pending, sqlite_where=pending)
+
+
+def downgrade() -> None:
+    op.drop_index('uq_email_outbox_pending_kind_recipient', table_name='email_outbox')
+    op.drop_index('ix_email_outbox_pending_send_after', table_name='email_outbox')
+    op.drop_table('email_outbox')
@@ -1,13 +1,49 @@
-from sqlalchemy import Column, Integer, String, Date, func, Boolean
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, String, Date, func, Boolean, Index, DDL, event, JSON, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import ForeignKey
 from sqlalchemy.sql.sqltypes import DateTime
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 
 from db import engine
 
 Base = declarative_base()
 
+
+class month_day(FunctionElement):
+    """
+    SQL expression for the month and day of a date as a single integer, e.g. 1231 for December 31st.
+
+    Lets birthday lookups ignore the year and be served from an index on the expression.
+    """
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(month_day)
+def _compile_month_day(element, compiler, **kw):
+    return "CAST(strftime('%%m%%d', %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(month_day, 'postgresql')
+def _compile_month_day_postgresql(element, compiler, **kw):
+    column = compiler.process(element.clauses, **kw)
+    return "(CAST(EXTRACT(MONTH FROM %s) * 100 + EXTRACT(DAY FROM %s) AS INTEGER))" % (column, column)
+
+
+def utcnow() -> datetime:
+    """
+    The current UTC time as a naive datetime.
+
+    Change tracking timestamps are set by the application rather than the database, so the changes
+    endpoint compares them against the same clock and the same time zone.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class Contact(Base):
     __tablename__ = "contacts"
 
@@ -20,6 +56,67 @@ class Contact(Base):
     additional_info = Column(String, nullable=True)
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
     user = relationship('User', backref="contacts")
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+    __table_args__ = (
+        Index('ix_contacts_user_id_id', 'user_id', 'id'),
+        Index('ix_contacts_user_id_updated_at', 'user_id', 'updated_at'),
+        Index('ix_contacts_user_id_birthday_md', 'user_id', month_day(birthday)),
+        Index('ix_contacts_first_name_trgm', 'first_name', postgresql_using='gin',
+              postgresql_ops={'first_name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_contacts_last_name_trgm', 'last_name', postgresql_using='gin',
+              postgresql_ops={'last_name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_contacts_email_trgm', 'email', postgresql_using='gin',
+              postgresql_ops={'email': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
+
+event.listen(Contact.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+class ContactTombstone(Base):
+    """
+    Marker left behind by a deleted contact, so clients syncing changes learn about the deletion.
+    """
+    __tablename__ = "contact_tombstones"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    deleted_at = Column(DateTime, default=utcnow)
+
+    __table_args__ = (
+        Index('ix_contact_tombstones_user_id_deleted_at', 'user_id', 'deleted_at'),
+    )
+
+
+class EmailOutbox(Base):
+    """
+    Email waiting to be sent by :class:`services.email.OutboxWorker`, kept once sent or given up on.
+
+    ``send_after`` is when the next attempt is due. At most one pending message of each kind exists per
+    recipient, so repeated requests for the same email are sent once.
+    """
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    recipient = Column(String(250), nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    status = Column(String(10), nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    send_after = Column(DateTime, nullable=False, default=utcnow)
+    created_at = Column(DateTime, default=utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(String(500), nullable=True)
+
+    __table_args__ = (
+        Index('ix_email_outbox_pending_send_after', 'send_after',
+              postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+        Index('uq_email_outbox_pending_kind_recipient', 'kind', 'recipient', unique=True,
+              postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+    )
 
 
 class User(Base):
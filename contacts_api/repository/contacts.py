@@ -1,9 +1,22 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, case, func, select, insert, update, delete, literal, true, tuple_, union_all
+from sqlalchemy.dialects import postgresql, sqlite
 import models, schemas
-from datetime import datetime, timedelta
+from db import replica_router
+from conf.config import MAX_CONTACT_IMPORT_BATCH_SIZE, settings
+from services.search import similarity
+from services.prefix_index import UserPrefixIndex, prefix_index
+from services.etag import contacts_version
+from services.serialization import CONTACT_FIELDS
+import calendar
+from datetime import date, datetime, timedelta
 
-async def create_contact(db: Session, body: schemas.ContactCreate, user: models.User):
+
+# the columns of a contact returned by the API, read as plain rows by the list queries
+CONTACT_COLUMNS = tuple(getattr(models.Contact, field) for field in CONTACT_FIELDS)
+
+
+async def create_contact(db: AsyncSession, body: schemas.ContactCreate, user: models.User):
     """
     Create a new contact for a specific user in the database.
 
@@ -11,7 +24,7 @@ async def create_contact(db: Session, body: schemas.ContactCreate, user: models.
     and saves the new contact to the database.
 
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param contact: The schema containing the contact information to be created.
     :type contact: schemas.ContactCreate
     :param user: The user for whom the contact is being created.
@@ -20,22 +33,24 @@ async def create_contact(db: Session, body: schemas.ContactCreate, user: models.
     :rtype: models.Contact
 
     Process:
-        - The contact data is unpacked from the schema and used to create a new Contact instance.
-        - The new contact is associated with the given user via the `user_id`.
-        - The contact is added to the database, committed, and refreshed to reflect the latest state.
-    """
-    contact = models.Contact(**body.model_dump(), user_id = user.id)
-    db.add(contact)
-    db.commit()
-    db.refresh(contact)
+        - The contact data is unpacked from the schema and inserted together with the `user_id` of the given user.
+        - The inserted row is returned by the same statement (`INSERT ... RETURNING`), then committed.
+        - The user's contacts version is bumped and the in-memory prefix index, if loaded, is updated.
+    """
+    stmt = insert(models.Contact).values(**body.model_dump(), user_id=user.id).returning(models.Contact)
+    result = await db.execute(stmt)
+    contact = result.scalars().one()
+    await db.commit()
+    previous, version = await contacts_version.bump(user.id)
+    prefix_index.contact_saved(user.id, contact, previous, version)
     return contact
 
-async def get_contact(db: Session, contact_id: int, user: models.User):
+async def get_contact(db: AsyncSession, contact_id: int, user: models.User):
     """
     Retrieves a single contact with the specified ID for a specific user.
 
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param contact_id: The ID of the contact to retrieve.
     :type contact_id: int
     :param user: The user to retrieve the contact for.
@@ -43,141 +58,582 @@ async def get_contact(db: Session, contact_id: int, user: models.User):
     :return: The contact with the specified ID, or None if it does not exist.
     :rtype: models.Contact | None
     """
-    return db.query(models.Contact).filter(and_(models.Contact.user_id == user.id, models.Contact.id == contact_id)).first()
+    stmt = select(models.Contact).filter(and_(models.Contact.user_id == user.id, models.Contact.id == contact_id))
+    result = await db.execute(stmt)
+    return result.scalars().first()
 
-async def get_contacts(db: Session, user: models.User, skip: int = 0, limit: int = 10):
+async def get_contacts(db: AsyncSession, user: models.User, skip: int = 0, limit: int = 10,
+                       after_id: int | None = None):
     """
     Retrieves a list of contacts for a specific user with specified pagination parameters.
 
+    Contacts are ordered by id. When `after_id` is given, keyset pagination is used instead of `skip`:
+    only contacts with an id greater than `after_id` are returned, which lets the database seek
+    straight to the page through the `(user_id, id)` index.
+
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param user: The user to retrieve contacts for.
     :type user: User
-    :param skip: The number of contacts to skip.
+    :param skip: The number of contacts to skip. Ignored when `after_id` is given.
     :type skip: int
     :param limit: The maximum number of contactss to return.
     :type limit: int
-    :return: A list of contacts.
-    :rtype: List[models.Contact]
+    :param after_id: The id of the last contact of the previous page.
+    :type after_id: int | None
+    :return: A list of rows with the ``CONTACT_COLUMNS`` of each contact.
+    :rtype: list[Row]
     """
-    return db.query(models.Contact).filter(models.Contact.user_id == user.id).offset(skip).limit(limit).all()
+    stmt = select(*CONTACT_COLUMNS).filter(models.Contact.user_id == user.id).order_by(models.Contact.id)
+    if after_id is not None:
+        stmt = stmt.filter(models.Contact.id > after_id)
+    else:
+        stmt = stmt.offset(skip)
+    stmt = stmt.limit(limit)
+    result = await db.execute(stmt)
+    return result.all()
 
-async def update_contact(db: Session, contact_id: int, body: schemas.ContactUpdate, user: models.User):
+async def stream_contacts(db: AsyncSession, user: models.User, partition_size: int = 1000):
+    """
+    Streams all contacts of a specific user, ordered by id, through a server-side cursor.
+
+    Only plain column tuples are fetched, and at most ``partition_size`` of them are held at a time,
+    so memory use does not depend on the number of contacts.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param user: The user to retrieve contacts for.
+    :type user: User
+    :param partition_size: The number of rows fetched from the cursor at a time.
+    :type partition_size: int
+    :return: Lists of rows with the ``CONTACT_COLUMNS`` of each contact.
+    :rtype: AsyncIterator[list[Row]]
+    """
+    stmt = (
+        select(*CONTACT_COLUMNS)
+        .filter(models.Contact.user_id == user.id)
+        .order_by(models.Contact.id)
+        .execution_options(yield_per=partition_size)
+    )
+    result = await db.stream(stmt)
+    async for partition in result.partitions():
+        yield partition
+
+async def update_contact(db: AsyncSession, contact_id: int, body: schemas.ContactUpdate, user: models.User):
     """
     Update an existing contact for a specific user in the database.
 
-    The function searches for a contact by its ID and the associated user, updates the contact's details with 
-    the provided data, and commits the changes to the database.
+    All fields of the contact are replaced with the provided data in a single `UPDATE ... RETURNING`
+    statement scoped to the user, so the contact is not loaded first.
 
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param contact_id: The ID of the contact to be updated.
     :type contact_id: int
     :param contact: The schema containing the updated contact information.
     :type contact: schemas.ContactUpdate
     :param user: The user who owns the contact.
     :type user: models.User
-    :return: The updated contact object after being saved to the database.
+    :return: The updated contact object, or None if the user has no such contact.
     :rtype: models.Contact
 
     Process:
-        1. Query the database for the contact by its `contact_id` and `user_id`.
-        2. For each key-value pair in the `contact` schema, update the corresponding attribute of the `db_contact`.
-        3. Commit the changes to the database.
-        4. Return the updated `db_contact` object.
+        1. Update the row matching `contact_id` and `user_id`, returning it.
+        2. Commit the changes to the database.
+        3. Bump the user's contacts version and update the in-memory prefix index, if loaded.
+        4. Return the updated contact.
     """
-    db_contact = db.query(models.Contact).filter(and_(models.Contact.user_id == user.id, models.Contact.id == contact_id)).first()
-    if db_contact is None:
+    return await _update_contact(db, contact_id, body.model_dump(), user)
+
+async def patch_contact(db: AsyncSession, contact_id: int, body: schemas.ContactPatch, user: models.User):
+    """
+    Partially update an existing contact for a specific user in the database.
+
+    Only the fields present in the request are written, in a single `UPDATE ... RETURNING` statement.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param contact_id: The ID of the contact to be updated.
+    :type contact_id: int
+    :param body: The fields to change.
+    :type body: schemas.ContactPatch
+    :param user: The user who owns the contact.
+    :type user: models.User
+    :return: The updated contact object, or None if the user has no such contact.
+    :rtype: models.Contact
+    """
+    values = body.model_dump(exclude_unset=True)
+    if not values:
+        return await get_contact(db, contact_id, user)
+    return await _update_contact(db, contact_id, values, user)
+
+async def _update_contact(db: AsyncSession, contact_id: int, values: dict, user: models.User):
+    stmt = (
+        update(models.Contact)
+        .where(models.Contact.id == contact_id, models.Contact.user_id == user.id)
+        .values(**values)
+        .returning(models.Contact)
+    )
+    result = await db.execute(stmt)
+    contact = result.scalars().first()
+    if contact is None:
         return None
-    else:
-        for key, value in body.model_dump().items():
-            setattr(db_contact, key, value)
-        db.commit()
-        return db_contact
+    await db.commit()
+    previous, version = await contacts_version.bump(user.id)
+    prefix_index.contact_saved(user.id, contact, previous, version)
+    return contact
 
-async def delete_contact(db: Session, contact_id: int, user: models.User):
+async def delete_contact(db: AsyncSession, contact_id: int, user: models.User):
     """
     Delete an existing contact for a specific user from the database.
 
-    The function searches for a contact by its ID and the associated user, deletes the contact from the database, 
-    and commits the change.
+    The contact is deleted by its ID and the associated user in a single `DELETE ... RETURNING` statement,
+    which also returns the deleted row.
 
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param contact_id: The ID of the contact to be deleted.
     :type contact_id: int
     :param user: The user who owns the contact.
     :type user: models.User
-    :return: The contact object before it was deleted.
+    :return: The contact object before it was deleted, or None if the user has no such contact.
     :rtype: models.Contact
 
     Process:
-        1. Query the database for the contact by its `contact_id` and `user_id` to ensure it belongs to the user.
-        2. If the contact is found, delete it from the database.
-        3. Commit the changes to the database.
-        4. Return the `db_contact` object that was deleted.
+        1. Delete the row matching `contact_id` and `user_id`, returning it.
+        2. If a contact was deleted, record its tombstone and commit the changes to the database.
+        3. Bump the user's contacts version and remove the contact from the in-memory prefix index, if loaded.
+        4. Return the deleted contact.
     """
-    db_contact = db.query(models.Contact).filter(and_(models.Contact.user_id == user.id, models.Contact.id == contact_id)).first()
-    db.delete(db_contact)
-    db.commit()
+    stmt = (
+        delete(models.Contact)
+        .where(models.Contact.id == contact_id, models.Contact.user_id == user.id)
+        .returning(models.Contact)
+    )
+    result = await db.execute(stmt)
+    db_contact = result.scalars().first()
+    if db_contact is None:
+        return None
+    await db.execute(_tombstones(db, [{"id": contact_id, "user_id": user.id}]))
+    await db.commit()
+    previous, version = await contacts_version.bump(user.id)
+    prefix_index.contact_deleted(user.id, contact_id, previous, version)
     return db_contact
 
-async def search_contacts(db: Session, query: str, user: models.User):
+def _insert(db: AsyncSession):
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+def _tombstones(db: AsyncSession, rows):
+    # ids may be reused after a delete (SQLite), so an existing tombstone is moved forward instead
+    stmt = _insert(db)(models.ContactTombstone)
+    stmt = stmt.values(rows) if isinstance(rows, list) else stmt.from_select(["id", "user_id", "deleted_at"], rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.ContactTombstone.id],
+        set_={"user_id": stmt.excluded.user_id, "deleted_at": stmt.excluded.deleted_at},
+    )
+
+async def insert_contacts(db: AsyncSession, bodies: list[schemas.ContactCreate], user: models.User):
+    """
+    Insert a batch of contacts for a specific user in a single statement.
+
+    Contacts whose email is already taken are skipped by ``INSERT ... ON CONFLICT DO NOTHING`` instead of
+    failing the whole batch. A batch larger than ``MAX_CONTACT_IMPORT_BATCH_SIZE`` rows, which would exceed
+    the bind parameter limit of Postgres, is split into several statements in the same transaction. The
+    batch is committed before returning.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param bodies: The contacts to insert.
+    :type bodies: list[schemas.ContactCreate]
+    :param user: The user who owns the contacts.
+    :type user: models.User
+    :return: The id, first name, last name and email of every inserted contact.
+    :rtype: list[Row]
+
+    Process:
+        1. Build multi-row inserts, skipping rows that conflict on the unique email.
+        2. Execute them, returning the inserted rows, and commit.
+        3. Bump the user's contacts version and drop the in-memory prefix index, if any contact was inserted.
+    """
+    if not bodies:
+        return []
+    inserted = []
+    for start in range(0, len(bodies), MAX_CONTACT_IMPORT_BATCH_SIZE):
+        stmt = (
+            _insert(db)(models.Contact)
+            .values([{**body.model_dump(), "user_id": user.id}
+                     for body in bodies[start:start + MAX_CONTACT_IMPORT_BATCH_SIZE]])
+            .on_conflict_do_nothing(index_elements=[models.Contact.email])
+            .returning(models.Contact.id, models.Contact.first_name, models.Contact.last_name, models.Contact.email)
+        )
+        result = await db.execute(stmt)
+        inserted += result.all()
+    await db.commit()
+    if inserted:
+        await contacts_version.bump(user.id)
+        prefix_index.invalidate(user.id)
+    return inserted
+
+def _bulk_conditions(selection: schemas.ContactBulkFilter, user: models.User):
+    conditions = [models.Contact.user_id == user.id]
+    if selection.ids is not None:
+        conditions.append(models.Contact.id.in_(selection.ids))
+    for field in ("first_name", "last_name", "email", "phone_number"):
+        value = getattr(selection, field)
+        if value is not None:
+            conditions.append(getattr(models.Contact, field) == value)
+    return conditions
+
+async def update_contacts(db: AsyncSession, selection: schemas.ContactBulkFilter, values: schemas.ContactBulkValues,
+                          user: models.User):
+    """
+    Update all contacts of a specific user matching a filter with a single UPDATE statement.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param selection: The ids and/or field values the contacts must match.
+    :type selection: schemas.ContactBulkFilter
+    :param values: The fields to set; only the fields present in the request are changed.
+    :type values: schemas.ContactBulkValues
+    :param user: The user who owns the contacts.
+    :type user: models.User
+    :return: The number of updated contacts.
+    :rtype: int
+
+    Process:
+        1. Update the matching rows in one statement, without loading them.
+        2. Commit the changes to the database.
+        3. Bump the user's contacts version and drop the in-memory prefix index, if any contact changed.
+    """
+    stmt = (
+        update(models.Contact)
+        .where(*_bulk_conditions(selection, user))
+        .values(**values.model_dump(exclude_unset=True))
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(stmt)
+    await db.commit()
+    if result.rowcount:
+        await contacts_version.bump(user.id)
+        prefix_index.invalidate(user.id)
+    return result.rowcount
+
+async def delete_contacts(db: AsyncSession, selection: schemas.ContactBulkFilter, user: models.User):
+    """
+    Delete all contacts of a specific user matching a filter with a single DELETE statement.
+
+    A tombstone is recorded for every deleted contact in the same transaction, for clients syncing changes.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param selection: The ids and/or field values the contacts must match.
+    :type selection: schemas.ContactBulkFilter
+    :param user: The user who owns the contacts.
+    :type user: models.User
+    :return: The number of deleted contacts.
+    :rtype: int
+
+    Process:
+        1. Record tombstones for the matching rows with an `INSERT ... SELECT`.
+        2. Delete the matching rows in one statement, without loading them.
+        3. Commit the changes to the database.
+        4. Bump the user's contacts version and drop the in-memory prefix index, if any contact was deleted.
+    """
+    conditions = _bulk_conditions(selection, user)
+    deleted_at = literal(models.utcnow(), models.ContactTombstone.deleted_at.type)
+    await db.execute(_tombstones(db, select(models.Contact.id, models.Contact.user_id, deleted_at).where(*conditions)))
+    stmt = (
+        delete(models.Contact)
+        .where(*conditions)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(stmt)
+    await db.commit()
+    if result.rowcount:
+        await contacts_version.bump(user.id)
+        prefix_index.invalidate(user.id)
+    return result.rowcount
+
+async def get_changes(db: AsyncSession, user: models.User, since: tuple[datetime, int] | None = None,
+                      limit: int = 100):
+    """
+    Retrieve the contacts of a specific user created, updated or deleted after a sync position.
+
+    Live contacts are found through the `(user_id, updated_at)` index and deleted ones through their tombstones,
+    so the cost depends on the number of changes, not on the number of contacts. Changes younger than
+    ``settings.contacts_sync_settle_seconds`` are left for the next sync: a transaction still running may
+    commit a change with an older timestamp, which a position already past it would skip.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param user: The user whose changes are retrieved.
+    :type user: models.User
+    :param since: The time and id of the last change already synced, or None for a full sync, which lists
+        the live contacts only.
+    :type since: tuple[datetime, int] | None
+    :param limit: The maximum number of changes to return.
+    :type limit: int
+    :return: Up to ``limit + 1`` changes ordered by time and id, each with `id`, `changed_at`, `created`
+        and `deleted` (an extra row means more changes follow), and the time up to which changes were read.
+    :rtype: tuple[list[Row], datetime]
+    """
+    settled = models.utcnow() - timedelta(seconds=settings.contacts_sync_settle_seconds)
+    contact, tombstone = models.Contact, models.ContactTombstone
+
+    def changed_after(changed_at, id):
+        conditions = [changed_at < settled]
+        if since is not None:
+            # the plain comparison bounds the index range, the row comparison breaks ties by id
+            conditions += [changed_at >= since[0], tuple_(changed_at, id) > tuple_(*since)]
+        return conditions
+
+    created = tuple_(contact.created_at, contact.id) > tuple_(*since) if since is not None else true()
+    live = (
+        select(contact.id, contact.updated_at.label("changed_at"), created.label("created"),
+               literal(False).label("deleted"))
+        .where(contact.user_id == user.id, *changed_after(contact.updated_at, contact.id))
+    )
+    deleted = (
+        select(tombstone.id, tombstone.deleted_at.label("changed_at"), literal(False).label("created"),
+               literal(True).label("deleted"))
+        .where(tombstone.user_id == user.id, *changed_after(tombstone.deleted_at, tombstone.id))
+    )
+    # a full sync has no use for the deletions of contacts the client never had
+    changes = (union_all(live, deleted) if since is not None else live).subquery()
+    stmt = select(changes).order_by(changes.c.changed_at, changes.c.id).limit(limit + 1)
+    result = await db.execute(stmt)
+    return result.all(), settled
+
+async def search_contacts_ranked(db: AsyncSession, query: str, user: models.User, limit: int = 100,
+                                 after: tuple[float, int] | None = None):
+    """
+    Search for contacts that match a query string and rank them by relevance.
+
+    A contact matches when its first name, last name, or email contains the query string, case-insensitively.
+    Its relevance is the best trigram similarity between the query and one of those fields. On Postgres,
+    the match is an ILIKE served by the `pg_trgm` GIN indexes and the rank is computed by `similarity()`.
+    Other databases fall back to matching and ranking the user's contacts in Python.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param query: The search string to match against the contact's first name, last name, or email.
+    :type query: str
+    :param user: The user whose contacts are being searched.
+    :type user: models.User
+    :param limit: The maximum number of contacts to return.
+    :type limit: int
+    :param after: The rank and id of the last contact of the previous page.
+    :type after: tuple[float, int] | None
+    :return: Pairs of a matching contact, as a row with its ``CONTACT_COLUMNS``, and its rank, the most
+        relevant first and ties ordered by id.
+    :rtype: list[tuple[Row, float]]
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        rank = func.greatest(
+            func.similarity(models.Contact.first_name, query),
+            func.similarity(models.Contact.last_name, query),
+            func.similarity(models.Contact.email, query),
+        )
+        # wildcards typed by the user are matched literally; ILIKE is kept so the trigram indexes serve the match
+        pattern = "%" + query.replace("/", "//").replace("%", "/%").replace("_", "/_") + "%"
+        stmt = select(*CONTACT_COLUMNS, rank).filter(models.Contact.user_id == user.id).filter(
+            models.Contact.first_name.ilike(pattern, escape="/") |
+            models.Contact.last_name.ilike(pattern, escape="/") |
+            models.Contact.email.ilike(pattern, escape="/")
+        )
+        if after is not None:
+            stmt = stmt.filter(or_(rank < after[0], and_(rank == after[0], models.Contact.id > after[1])))
+        stmt = stmt.order_by(rank.desc(), models.Contact.id).limit(limit)
+        result = await db.execute(stmt)
+        return [(row, row[-1]) for row in result.all()]
+
+    result = await db.execute(select(*CONTACT_COLUMNS).filter(models.Contact.user_id == user.id).order_by(models.Contact.id))
+    needle = query.lower()
+    ranked = []
+    for contact in result.all():
+        fields = [field or "" for field in (contact.first_name, contact.last_name, contact.email)]
+        if any(needle in field.lower() for field in fields):
+            ranked.append((contact, max(similarity(field, query) for field in fields)))
+    # The sort is stable, so ties keep their id order
+    ranked.sort(key=lambda item: -item[1])
+    if after is not None:
+        ranked = [(contact, contact_rank) for contact, contact_rank in ranked
+                  if contact_rank < after[0] or (contact_rank == after[0] and contact.id > after[1])]
+    return ranked[:limit]
+
+async def search_contacts(db: AsyncSession, query: str, user: models.User, limit: int = 100,
+                          after: tuple[float, int] | None = None):
     """
     Search for contacts that match a query string for a specific user in the database.
 
     The function searches the user's contacts by first name, last name, or email, using a case-insensitive 
-    match (ILIKE) for the given query string.
+    substring match for the given query string. See :func:`search_contacts_ranked` for the ranking.
 
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param query: The search string to match against the contact's first name, last name, or email.
     :type query: str
     :param user: The user whose contacts are being searched.
     :type user: models.User
-    :return: A list of contacts that match the search query.
-    :rtype: list[models.Contact]
+    :param limit: The maximum number of contacts to return.
+    :type limit: int
+    :param after: The rank and id of the last contact of the previous page.
+    :type after: tuple[float, int] | None
+    :return: A list of rows with the ``CONTACT_COLUMNS`` of the contacts that match the search query,
+        the most relevant first.
+    :rtype: list[Row]
+    """
+    return [contact for contact, _ in await search_contacts_ranked(db, query, user, limit, after)]
 
-    Process:
-        1. Query the database for contacts associated with the user.
-        2. Apply case-insensitive filters on the `first_name`, `last_name`, and `email` fields to match the `query`.
-        3. Return all matching contacts.
+async def suggest_contacts(db: AsyncSession, prefix: str, user: models.User, limit: int = 10):
     """
-    return db.query(models.Contact).filter(models.Contact.user_id == user.id).filter(
-        models.Contact.first_name.ilike(f"%{query}%") |
-        models.Contact.last_name.ilike(f"%{query}%") |
-        models.Contact.email.ilike(f"%{query}%")
-    ).all()
+    Suggest contacts whose first name, last name, full name or email starts with a prefix.
+
+    Suggestions are answered from the user's in-memory prefix index, which is built from the database on
+    the first call and rebuilt whenever the user's shared contacts version shows a write the index has not
+    seen, e.g. one handled by another worker. Contacts read from a replica shortly after a write may miss
+    it, so they only answer the current call and are not kept as the user's index. When the prefix index is
+    disabled, the database search is used instead.
 
-async def get_birthdays_in_next_7_days(db: Session, user: models.User):
+    :param db: The database session.
+    :type db: AsyncSession
+    :param prefix: The prefix typed by the user.
+    :type prefix: str
+    :param user: The user whose contacts are being suggested.
+    :type user: models.User
+    :param limit: The maximum number of suggestions to return.
+    :type limit: int
+    :return: The suggested contacts as dicts with id, first_name, last_name and email.
+    :rtype: list[dict]
     """
-    Retrieve contacts whose birthdays fall within the next 7 days for a specific user.
+    if not prefix_index.enabled:
+        contacts = await search_contacts(db, prefix, user, limit)
+        return [{"id": contact.id, "first_name": contact.first_name, "last_name": contact.last_name,
+                 "email": contact.email} for contact in contacts]
+    version = await contacts_version.get(user.id)
+    index = prefix_index.get(user.id, version)
+    if index is None:
+        replica_router.follow_writes(db, version)
+        result = await db.execute(select(models.Contact.id, models.Contact.first_name, models.Contact.last_name,
+                                         models.Contact.email).filter(models.Contact.user_id == user.id))
+        if contacts_version.can_tag(version, db):
+            index = prefix_index.put(user.id, result.all(), version)
+        else:
+            index = UserPrefixIndex(result.all())
+    return index.search(prefix, limit)
 
-    The function filters the user's contacts to find those whose birthdays are between the current date
-    and 7 days from now.
+def month_day_window(today: date, days: int):
+    """
+    Compute the month-day bounds (see `models.month_day`) of a window of `days` days starting today.
+
+    In common years, February 29th birthdays are treated as falling between February 28th and March 1st,
+    so they show up in any window that contains March 1st.
+
+    :param today: The first day of the window.
+    :type today: date
+    :param days: The number of days after `today` that still belong to the window.
+    :type days: int
+    :return: The first and the last month-day of the window. The first is greater than the last
+        when the window wraps past December 31st.
+    :rtype: tuple[int, int]
+    """
+    if days >= 365:
+        return 101, 1231
+    end = today + timedelta(days=days)
+    start_md = today.month * 100 + today.day
+    end_md = end.month * 100 + end.day
+    if start_md == 301 and not calendar.isleap(today.year):
+        start_md = 229
+    return start_md, end_md
+
+async def get_upcoming_birthdays(db: AsyncSession, user: models.User, days: int = 7):
+    """
+    Retrieve contacts whose birthdays fall within the next `days` days for a specific user.
+
+    The filter runs in the database on the month and day of the birthday, so only matching rows are
+    loaded, and it is served by the `(user_id, month_day(birthday))` index.
 
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param user: The user whose contacts are being searched.
     :type user: models.User
-    :return: A list of contacts with birthdays in the next 7 days.
-    :rtype: List[models.Contact]
+    :param days: The size of the window in days, starting today.
+    :type days: int
+    :return: A list of rows with the ``CONTACT_COLUMNS`` of the contacts with upcoming birthdays,
+        the nearest birthday first.
+    :rtype: list[Row]
 
     Process:
-        1. Retrieve the current date and the date 7 days from now.
-        2. Fetch all contacts for the user from the database.
-        3. Check if the contacts' birthdays fall within the range from today to 7 days ahead.
-        4. Return a list of contacts with upcoming birthdays.
-    """
-    today = datetime.now().date()
-    next_week = today + timedelta(days=7)    
-    contacts = db.query(models.Contact).filter(models.Contact.user_id == user.id).all()
-    if contacts is None:
-        return None
+        1. Compute the month-day bounds of the window, wrapping around the end of the year if needed.
+        2. Select the user's contacts whose birthday month-day is within the bounds.
+        3. Order them by the next occurrence of the birthday.
+    """
+    in_window, next_birthday = _birthday_window(datetime.now().date(), days)
+    stmt = select(*CONTACT_COLUMNS).filter(models.Contact.user_id == user.id, in_window)\
+        .order_by(*next_birthday)
+    result = await db.execute(stmt)
+    return result.all()
+
+def _birthday_window(today: date, days: int):
+    # the condition selecting birthdays in the window, and the ORDER BY putting the nearest one first
+    start_md, end_md = month_day_window(today, days)
+    md = models.month_day(models.Contact.birthday)
+    if start_md <= end_md:
+        in_window = md.between(start_md, end_md)
     else:
-        upcoming_birthdays = [contact for contact in contacts if today <= contact.birthday.replace(year=today.year) <= next_week]
-        if upcoming_birthdays is None:
-            return None
-        else:
-            upcoming_birthdays = [contact for contact in contacts if today <= contact.birthday.replace(year=today.year) <= next_week]
-            return upcoming_birthdays
+        in_window = or_(md >= start_md, md <= end_md)
+    return in_window, (case((md < start_md, 1), else_=0), md)
+
+async def stream_upcoming_birthdays_by_user(db: AsyncSession, days: int = 7, today: date | None = None,
+                                            partition_size: int = 1000):
+    """
+    Streams the contacts with birthdays within the next `days` days of all confirmed users, grouped by user.
+
+    A single query over all users replaces one `get_upcoming_birthdays` query per user. Rows are read
+    through a server-side cursor, ordered by user, ``partition_size`` at a time, and the contacts of a user
+    are yielded together once the next user's rows start.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param days: The size of the window in days, starting today.
+    :type days: int
+    :param today: The first day of the window, the current date by default.
+    :type today: date | None
+    :param partition_size: The number of rows fetched from the cursor at a time.
+    :type partition_size: int
+    :return: For each user with upcoming birthdays, the user's id, email and username, and the values of the
+        ``CONTACT_COLUMNS`` of the contacts, the nearest birthday first.
+    :rtype: AsyncIterator[tuple[tuple, list[tuple]]]
+    """
+    in_window, next_birthday = _birthday_window(today or datetime.now().date(), days)
+    stmt = (
+        select(models.User.id, models.User.email, models.User.username, *CONTACT_COLUMNS)
+        .join(models.Contact, models.Contact.user_id == models.User.id)
+        .filter(models.User.confirmed.is_(True), in_window)
+        .order_by(models.User.id, *next_birthday)
+        .execution_options(yield_per=partition_size)
+    )
+    result = await db.stream(stmt)
+    user, contacts = None, []
+    async for partition in result.partitions():
+        for row in partition:
+            if user is None or row[0] != user[0]:
+                if user is not None:
+                    yield user, contacts
+                user, contacts = row[:3], []
+            contacts.append(row[3:])
+    if user is not None:
+        yield user, contacts
+
+async def get_birthdays_in_next_7_days(db: AsyncSession, user: models.User):
+    """
+    Retrieve contacts whose birthdays fall within the next 7 days for a specific user.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param user: The user whose contacts are being searched.
+    :type user: models.User
+    :return: A list of rows with the ``CONTACT_COLUMNS`` of the contacts with birthdays in the next 7 days.
+    :rtype: list[Row]
+    """
+    return await get_upcoming_birthdays(db, user, days=7)
@@ -0,0 +1,144 @@
+from datetime import timedelta
+
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import EmailOutbox, utcnow
+
+
+def _insert(db: AsyncSession):
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+
+async def enqueue_email(db: AsyncSession, kind: str, recipient: str, payload: dict, commit: bool = True) -> bool:
+    """
+    Add an email to the outbox, unless the same kind of email is already waiting for the recipient.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param kind: The kind of email, which picks its subject and template.
+    :type kind: str
+    :param recipient: The recipient's email address.
+    :type recipient: str
+    :param payload: The values the email is rendered with.
+    :type payload: dict
+    :param commit: Whether to commit, or leave the email in the caller's transaction.
+    :type commit: bool
+    :return: True if the email was queued, False if a pending one was already there.
+    :rtype: bool
+    """
+    return await enqueue_emails(db, kind, [(recipient, payload)], commit=commit) > 0
+
+
+async def enqueue_emails(db: AsyncSession, kind: str, emails: list[tuple[str, dict]], replace: bool = False,
+                         commit: bool = True) -> int:
+    """
+    Add emails of the same kind to the outbox with a single INSERT statement.
+
+    An email of the same kind already waiting for a recipient is kept as is, or gets the new payload
+    when ``replace`` is set, e.g. so a digest still unsent from a previous run is sent with current data.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param kind: The kind of the emails, which picks their subject and template.
+    :type kind: str
+    :param emails: The recipient's email address and the payload of each email, at most one per recipient.
+    :type emails: list[tuple[str, dict]]
+    :param replace: Whether to replace the payload of pending emails.
+    :type replace: bool
+    :param commit: Whether to commit, or leave the emails in the caller's transaction.
+    :type commit: bool
+    :return: The number of emails queued or replaced.
+    :rtype: int
+    """
+    if not emails:
+        return 0
+    now = utcnow()
+    stmt = _insert(db)(EmailOutbox).values([
+        {"kind": kind, "recipient": recipient, "payload": payload, "status": "pending", "attempts": 0,
+         "send_after": now, "created_at": now}
+        for recipient, payload in emails
+    ])
+    # the predicate is a literal, as Postgres cannot match a bound parameter against the partial unique index
+    conflict = {"index_elements": [EmailOutbox.kind, EmailOutbox.recipient],
+                "index_where": text("status = 'pending'")}
+    if replace:
+        stmt = stmt.on_conflict_do_update(**conflict, set_={"payload": stmt.excluded.payload})
+    else:
+        stmt = stmt.on_conflict_do_nothing(**conflict)
+    result = await db.execute(stmt)
+    if commit:
+        await db.commit()
+    return result.rowcount
+
+
+async def claim_emails(db: AsyncSession, limit: int, lease_seconds: float) -> list:
+    """
+    Claim the pending emails that are due, oldest first, and count the attempt.
+
+    Claimed emails are not due again until the lease ends, so a worker that dies before recording the result
+    leaves them to be retried. Rows claimed by a concurrent worker are skipped rather than waited for.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param limit: The maximum number of emails to claim.
+    :type limit: int
+    :param lease_seconds: How long the claim lasts.
+    :type lease_seconds: float
+    :return: Rows with the id, kind, recipient, payload and attempt number of each claimed email.
+    :rtype: list
+    """
+    now = utcnow()
+    due = (
+        select(EmailOutbox.id)
+        .where(EmailOutbox.status == "pending", EmailOutbox.send_after <= now)
+        .order_by(EmailOutbox.send_after)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(EmailOutbox)
+        .where(EmailOutbox.id.in_(due.scalar_subquery()))
+        .values(attempts=EmailOutbox.attempts + 1, send_after=now + timedelta(seconds=lease_seconds))
+        .returning(EmailOutbox.id, EmailOutbox.kind, EmailOutbox.recipient, EmailOutbox.payload,
+                   EmailOutbox.attempts)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(stmt)
+    rows = result.all()
+    await db.commit()
+    return rows
+
+
+async def record_results(db: AsyncSession, sent: list[int], failures: list[tuple[int, str, float | None]]) -> None:
+    """
+    Record the outcome of a batch of claimed emails in one transaction.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param sent: The ids of the emails that were sent.
+    :type sent: list[int]
+    :param failures: The id of each email that was not sent, the error, and the seconds until the next attempt,
+        or None to give up on it.
+    :type failures: list[tuple[int, str, float | None]]
+    :return: None
+    """
+    now = utcnow()
+    if sent:
+        await db.execute(
+            update(EmailOutbox).where(EmailOutbox.id.in_(sent))
+            .values(status="sent", sent_at=now, last_error=None)
+            .execution_options(synchronize_session=False)
+        )
+    for email_id, error, retry_in in failures:
+        values = {"last_error": error[:500]}
+        if retry_in is None:
+            values["status"] = "failed"
+        else:
+            values["send_after"] = now + timedelta(seconds=retry_in)
+        await db.execute(
+            update(EmailOutbox).where(EmailOutbox.id == email_id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
@@ -1,31 +1,40 @@
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from models import User
+from repository import outbox as repository_outbox
 from schemas import UserModel
+from services.user_cache import user_cache
 
-async def get_user_by_email(email: str, db: Session) -> User:
+async def get_user_by_email(email: str, db: AsyncSession) -> User:
     """
     Retrieve a user from the database by their email.
 
     :param email: The email address of the user.
     :type email: str
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :return: The user that matches the provided email, or None if not found.
     :rtype: User
     """
-    return db.query(User).filter(User.email == email).first()
+    result = await db.execute(select(User).filter(User.email == email))
+    return result.scalars().first()
 
 
-async def create_user(body: UserModel, db: Session) -> User:
+async def create_user(body: UserModel, db: AsyncSession, email: tuple[str, dict] | None = None) -> User:
     """
     Create a new user in the database and set their avatar from Gravatar if available.
 
+    An email to the user, e.g. the confirmation email, can be queued in the outbox in the same transaction,
+    so the user is never created without it.
+
     :param body: The data for creating the user, including email and password.
     :type body: UserModel
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
+    :param email: The kind and payload of an email to queue for the user.
+    :type email: tuple[str, dict] | None
     :return: The newly created user with the avatar URL from Gravatar.
     :rtype: User
     """
@@ -37,56 +46,65 @@ async def create_user(body: UserModel, db: Session) -> User:
         print(e)
     new_user = User(**body.model_dump(), avatar=avatar)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    if email is not None:
+        kind, payload = email
+        await repository_outbox.enqueue_email(db, kind, new_user.email, payload, commit=False)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 
-async def update_token(user: User, token: str | None, db: Session) -> None:
+async def update_token(user: User, token: str | None, db: AsyncSession) -> None:
     """
     Update the refresh token for a user.
 
+    Invalidating the token logs the user out, so the user is also dropped from the user cache.
+
     :param user: The user whose token needs to be updated.
     :type user: User
     :param token: The new refresh token, or None to invalidate it.
     :type token: str | None
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :return: None
     """
     user.refresh_token = token
-    db.commit()
+    await db.commit()
+    if token is None:
+        await user_cache.invalidate(user.email)
 
-async def confirmed_email(email: str, db: Session) -> None:
+async def confirmed_email(email: str, db: AsyncSession) -> None:
     """
-    Mark a user's email as confirmed in the database.
+    Mark a user's email as confirmed in the database and drop the user from the user cache.
 
     :param email: The email address of the user to confirm.
     :type email: str
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :return: None
     """
     user = await get_user_by_email(email, db)
     user.confirmed = True
-    db.commit()
+    await db.commit()
+    await user_cache.invalidate(email)
 
-async def update_avatar(email, url: str, db: Session) -> User:
+async def update_avatar(email, url: str, db: AsyncSession) -> User:
     """
-    Update the avatar URL for a user.
+    Update the avatar URL for a user and drop the user from the user cache.
 
     :param email: The email address of the user.
     :type email: str
     :param url: The new avatar URL to set for the user.
     :type url: str
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :return: The updated user with the new avatar URL.
     :rtype: User
     """
     user = await get_user_by_email(email, db)
     user.avatar = url
-    db.commit()
+    await db.commit()
+    await user_cache.invalidate(email)
     return user
 
 
@@ -1,14 +1,22 @@
 from fastapi import Depends, HTTPException
-from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Depends, status, Request, Response, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
+from typing import List, Optional
 
 from repository import contacts as repository_contacts
 import models, schemas
-from db import get_db
+from db import get_db, get_read_db, read_session, replica_router
 from services.auth import auth_service
+from services.contact_export import export_contacts, FORMATS as EXPORT_FORMATS
+from services.contact_import import import_contacts
+from services.rate_limit import RateLimit
+from services.etag import contacts_version, if_none_match, not_modified
+from services.result_cache import result_cache
+from services.serialization import contacts_body, json_response
+from services.pagination import (encode_cursor, decode_cursor, decode_ranked_cursor, encode_sync_token,
+                                decode_sync_token, NEXT_CURSOR_HEADER)
 
 
 router = APIRouter(prefix='/contacts', tags=["contacts"])
@@ -16,7 +24,7 @@ router = APIRouter(prefix='/contacts', tags=["contacts"])
 
 # Создать новый контакт
 @router.post("/", response_model=schemas.ContactResponse)
-async def create_contact(contact: schemas.ContactCreate, db: Session = Depends(get_db), 
+async def create_contact(contact: schemas.ContactCreate, db: AsyncSession = Depends(get_db), 
                          current_user: models.User = Depends(auth_service.get_current_user)):
     """
     Create a new contact for the authenticated user.
@@ -24,7 +32,7 @@ async def create_contact(contact: schemas.ContactCreate, db: Session = Depends(g
     :param contact: The contact information to be created.
     :type contact: schemas.ContactCreate
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param current_user: The currently authenticated user.
     :type current_user: models.User
     :return: The created contact information.
@@ -32,53 +40,259 @@ async def create_contact(contact: schemas.ContactCreate, db: Session = Depends(g
     """
     return await repository_contacts.create_contact(db, contact, current_user)
 
+# Импорт контактов из CSV или NDJSON
+@router.post("/bulk", response_model=schemas.ContactImportReport)
+async def bulk_create_contacts(request: Request, db: AsyncSession = Depends(get_db),
+                               current_user: models.User = Depends(auth_service.get_current_user)):
+    """
+    Import contacts for the authenticated user from a CSV or NDJSON file sent as the request body.
+
+    The body is read as it arrives: a `text/csv` file with a header row naming the contact fields, or an
+    `application/x-ndjson` file with one contact object per line. Valid rows are inserted in batches;
+    invalid rows and rows whose email already exists are skipped and listed in the report.
+
+    :param request: The incoming request, whose body is the file.
+    :type request: Request
+    :param db: The database session.
+    :type db: AsyncSession
+    :param current_user: The currently authenticated user.
+    :type current_user: models.User
+    :return: The number of imported and failed rows, and the errors of the failed rows.
+    :rtype: schemas.ContactImportReport
+    :raises HTTPException: If the content type is not supported (415), a row is too long (413)
+        or the file is not UTF-8 (400).
+    """
+    return await import_contacts(db, request.stream(), request.headers.get("content-type", ""), current_user)
+
+# Обновить несколько контактов
+@router.patch("/bulk", response_model=schemas.ContactBulkResult)
+async def bulk_update_contacts(body: schemas.ContactBulkUpdate, db: AsyncSession = Depends(get_db),
+                               current_user: models.User = Depends(auth_service.get_current_user)):
+    """
+    Update all contacts of the authenticated user matching a filter, in a single statement.
+
+    :param body: The filter the contacts must match (ids and/or field values) and the fields to set.
+    :type body: schemas.ContactBulkUpdate
+    :param db: The database session.
+    :type db: AsyncSession
+    :param current_user: The currently authenticated user.
+    :type current_user: models.User
+    :return: The number of updated contacts.
+    :rtype: schemas.ContactBulkResult
+    """
+    affected = await repository_contacts.update_contacts(db, body.filter, body.values, current_user)
+    return {"affected": affected}
+
+# Удалить несколько контактов
+@router.delete("/bulk", response_model=schemas.ContactBulkResult)
+async def bulk_delete_contacts(body: schemas.ContactBulkFilter, db: AsyncSession = Depends(get_db),
+                               current_user: models.User = Depends(auth_service.get_current_user)):
+    """
+    Delete all contacts of the authenticated user matching a filter, in a single statement.
+
+    :param body: The filter the contacts must match: ids and/or field values.
+    :type body: schemas.ContactBulkFilter
+    :param db: The database session.
+    :type db: AsyncSession
+    :param current_user: The currently authenticated user.
+    :type current_user: models.User
+    :return: The number of deleted contacts.
+    :rtype: schemas.ContactBulkResult
+    """
+    affected = await repository_contacts.delete_contacts(db, body, current_user)
+    return {"affected": affected}
+
 # Получить список всех контактов
 @router.get("/", response_model=List[schemas.ContactResponse], description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
-                     current_user: models.User = Depends(auth_service.get_current_user)):
+            dependencies=[Depends(RateLimit(times=10, seconds=60))])
+async def read_contacts(request: Request, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                        db: AsyncSession = Depends(get_read_db),
+                        current_user: models.User = Depends(auth_service.get_current_user)):
     """
     Retrieve a list of contacts for the authenticated user, with optional pagination.
 
-    :param skip: The number of contacts to skip for pagination.
+    Pages can be requested either with `skip`/`limit` or with an opaque `cursor`. When a full page is
+    returned, the cursor for the next page is sent in the `X-Next-Cursor` response header. The page is
+    read as plain rows and serialized in bulk, see :func:`services.serialization.contacts_body`, and
+    cached until a contact of the user changes, see :class:`services.result_cache.ResultCache`.
+
+    The response carries an `ETag` that changes whenever any contact of the user changes. A request with
+    a matching `If-None-Match` header is answered with 304 Not Modified without reading the contacts.
+
+    :param request: The incoming request, with the optional `If-None-Match` header.
+    :type request: Request
+    :param skip: The number of contacts to skip for pagination. Ignored when `cursor` is given.
     :type skip: int
     :param limit: The maximum number of contacts to return.
     :type limit: int
+    :param cursor: The cursor from the `X-Next-Cursor` header of the previous page.
+    :type cursor: Optional[str]
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param current_user: The currently authenticated user.
     :type current_user: models.User
     :return: A list of contacts.
-    :rtype: List[schemas.ContactResponse]
+    :rtype: Response
+    :raises HTTPException: If the cursor is malformed (400).
+    """
+    after_id = decode_cursor(cursor) if cursor else None
+    version = await contacts_version.get(current_user.id)
+    replica_router.follow_writes(db, version)
+    etag = contacts_version.etag(version)
+    if if_none_match(request, etag):
+        return not_modified(etag)
+
+    async def fill():
+        contacts = await repository_contacts.get_contacts(db, current_user, skip, limit, after_id=after_id)
+        headers = {}
+        if contacts and len(contacts) == limit:
+            headers[NEXT_CURSOR_HEADER] = encode_cursor(contacts[-1].id)
+        fresh = contacts_version.can_tag(version, db)
+        if fresh:
+            headers["ETag"] = etag
+        return contacts_body(contacts), headers, fresh
+
+    # skip is ignored after a cursor
+    params = {"skip": skip if after_id is None else 0, "limit": limit, "after_id": after_id}
+    key = result_cache.key(current_user.id, version, "list", params)
+    return json_response(*await result_cache.get_or_fill(key, fill))
+
+# Подсказки по началу имени, фамилии или email
+@router.get("/suggest", response_model=List[schemas.ContactSuggestion])
+async def suggest_contacts(prefix: str = Query(min_length=1), limit: int = Query(10, ge=1, le=50),
+                           db: AsyncSession = Depends(get_read_db),
+                           current_user: models.User = Depends(auth_service.get_current_user)):
     """
-    contacts = await repository_contacts.get_contacts(db, current_user, skip, limit)
-    return contacts
+    Suggest contacts whose first name, last name, full name or email starts with the prefix, for autocomplete.
+
+    Answers from an in-memory prefix index of the authenticated user's contacts.
+
+    :param prefix: The beginning of the name or email typed by the user.
+    :type prefix: str
+    :param limit: The maximum number of suggestions to return.
+    :type limit: int
+    :param db: The database session.
+    :type db: AsyncSession
+    :param current_user: The currently authenticated user.
+    :type current_user: models.User
+    :return: A list of suggested contacts.
+    :rtype: List[schemas.ContactSuggestion]
+    """
+    return await repository_contacts.suggest_contacts(db, prefix, current_user, limit)
+
+# Выгрузка всех контактов
+@router.get("/export", response_class=StreamingResponse)
+async def export_all_contacts(request: Request, format: str = Query("csv", pattern="^(csv|ndjson|vcard)$"),
+                              current_user: models.User = Depends(auth_service.get_current_user)):
+    """
+    Export all contacts of the authenticated user as a CSV, NDJSON or vCard file.
+
+    The file is streamed while the contacts are read from the database, so the response starts right away
+    and memory use does not depend on the number of contacts.
+
+    :param request: The incoming request, used to route the export to a read replica.
+    :type request: Request
+    :param format: The file format: `csv` (default), `ndjson` or `vcard`.
+    :type format: str
+    :param current_user: The currently authenticated user.
+    :type current_user: models.User
+    :return: The file, sent as an attachment.
+    :rtype: StreamingResponse
+    """
+    media_type, extension, _ = EXPORT_FORMATS[format]
+    client_key = replica_router.client_key(request)
+    version = await contacts_version.get(current_user.id)
+
+    # the request's session is closed before the response is sent, so the stream opens its own
+    async def content():
+        async with read_session(client_key, version) as db:
+            async for chunk in export_contacts(db, current_user, format):
+                yield chunk
+
+    return StreamingResponse(content(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="contacts.{extension}"'})
+
+# Изменения контактов с последней синхронизации
+@router.get("/changes", response_model=schemas.ContactChanges)
+async def read_contact_changes(since: Optional[str] = None, limit: int = Query(500, ge=1, le=1000),
+                               db: AsyncSession = Depends(get_db),
+                               current_user: models.User = Depends(auth_service.get_current_user)):
+    """
+    Retrieve the ids of the contacts created, updated or deleted since the last sync of the authenticated user.
+
+    Without `since`, every contact is reported as created. Each response carries a `next_token` to pass as
+    `since` next time; while `has_more` is true, more changes can be fetched right away. An id appears in one
+    list only, the one of its latest change. Changes are read from the primary database, as a replica
+    lagging behind could make the client skip them.
+
+    :param since: The `next_token` of the previous response.
+    :type since: Optional[str]
+    :param limit: The maximum number of changes to return.
+    :type limit: int
+    :param db: The database session.
+    :type db: AsyncSession
+    :param current_user: The currently authenticated user.
+    :type current_user: models.User
+    :return: The ids of the changed contacts and the token for the next sync.
+    :rtype: schemas.ContactChanges
+    :raises HTTPException: If the sync token is malformed (400).
+    """
+    position = decode_sync_token(since) if since else None
+    rows, settled = await repository_contacts.get_changes(db, current_user, position, limit)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        next_token = encode_sync_token(rows[-1].changed_at, rows[-1].id)
+    else:
+        # everything before the settle time was read, the next sync starts from there
+        next_token = encode_sync_token(settled, 0)
+    changes = schemas.ContactChanges(next_token=next_token, has_more=has_more)
+    # a later change of the same id replaces an earlier one
+    latest = {row.id: "deleted" if row.deleted else "created" if row.created else "updated" for row in rows}
+    for contact_id, change in latest.items():
+        getattr(changes, change).append(contact_id)
+    return changes
 
 # Получить один контакт по идентификатору
 @router.get("/{contact_id}", response_model=schemas.ContactResponse)
-async def read_contact(contact_id: int, db: Session = Depends(get_db), 
-                         current_user: models.User = Depends(auth_service.get_current_user)):
+async def read_contact(contact_id: int, request: Request, response: Response,
+                       db: AsyncSession = Depends(get_read_db),
+                       current_user: models.User = Depends(auth_service.get_current_user)):
     """
     Retrieve a contact by its ID for the authenticated user.
 
+    The response carries an `ETag` that changes whenever any contact of the user changes. A request with
+    a matching `If-None-Match` header is answered with 304 Not Modified without reading the contact.
+
     :param contact_id: The ID of the contact to retrieve.
     :type contact_id: int
+    :param request: The incoming request, with the optional `If-None-Match` header.
+    :type request: Request
+    :param response: The outgoing response, used to set the ETag header.
+    :type response: Response
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param current_user: The currently authenticated user.
     :type current_user: models.User
     :return: The contact information.
     :rtype: schemas.ContactResponse
     :raises HTTPException: If the contact is not found (404).
     """
+    version = await contacts_version.get(current_user.id)
+    replica_router.follow_writes(db, version)
+    etag = contacts_version.etag(version)
+    if if_none_match(request, etag):
+        return not_modified(etag)
     db_contact = await repository_contacts.get_contact(db, contact_id, current_user)
     if db_contact is None:
         raise HTTPException(status_code=404, detail="Contact not found")
+    if contacts_version.can_tag(version, db):
+        response.headers["ETag"] = etag
     return db_contact
 
 # Обновить контакт
 @router.put("/{contact_id}", response_model=schemas.ContactResponse)
-async def update_contact(contact_id: int, contact: schemas.ContactUpdate, db: Session = Depends(get_db), 
+async def update_contact(contact_id: int, contact: schemas.ContactUpdate, db: AsyncSession = Depends(get_db), 
                          current_user: models.User = Depends(auth_service.get_current_user)):
     """
     Update the details of an existing contact for the authenticated user.
@@ -88,7 +302,7 @@ async def update_contact(contact_id: int, contact: schemas.ContactUpdate, db: Se
     :param contact: The updated contact data.
     :type contact: schemas.ContactUpdate
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param current_user: The currently authenticated user.
     :type current_user: models.User
     :return: The updated contact information.
@@ -100,9 +314,33 @@ async def update_contact(contact_id: int, contact: schemas.ContactUpdate, db: Se
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
     return contact
 
+# Частично обновить контакт
+@router.patch("/{contact_id}", response_model=schemas.ContactResponse)
+async def patch_contact(contact_id: int, contact: schemas.ContactPatch, db: AsyncSession = Depends(get_db),
+                        current_user: models.User = Depends(auth_service.get_current_user)):
+    """
+    Update only the given fields of an existing contact for the authenticated user.
+
+    :param contact_id: The ID of the contact to update.
+    :type contact_id: int
+    :param contact: The fields to change; omitted fields keep their values.
+    :type contact: schemas.ContactPatch
+    :param db: The database session.
+    :type db: AsyncSession
+    :param current_user: The currently authenticated user.
+    :type current_user: models.User
+    :return: The updated contact information.
+    :rtype: schemas.ContactResponse
+    :raises HTTPException: If the contact is not found (404).
+    """
+    contact = await repository_contacts.patch_contact(db, contact_id, contact, current_user)
+    if contact is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
+    return contact
+
 # Удалить контакт
 @router.delete("/{contact_id}")
-async def delete_contact(contact_id: int, db: Session = Depends(get_db), 
+async def delete_contact(contact_id: int, db: AsyncSession = Depends(get_db), 
                          current_user: models.User = Depends(auth_service.get_current_user)):
     """
     Delete a contact by its ID for the authenticated user.
@@ -110,7 +348,7 @@ async def delete_contact(contact_id: int, db: Session = Depends(get_db),
     :param contact_id: The ID of the contact to delete.
     :type contact_id: int
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param current_user: The currently authenticated user.
     :type current_user: models.User
     :return: A message indicating the contact has been deleted.
@@ -124,43 +362,69 @@ async def delete_contact(contact_id: int, db: Session = Depends(get_db),
 
 # Поиск по имени, фамилии или email
 @router.get("/contacts/search/", response_model=List[schemas.ContactResponse])
-async def search_contacts(query: str, db: Session = Depends(get_db), 
-                         current_user: models.User = Depends(auth_service.get_current_user)):
+async def search_contacts(query: str, limit: int = Query(100, ge=1, le=500), cursor: Optional[str] = None,
+                          db: AsyncSession = Depends(get_read_db),
+                          current_user: models.User = Depends(auth_service.get_current_user)):
     """
     Search contacts by first name, last name, or email for the authenticated user.
 
+    Results are ordered by relevance. When a full page is returned, the cursor for the next page is sent
+    in the `X-Next-Cursor` response header. Results are cached until a contact of the user changes.
+
     :param query: The search term for filtering contacts.
     :type query: str
+    :param limit: The maximum number of contacts to return.
+    :type limit: int
+    :param cursor: The cursor from the `X-Next-Cursor` header of the previous page.
+    :type cursor: Optional[str]
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param current_user: The currently authenticated user.
     :type current_user: models.User
     :return: A list of contacts matching the search query.
-    :rtype: List[schemas.ContactResponse]
-    :raises HTTPException: If no matching contacts are found (404).
+    :rtype: Response
+    :raises HTTPException: If the cursor is malformed (400).
     """
-    contact = await repository_contacts.search_contacts(db, query, current_user)
-    if contact is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
-    return contact
+    after = decode_ranked_cursor(cursor) if cursor else None
+    version = await contacts_version.get(current_user.id)
+    replica_router.follow_writes(db, version)
+
+    async def fill():
+        ranked = await repository_contacts.search_contacts_ranked(db, query, current_user, limit, after)
+        headers = {}
+        if ranked and len(ranked) == limit:
+            last_contact, last_rank = ranked[-1]
+            headers[NEXT_CURSOR_HEADER] = encode_cursor(last_contact.id, rank=last_rank)
+        return contacts_body([contact for contact, _ in ranked]), headers, contacts_version.can_tag(version, db)
 
-# Контакты с днями рождения в ближайшие 7 дней
+    key = result_cache.key(current_user.id, version, "search", {"query": query, "limit": limit, "after": after})
+    return json_response(*await result_cache.get_or_fill(key, fill))
+
+# Контакты с днями рождения в ближайшие дни
 @router.get("/contacts/birthdays/", response_model=List[schemas.ContactResponse])
-async def upcoming_birthdays(db: Session = Depends(get_db), 
+async def upcoming_birthdays(days: int = Query(7, ge=0, le=366), db: AsyncSession = Depends(get_read_db),
                          current_user: models.User = Depends(auth_service.get_current_user)):
     """
-    Retrieve a list of contacts who have birthdays in the next 7 days for the authenticated user.
+    Retrieve a list of contacts who have birthdays in the next `days` days for the authenticated user.
+
+    Results are cached until a contact of the user changes or the day ends.
 
+    :param days: The size of the window in days, starting today (7 by default).
+    :type days: int
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :param current_user: The currently authenticated user.
     :type current_user: models.User
     :return: A list of contacts with upcoming birthdays.
-    :rtype: List[schemas.ContactResponse]
-    :raises HTTPException: If no contacts with upcoming birthdays are found (404).
+    :rtype: Response
     """
-    contact = await repository_contacts.get_birthdays_in_next_7_days(db, current_user)
-    if contact is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
-    return contact
+    version = await contacts_version.get(current_user.id)
+    replica_router.follow_writes(db, version)
+
+    async def fill():
+        contacts = await repository_contacts.get_upcoming_birthdays(db, current_user, days)
+        return contacts_body(contacts), {}, contacts_version.can_tag(version, db)
+
+    key = result_cache.key(current_user.id, version, "birthdays", {"days": days, "today": date.today().isoformat()})
+    return json_response(*await result_cache.get_or_fill(key, fill))
 
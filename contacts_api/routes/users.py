@@ -1,55 +1,76 @@
-from fastapi import APIRouter, Depends, status, UploadFile, File
-from sqlalchemy.orm import Session
-import cloudinary
-import cloudinary.uploader
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, UploadFile, File
 
-from db import get_db
 from models import User
-from repository import users as repository_users
 from services.auth import auth_service
-from conf.config import settings
-from schemas import UserDb
+from services.avatars import avatar_pipeline
+from services.etag import user_etag, if_none_match, not_modified
+from schemas import AvatarStatusResponse, UserDb
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
 @router.get("/me/", response_model=UserDb)
-async def read_users_me(current_user: User = Depends(auth_service.get_current_user)):
+async def read_users_me(request: Request, response: Response,
+                        current_user: User = Depends(auth_service.get_current_user)):
     """
     Retrieve the details of the currently authenticated user.
 
+    The response carries an `ETag` of the user data; a request with a matching `If-None-Match` header
+    is answered with 304 Not Modified.
+
+    :param request: The incoming request, with the optional `If-None-Match` header.
+    :type request: Request
+    :param response: The outgoing response, used to set the ETag header.
+    :type response: Response
     :param current_user: The currently authenticated user.
     :type current_user: User
     :return: The user data.
     :rtype: UserDb
     """
+    etag = user_etag(current_user)
+    if if_none_match(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return current_user
 
 
-@router.patch('/avatar', response_model=UserDb)
-async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+@router.patch('/avatar', response_model=UserDb, status_code=status.HTTP_202_ACCEPTED)
+async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user)):
     """
-    Update the avatar of the currently authenticated user by uploading a new image to Cloudinary.
+    Accept a new avatar for the currently authenticated user and process it in the background.
+
+    The upload is copied to a temporary file and checked to be an image. It is then cropped and resized to a
+    square, stored, and set as the user's avatar after the response is sent, so the returned user still has
+    the previous avatar URL. Whether the avatar was set can be checked at `GET /users/avatar/status`.
 
     :param file: The uploaded image file for the avatar.
     :type file: UploadFile
     :param current_user: The currently authenticated user.
     :type current_user: User
-    :param db: The database session.
-    :type db: Session
-    :return: The updated user data with the new avatar URL.
+    :return: The user data.
     :rtype: UserDb
+    :raises HTTPException: If the file is too large (status 413), is not an image (status 415), or too many
+        avatars are being processed (status 503).
+    """
+    await avatar_pipeline.submit(file, current_user.id, current_user.email)
+    return current_user
+
+
+@router.get('/avatar/status', response_model=AvatarStatusResponse)
+async def read_avatar_status(current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Retrieve the status of the latest avatar upload of the currently authenticated user.
+
+    The status is `processing` until the avatar is set, then `done`, or `failed` if it could not be
+    processed or stored, in which case the previous avatar is kept.
+
+    :param current_user: The currently authenticated user.
+    :type current_user: User
+    :return: The status of the upload.
+    :rtype: AvatarStatusResponse
+    :raises HTTPException: If the user uploaded no avatar recently (status 404).
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
-
-    r = cloudinary.uploader.upload(file.file, public_id=f'ContactsApp/{current_user.username}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'ContactsApp/{current_user.username}')\
-                        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
-    user = await repository_users.update_avatar(current_user.email, src_url, db)
-    return user
+    avatar_status = await avatar_pipeline.status.get(current_user.id)
+    if avatar_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No recent avatar upload")
+    return avatar_status
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 class ContactBase(BaseModel):
     first_name: str
@@ -16,6 +16,22 @@ class ContactCreate(ContactBase):
 class ContactUpdate(ContactBase):
     pass
 
+def check_not_null(cls, value):
+    # omitted fields are left unchanged, but only additional_info may be cleared
+    if value is None:
+        raise ValueError("Field may not be null")
+    return value
+
+class ContactPatch(BaseModel):
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    email: Optional[EmailStr] = None
+    phone_number: Optional[str] = None
+    birthday: Optional[datetime] = None
+    additional_info: Optional[str] = None
+
+    _check_not_null = field_validator("first_name", "last_name", "email", "phone_number", "birthday")(check_not_null)
+
 class ContactResponse(ContactBase):
     id: int
 
@@ -24,6 +40,71 @@ class ContactResponse(ContactBase):
         # orm_mode =True
 
 
+class ContactSuggestion(BaseModel):
+    id: int
+    first_name: str
+    last_name: str
+    email: str
+
+
+class ContactImportError(BaseModel):
+    row: int
+    errors: List[str]
+
+
+class ContactImportReport(BaseModel):
+    imported: int = 0
+    failed: int = 0
+    errors: List[ContactImportError] = []
+
+
+class ContactBulkFilter(BaseModel):
+    ids: Optional[List[int]] = Field(None, min_length=1, max_length=10000)
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    email: Optional[str] = None
+    phone_number: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_not_empty(self):
+        if not self.model_dump(exclude_none=True):
+            raise ValueError("At least one of ids, first_name, last_name, email or phone_number is required")
+        return self
+
+
+class ContactBulkValues(BaseModel):
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    phone_number: Optional[str] = None
+    birthday: Optional[datetime] = None
+    additional_info: Optional[str] = None
+
+    _check_not_null = field_validator("first_name", "last_name", "phone_number", "birthday")(check_not_null)
+
+    @model_validator(mode="after")
+    def check_not_empty(self):
+        if not self.model_fields_set:
+            raise ValueError("At least one field to update is required")
+        return self
+
+
+class ContactBulkUpdate(BaseModel):
+    filter: ContactBulkFilter
+    values: ContactBulkValues
+
+
+class ContactBulkResult(BaseModel):
+    affected: int
+
+
+class ContactChanges(BaseModel):
+    created: List[int] = []
+    updated: List[int] = []
+    deleted: List[int] = []
+    next_token: str
+    has_more: bool = False
+
+
 class UserModel(BaseModel):
     username: str = Field(min_length=5, max_length=16)
     email: str
@@ -41,6 +122,11 @@ class UserDb(BaseModel):
         from_attribures = True
 
 
+class AvatarStatusResponse(BaseModel):
+    status: str
+    detail: Optional[str] = None
+
+
 class UserResponse(BaseModel):
     user: UserDb
     detail: str = "User successfully created"
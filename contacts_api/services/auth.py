@@ -1,15 +1,17 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from jose import JWTError, jwt
+from jose import JWTError
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
-from sqlalchemy.orm import Session
-import pickle
-import redis
-
+from sqlalchemy.ext.asyncio import AsyncSession
 from db import get_db
 from repository import users as repository_users
+from services.jwt_keys import key_set
+from services.token_cache import token_cache
+from services.user_cache import user_cache, UserSnapshot
 from conf.config import settings
 
 
@@ -22,17 +24,40 @@ class Auth:
         SECRET_KEY (str): The secret key used for encoding and decoding JWTs.
         ALGORITHM (str): The algorithm used for encoding JWTs.
         oauth2_scheme (OAuth2PasswordBearer): OAuth2 bearer token security scheme.
-        r (redis.Redis): Redis instance for caching user data.
+        keys (KeySet): Keys used to sign and verify JWTs.
+        hash_executor (ThreadPoolExecutor): Worker threads running bcrypt off the event loop.
+        hash_queue_limit (int): Maximum number of hashing jobs running or waiting before requests are rejected.
     """
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+    keys = key_set
+    hash_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix="bcrypt")
+    hash_queue_limit = settings.password_hash_workers + settings.password_hash_queue_size
+    hash_pending = 0
+
+    async def _run_hashing(self, func, *args):
+        """
+        Runs a bcrypt call on the hashing worker threads, rejecting it when too many are already queued.
+
+        :param func: The blocking function to run.
+        :param args: Its arguments.
+        :return: The result of the function.
+        :raises HTTPException: If the hashing queue is full (status 503).
+        """
+        if self.hash_pending >= self.hash_queue_limit:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Server is busy, try again later", headers={"Retry-After": "1"})
+        self.hash_pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.hash_executor, func, *args)
+        finally:
+            self.hash_pending -= 1
 
-    def verify_password(self, plain_password, hashed_password):
+    async def verify_password(self, plain_password, hashed_password):
         """
-        Verifies that a plain password matches a hashed password.
+        Verifies that a plain password matches a hashed password, on the hashing worker threads.
 
         :param plain_password: The user's plain text password.
         :type plain_password: str
@@ -40,19 +65,21 @@ class Auth:
         :type hashed_password: str
         :return: True if the password matches, otherwise False.
         :rtype: bool
+        :raises HTTPException: If the hashing queue is full (status 503).
         """
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return await self._run_hashing(self.pwd_context.verify, plain_password, hashed_password)
 
-    def get_password_hash(self, password: str):
+    async def get_password_hash(self, password: str):
         """
-        Hashes a password using bcrypt.
+        Hashes a password using bcrypt, on the hashing worker threads.
 
         :param password: The user's plain text password.
         :type password: str
         :return: The hashed password.
         :rtype: str
+        :raises HTTPException: If the hashing queue is full (status 503).
         """
-        return self.pwd_context.hash(password)
+        return await self._run_hashing(self.pwd_context.hash, password)
 
     # define a function to generate a new access token
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
@@ -72,7 +99,7 @@ class Auth:
         else:
             expire = datetime.now(timezone.utc) + timedelta(minutes=15)
         to_encode.update({"iat": datetime.now(timezone.utc), "exp": expire, "scope": "access_token"})
-        encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        encoded_access_token = self.keys.encode(to_encode)
         return encoded_access_token
 
     # define a function to generate a new refresh token
@@ -93,7 +120,7 @@ class Auth:
         else:
             expire = datetime.now(timezone.utc) + timedelta(days=7)
         to_encode.update({"iat": datetime.now(timezone.utc), "exp": expire, "scope": "refresh_token"})
-        encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        encoded_refresh_token = self.keys.encode(to_encode)
         return encoded_refresh_token
 
     async def decode_refresh_token(self, refresh_token: str):
@@ -107,7 +134,7 @@ class Auth:
         :raises HTTPException: If the token is invalid or does not have the correct scope.
         """
         try:
-            payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.keys.decode(refresh_token)
             if payload['scope'] == 'refresh_token':
                 email = payload['sub']
                 return email
@@ -115,16 +142,19 @@ class Auth:
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
         """
         Retrieves the currently authenticated user based on the provided token.
 
+        The claims of a token are verified once and then served from the token cache until the token expires.
+        The user is read from the Redis user cache and loaded from the database only on a cache miss.
+
         :param token: The JWT access token.
         :type token: str
         :param db: The database session.
-        :type db: Session
-        :return: The authenticated user object.
-        :rtype: User
+        :type db: AsyncSession
+        :return: A snapshot of the authenticated user.
+        :rtype: UserSnapshot
         :raises HTTPException: If the token is invalid or the user is not found.
         """
         credentials_exception = HTTPException(
@@ -134,8 +164,11 @@ class Auth:
         )
 
         try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            # Decode JWT, unless it was verified before
+            payload = token_cache.get(token)
+            if payload is None:
+                payload = self.keys.decode(token)
+                token_cache.put(token, payload)
             if payload['scope'] == 'access_token':
                 email = payload["sub"]
                 if email is None:
@@ -145,15 +178,13 @@ class Auth:
         except JWTError as e:
             raise credentials_exception
         
-        user = self.r.get(f"user:{email}")
+        user = await user_cache.get(email)
         if user is None:
-            user = await repository_users.get_user_by_email(email, db)
-            if user is None:
+            db_user = await repository_users.get_user_by_email(email, db)
+            if db_user is None:
                 raise credentials_exception
-            self.r.set(f"user:{email}", pickle.dumps(user))
-            self.r.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+            user = UserSnapshot.from_user(db_user)
+            await user_cache.set(user)
         return user
 
 
@@ -169,7 +200,7 @@ class Auth:
         to_encode = data.copy()
         expire = datetime.now(timezone.utc) + timedelta(days=7)
         to_encode.update({"iat": datetime.now(timezone.utc), "exp": expire})
-        token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        token = self.keys.encode(to_encode)
         return token
     
     async def get_email_from_token(self, token: str):
@@ -183,7 +214,7 @@ class Auth:
         :raises HTTPException: If the token is invalid.
         """
         try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.keys.decode(token)
             email = payload["sub"]
             return email
         except JWTError as e:
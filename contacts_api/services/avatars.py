@@ -0,0 +1,301 @@
+import abc
+import asyncio
+import io
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cloudinary
+import cloudinary.uploader
+import orjson
+import redis.asyncio as redis
+from fastapi import HTTPException, UploadFile, status
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from conf.config import settings
+from db import SessionLocal
+from repository import users as repository_users
+from services.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+
+def process_avatar(path: str, size: int = 250) -> bytes:
+    """
+    Crops an image to a centered square, resizes it to ``size`` pixels and re-encodes it as JPEG.
+
+    :param path: The path of the image file.
+    :type path: str
+    :param size: The width and height of the avatar.
+    :type size: int
+    :return: The JPEG data.
+    :rtype: bytes
+    """
+    with Image.open(path) as image:
+        # lets JPEG decode at a reduced scale instead of decoding every pixel of a large photo
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        avatar = ImageOps.fit(image.convert("RGB"), (size, size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    avatar.save(buffer, "JPEG", quality=85, optimize=True)
+    return buffer.getvalue()
+
+
+def _spool(source, max_bytes: int, chunk_size: int = 64 * 1024) -> str:
+    # copies the upload, which is closed with the request, and checks it is an image before accepting it
+    with tempfile.NamedTemporaryFile(prefix="avatar-", delete=False) as spool:
+        try:
+            copied = 0
+            while chunk := source.read(chunk_size):
+                copied += len(chunk)
+                if copied > max_bytes:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail="Avatar file is too large")
+                spool.write(chunk)
+            spool.flush()
+            try:
+                with Image.open(spool.name) as image:
+                    image.verify()
+            except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError):
+                raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                    detail="Avatar must be an image")
+        except BaseException:
+            spool.close()
+            os.unlink(spool.name)
+            raise
+    return spool.name
+
+
+class AvatarStorage(abc.ABC):
+    """
+    Base class of the avatar storage backends. Subclasses implement the blocking ``_upload``, which runs
+    on the given executor.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor):
+        self.executor = executor
+
+    @abc.abstractmethod
+    def _upload(self, key: str, data: bytes) -> str:
+        """
+        Stores an avatar, blocking until it is stored.
+
+        :param key: The name of the avatar, without extension.
+        :type key: str
+        :param data: The JPEG data.
+        :type data: bytes
+        :return: The URL of the avatar.
+        :rtype: str
+        """
+
+    async def save(self, key: str, data: bytes) -> str:
+        """
+        Stores an avatar.
+
+        :param key: The name of the avatar, without extension.
+        :type key: str
+        :param data: The JPEG data.
+        :type data: bytes
+        :return: The URL of the avatar.
+        :rtype: str
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._upload, key, data)
+
+
+class CloudinaryStorage(AvatarStorage):
+    """
+    Stores avatars in Cloudinary.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, cloud_name: str, api_key: str, api_secret: str):
+        super().__init__(executor)
+        cloudinary.config(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret, secure=True)
+
+    def _upload(self, key: str, data: bytes) -> str:
+        result = cloudinary.uploader.upload(io.BytesIO(data), public_id=key, overwrite=True)
+        return result["secure_url"]
+
+
+class LocalStorage(AvatarStorage):
+    """
+    Stores avatars as files in a local directory served under ``base_url``, e.g. for development and tests.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, directory: str, base_url: str):
+        super().__init__(executor)
+        self.directory = Path(directory)
+        self.base_url = base_url
+
+    def _upload(self, key: str, data: bytes) -> str:
+        path = self.directory / f"{key}.jpg"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix(".part")
+        partial.write_bytes(data)
+        os.replace(partial, path)
+        # the version makes clients fetch the new file instead of a cached old one
+        return f"{self.base_url}{key}.jpg?v={int(time.time())}"
+
+
+class AvatarStatus:
+    """
+    Status of the latest avatar upload of each user, shared by all workers through Redis, so a client
+    whose upload was accepted can learn whether its avatar was set.
+
+    Attributes:
+        r (redis.asyncio.Redis): Redis instance holding the statuses.
+        ttl (int): Seconds a status is kept after its last change.
+    """
+
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, r: redis.Redis, ttl: int = 24 * 3600):
+        self.r = r
+        self.ttl = ttl
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f"avatar-status:{user_id}"
+
+    async def set(self, user_id: int, status: str, detail: str | None = None) -> None:
+        """
+        Records the status of the latest avatar upload of a user.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :param status: One of :attr:`PROCESSING`, :attr:`DONE` or :attr:`FAILED`.
+        :type status: str
+        :param detail: Why the avatar was not set, for a failed upload.
+        :type detail: str | None
+        """
+        await self.r.set(self.key(user_id), orjson.dumps({"status": status, "detail": detail}), ex=self.ttl)
+
+    async def get(self, user_id: int) -> dict | None:
+        """
+        Returns the status of the latest avatar upload of a user.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :return: The status and detail, or None if the user uploaded no avatar recently.
+        :rtype: dict | None
+        """
+        data = await self.r.get(self.key(user_id))
+        return orjson.loads(data) if data is not None else None
+
+
+class AvatarPipeline:
+    """
+    Processes avatar uploads in the background, off the request path.
+
+    The request only copies the upload to a temporary file and checks it is an image. The image is then
+    cropped, resized and re-encoded on worker threads, stored by the storage backend, and the user's
+    avatar URL is updated once it is stored. At most ``queue_limit`` avatars are processed or waiting at
+    a time; further uploads are rejected. The progress of each upload is recorded in ``status``; a failed
+    upload leaves the previous avatar in place.
+
+    Attributes:
+        storage (AvatarStorage): Where avatars are stored.
+        executor (ThreadPoolExecutor): Worker threads resizing the images.
+        size (int): The width and height of the avatars.
+        max_bytes (int): The largest upload accepted.
+        queue_limit (int): Maximum number of avatars in the pipeline.
+        session_factory (Callable[[], AsyncSession]): Opens the sessions updating the users.
+        status (AvatarStatus): Where the status of each user's latest upload is recorded.
+        processed (int): Number of avatars stored.
+        failed (int): Number of avatars that could not be processed or stored.
+    """
+
+    def __init__(self, storage: AvatarStorage, executor: ThreadPoolExecutor, size: int = 250,
+                 max_bytes: int = 10 * 1024 * 1024, queue_limit: int = 32, session_factory=SessionLocal,
+                 status: AvatarStatus | None = None):
+        self.storage = storage
+        self.executor = executor
+        self.size = size
+        self.max_bytes = max_bytes
+        self.queue_limit = queue_limit
+        self.session_factory = session_factory
+        self.status = status or AvatarStatus(redis_client)
+        self.processed = 0
+        self.failed = 0
+        self.pending = 0
+        self._tasks = set()
+
+    async def submit(self, file: UploadFile, user_id: int, email: str) -> None:
+        """
+        Accepts an uploaded avatar and starts processing it in the background.
+
+        :param file: The uploaded image.
+        :type file: UploadFile
+        :param user_id: The id of the user, which names the stored avatar.
+        :type user_id: int
+        :param email: The email address of the user.
+        :type email: str
+        :raises HTTPException: If too many avatars are in the pipeline (status 503), the file is too large
+            (status 413) or is not an image (status 415).
+        """
+        if self.pending >= self.queue_limit:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Server is busy, try again later", headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            path = await asyncio.get_running_loop().run_in_executor(self.executor, _spool, file.file,
+                                                                    self.max_bytes)
+        except BaseException:
+            self.pending -= 1
+            raise
+        try:
+            await self.status.set(user_id, AvatarStatus.PROCESSING)
+        except BaseException:
+            os.unlink(path)
+            self.pending -= 1
+            raise
+        task = asyncio.create_task(self._process(path, user_id, email))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, path: str, user_id: int, email: str):
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(self.executor, process_avatar, path, self.size)
+            url = await self.storage.save(f"ContactsApp/{user_id}", data)
+            async with self.session_factory() as db:
+                await repository_users.update_avatar(email, url, db)
+            self.processed += 1
+            outcome = (AvatarStatus.DONE, None)
+        except Exception:
+            self.failed += 1
+            logger.exception("Avatar of user %s could not be processed", user_id)
+            outcome = (AvatarStatus.FAILED, "The avatar could not be processed, the previous one is kept")
+        finally:
+            os.unlink(path)
+            self.pending -= 1
+        try:
+            await self.status.set(user_id, *outcome)
+        except Exception:
+            logger.exception("Avatar status of user %s could not be recorded", user_id)
+
+    async def drain(self, timeout: float = 30):
+        """
+        Waits for the avatars in the pipeline to be stored, e.g. before the application stops.
+
+        :param timeout: The longest wait in seconds.
+        :type timeout: float
+        """
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+
+    def stats(self) -> dict:
+        return {"processed": self.processed, "failed": self.failed, "in_flight": self.pending}
+
+
+avatar_executor = ThreadPoolExecutor(max_workers=settings.avatar_workers, thread_name_prefix="avatar")
+if settings.avatar_storage == "local":
+    avatar_storage = LocalStorage(avatar_executor, settings.avatar_local_dir, settings.avatar_local_url)
+else:
+    avatar_storage = CloudinaryStorage(avatar_executor, settings.cloudinary_name, settings.cloudinary_api_key,
+                                       settings.cloudinary_api_secret)
+avatar_pipeline = AvatarPipeline(avatar_storage, avatar_executor, settings.avatar_size, settings.avatar_max_bytes,
+                                 settings.avatar_queue_size)
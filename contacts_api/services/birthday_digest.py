@@ -0,0 +1,93 @@
+"""
+Batch job queueing a daily digest email of upcoming birthdays to every user who has some.
+
+Meant to be run once a day, e.g. from cron or a systemd timer::
+
+    python -m services.birthday_digest --days 7
+
+The emails are sent by the outbox worker of the running application (:data:`services.email.email_worker`),
+which picks them up on its next poll, at most ``EMAIL_OUTBOX_POLL_INTERVAL`` seconds later: the job runs in
+its own process and cannot wake that worker.
+"""
+import argparse
+import asyncio
+import time
+from datetime import date
+
+from conf.config import settings
+from db import SessionLocal, engine, read_session
+from repository import contacts as repository_contacts
+from repository import outbox as repository_outbox
+from services.email import BIRTHDAY_DIGEST
+from services.email_templates import email_templates
+from services.serialization import CONTACT_FIELDS
+
+SUBJECT = "Upcoming birthdays"
+TEMPLATE = "birthday_digest.html"
+
+
+async def _queue_chunk(chunk: list, days: int, session_factory) -> int:
+    contexts = [{"username": username, "contacts": [dict(zip(CONTACT_FIELDS, contact)) for contact in contacts]}
+                for (_, _, username), contacts in chunk]
+    bodies = email_templates.render_many(TEMPLATE, contexts, days=days)
+    emails = [(email, {"subject": SUBJECT, "html": html}) for ((_, email, _), _), html in zip(chunk, bodies)]
+    async with session_factory() as db:
+        return await repository_outbox.enqueue_emails(db, BIRTHDAY_DIGEST, emails, replace=True)
+
+
+async def queue_birthday_digests(days: int = 7, chunk_size: int = 500, today: date | None = None,
+                                 read_session_factory=read_session, session_factory=SessionLocal) -> dict:
+    """
+    Queues one digest email per user listing the user's contacts with birthdays in the next `days` days.
+
+    Upcoming birthdays of all users come from one query, streamed and grouped by user
+    (:func:`repository.contacts.stream_upcoming_birthdays_by_user`). Every ``chunk_size`` users, their digests
+    are rendered from the compiled template in one loop and queued with a single INSERT. A digest still
+    waiting in the outbox from an earlier run is replaced.
+
+    :param days: The size of the window in days, starting today.
+    :type days: int
+    :param chunk_size: The number of users whose digests are queued together.
+    :type chunk_size: int
+    :param today: The first day of the window, the current date by default.
+    :type today: date | None
+    :param read_session_factory: Opens the session reading the birthdays, on a read replica if there is one.
+    :type read_session_factory: Callable[[], AsyncSession]
+    :param session_factory: Opens the sessions writing to the outbox.
+    :type session_factory: Callable[[], AsyncSession]
+    :return: The number of users, birthdays and queued digests, the run time, and the users per second.
+    :rtype: dict
+    """
+    started = time.perf_counter()
+    users = birthdays = queued = 0
+    chunk = []
+    async with read_session_factory() as db:
+        async for user, contacts in repository_contacts.stream_upcoming_birthdays_by_user(db, days, today):
+            users += 1
+            birthdays += len(contacts)
+            chunk.append((user, contacts))
+            if len(chunk) >= chunk_size:
+                queued += await _queue_chunk(chunk, days, session_factory)
+                chunk = []
+    if chunk:
+        queued += await _queue_chunk(chunk, days, session_factory)
+    seconds = time.perf_counter() - started
+    return {"users": users, "birthdays": birthdays, "queued": queued, "seconds": seconds,
+            "users_per_second": users / seconds if seconds else 0.0}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=settings.birthday_digest_days)
+    parser.add_argument("--chunk-size", type=int, default=settings.birthday_digest_chunk_size)
+    args = parser.parse_args()
+    try:
+        stats = await queue_birthday_digests(args.days, args.chunk_size)
+    finally:
+        await engine.dispose()
+    print(f"{stats['users']} users, {stats['birthdays']} birthdays, {stats['queued']} digests queued "
+          f"in {stats['seconds']:.2f} s ({stats['users_per_second']:.0f} users/s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
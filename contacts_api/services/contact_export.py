@@ -0,0 +1,101 @@
+import csv
+import io
+from typing import AsyncIterator
+
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from repository import contacts as repository_contacts
+from services.serialization import contact_dicts
+
+
+FIELDS = ("id", "first_name", "last_name", "email", "phone_number", "birthday", "additional_info")
+
+
+def _csv_lines(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _csv_chunk(rows) -> str:
+    return _csv_lines((row.id, row.first_name, row.last_name, row.email, row.phone_number,
+                       row.birthday.isoformat() if row.birthday else None, row.additional_info) for row in rows)
+
+
+def _ndjson_chunk(rows) -> bytes:
+    return b"".join(orjson.dumps(contact) + b"\n" for contact in contact_dicts(rows))
+
+
+def _vcard_text(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace(",", "\\,").replace(";", "\\;")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _vcard_line(name: str, value: str) -> str:
+    # content lines are folded at 75 octets, continuation lines start with a space
+    line = f"{name}:{value}"
+    if len(line.encode()) <= 75:
+        return line + "\r\n"
+    folded, current, size = [], "", 0
+    for char in line:
+        char_size = len(char.encode())
+        if size + char_size > 75:
+            folded.append(current)
+            current, size = " ", 1
+        current += char
+        size += char_size
+    folded.append(current)
+    return "\r\n".join(folded) + "\r\n"
+
+
+def _vcard_chunk(rows) -> str:
+    cards = []
+    for row in rows:
+        first_name, last_name = _vcard_text(row.first_name or ""), _vcard_text(row.last_name or "")
+        lines = ["BEGIN:VCARD\r\n", "VERSION:4.0\r\n",
+                 _vcard_line("FN", f"{first_name} {last_name}".strip()),
+                 _vcard_line("N", f"{last_name};{first_name};;;")]
+        if row.email:
+            lines.append(_vcard_line("EMAIL", _vcard_text(row.email)))
+        if row.phone_number:
+            lines.append(_vcard_line("TEL", _vcard_text(row.phone_number)))
+        if row.birthday:
+            lines.append(_vcard_line("BDAY", row.birthday.strftime("%Y%m%d")))
+        if row.additional_info:
+            lines.append(_vcard_line("NOTE", _vcard_text(row.additional_info)))
+        lines.append("END:VCARD\r\n")
+        cards.append("".join(lines))
+    return "".join(cards)
+
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv", _csv_chunk),
+    "ndjson": ("application/x-ndjson", "ndjson", _ndjson_chunk),
+    "vcard": ("text/vcard; charset=utf-8", "vcf", _vcard_chunk),
+}
+
+
+async def export_contacts(db: AsyncSession, user: models.User, format: str) -> AsyncIterator[str | bytes]:
+    """
+    Renders all contacts of a user in the given format, one chunk per partition read from the database.
+
+    The CSV and NDJSON files use the field names accepted by ``POST /api/contacts/bulk``, so an export can
+    be imported again.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param user: The user whose contacts are exported.
+    :type user: models.User
+    :param format: One of the keys of ``FORMATS``: ``csv``, ``ndjson`` or ``vcard``.
+    :type format: str
+    :return: The rendered file, chunk by chunk.
+    :rtype: AsyncIterator[str | bytes]
+    """
+    render = FORMATS[format][2]
+    if format == "csv":
+        # the header goes out before the first query so the client gets its first bytes right away
+        yield _csv_lines([FIELDS])
+    async for rows in repository_contacts.stream_contacts(db, user):
+        yield render(rows)
@@ -0,0 +1,176 @@
+import codecs
+import csv
+from typing import AsyncIterator
+
+import orjson
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models, schemas
+from conf.config import settings
+from repository import contacts as repository_contacts
+
+
+CSV_TYPES = ("text/csv",)
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-lines")
+MAX_ROW_BYTES = 64 * 1024
+MAX_REPORTED_ERRORS = 1000
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Splits a stream of UTF-8 bytes into lines without reading it whole.
+
+    :param chunks: The request body as it arrives.
+    :type chunks: AsyncIterator[bytes]
+    :return: The lines, without their line terminators.
+    :rtype: AsyncIterator[str]
+    :raises HTTPException: If a line is longer than ``MAX_ROW_BYTES`` (413) or is not valid UTF-8 (400).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    try:
+        async for chunk in chunks:
+            pending += decoder.decode(chunk)
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                yield line.rstrip("\r")
+            if len(pending) > MAX_ROW_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Row too long")
+        pending += decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File is not valid UTF-8")
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_csv_records(lines: AsyncIterator[str]) -> AsyncIterator[dict | str]:
+    """
+    Parses CSV lines into dicts keyed by the header row. Quoted fields may span several lines.
+
+    :param lines: The lines of the file.
+    :type lines: AsyncIterator[str]
+    :return: A dict per data row, or an error message for a row that cannot be parsed.
+    :rtype: AsyncIterator[dict | str]
+    """
+    header = None
+    record = ""
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        # an odd number of quotes means a quoted field continues on the next line
+        if record.count('"') % 2:
+            if len(record) > MAX_ROW_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Row too long")
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+        fields = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in fields]
+        elif len(fields) != len(header):
+            yield f"Expected {len(header)} fields, got {len(fields)}"
+        else:
+            record_fields = dict(zip(header, fields))
+            if record_fields.get("additional_info") == "":
+                record_fields["additional_info"] = None
+            yield record_fields
+    if record:
+        yield "Unterminated quoted field"
+
+
+async def iter_ndjson_records(lines: AsyncIterator[str]) -> AsyncIterator[dict | str]:
+    """
+    Parses NDJSON lines, one JSON object per line. Blank lines are ignored.
+
+    :param lines: The lines of the file.
+    :type lines: AsyncIterator[str]
+    :return: A dict per line, or an error message for a line that is not a JSON object.
+    :rtype: AsyncIterator[dict | str]
+    """
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            yield "Invalid JSON"
+            continue
+        yield record if isinstance(record, dict) else "Expected a JSON object"
+
+
+def _validation_messages(error: ValidationError) -> list[str]:
+    return [f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()]
+
+
+async def import_contacts(db: AsyncSession, chunks: AsyncIterator[bytes], content_type: str,
+                          user: models.User) -> schemas.ContactImportReport:
+    """
+    Imports contacts from a streamed CSV or NDJSON file.
+
+    Rows are validated one by one against :class:`schemas.ContactCreate` and inserted in batches of
+    ``settings.contact_import_batch_size``, each batch committed on its own, so memory use does not grow
+    with the file. Invalid rows and rows whose email already exists are reported and skipped. Rows are
+    numbered from 1, not counting the CSV header and blank lines.
+
+    :param db: The database session.
+    :type db: AsyncSession
+    :param chunks: The request body as it arrives.
+    :type chunks: AsyncIterator[bytes]
+    :param content_type: The media type of the file.
+    :type content_type: str
+    :param user: The user who owns the contacts.
+    :type user: models.User
+    :return: The number of imported and failed rows, with the errors of up to ``MAX_REPORTED_ERRORS`` of them.
+    :rtype: schemas.ContactImportReport
+    :raises HTTPException: If the media type is not supported (415) or a row is too long (413).
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in CSV_TYPES:
+        records = iter_csv_records(iter_lines(chunks))
+    elif media_type in NDJSON_TYPES:
+        records = iter_ndjson_records(iter_lines(chunks))
+    else:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Upload text/csv or application/x-ndjson")
+
+    report = schemas.ContactImportReport()
+
+    def fail(row: int, errors: list[str]):
+        report.failed += 1
+        if len(report.errors) < MAX_REPORTED_ERRORS:
+            report.errors.append(schemas.ContactImportError(row=row, errors=errors))
+
+    async def flush(batch: dict):
+        inserted = await repository_contacts.insert_contacts(db, [body for _, body in batch.values()], user)
+        report.imported += len(inserted)
+        inserted_emails = {contact.email for contact in inserted}
+        for email, (row, _) in batch.items():
+            if email not in inserted_emails:
+                fail(row, ["email: Contact with this email already exists"])
+
+    # rows waiting to be inserted, by email
+    batch = {}
+    row = 0
+    async for record in records:
+        row += 1
+        if isinstance(record, str):
+            fail(row, [record])
+            continue
+        try:
+            body = schemas.ContactCreate.model_validate(record)
+        except ValidationError as error:
+            fail(row, _validation_messages(error))
+            continue
+        if body.email in batch:
+            fail(row, [f"email: Duplicate of row {batch[body.email][0]}"])
+            continue
+        batch[body.email] = (row, body)
+        if len(batch) >= settings.contact_import_batch_size:
+            await flush(batch)
+            batch = {}
+    if batch:
+        await flush(batch)
+    report.errors.sort(key=lambda error: error.row)
+    return report
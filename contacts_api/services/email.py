@@ -1,10 +1,19 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from email.message import EmailMessage
+from email.utils import formataddr, make_msgid
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
+import aiosmtplib
+from fastapi_mail import ConnectionConfig
 from pydantic import EmailStr
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from db import SessionLocal
+from repository import outbox as repository_outbox
 from services.auth import auth_service
+from services.email_templates import email_templates
 
 from conf.config import settings
 
@@ -15,40 +24,272 @@ conf = ConnectionConfig(
     MAIL_PORT=settings.mail_port,
     MAIL_SERVER=settings.mail_server,
     MAIL_FROM_NAME=settings.mail_from_name,
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
+    MAIL_STARTTLS=settings.mail_starttls,
+    MAIL_SSL_TLS=settings.mail_ssl_tls,
+    USE_CREDENTIALS=settings.mail_use_credentials,
+    VALIDATE_CERTS=settings.mail_validate_certs,
     TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
 )
 
+CONFIRM_EMAIL = "confirm_email"
+# rendered when queued: the payload holds the subject and the HTML body
+BIRTHDAY_DIGEST = "birthday_digest"
 
-async def send_email(email: EmailStr, username: str, host: str):
+
+class SMTPPool:
+    """
+    Bounded pool of logged-in SMTP connections, reused across messages and batches.
+
+    At most ``size`` connections are open at a time; callers wait for a free one. A connection that raised
+    while in use is closed rather than returned, and one left idle for more than ``max_idle`` seconds is
+    replaced, as servers drop idle sessions.
+
+    Attributes:
+        size (int): Maximum number of connections.
+        max_idle (float): Seconds an idle connection is kept.
+        opened (int): Number of connections opened so far.
     """
-    Sends a confirmation email to the user's email address to verify the account.
 
-    The function generates a token using the provided user's email and sends an HTML email 
-    containing a verification link. It uses the FastMail configuration and a predefined template.
+    def __init__(self, hostname: str, port: int, username: str | None = None, password: str | None = None,
+                 use_tls: bool = True, start_tls: bool = False, validate_certs: bool = True, size: int = 4,
+                 max_idle: float = 60, timeout: float = 30):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.validate_certs = validate_certs
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.opened = 0
+        self._slots = asyncio.Semaphore(size)
+        # (connection, time it was returned), most recently used last
+        self._idle = []
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, use_tls=self.use_tls,
+                               start_tls=self.start_tls, validate_certs=self.validate_certs, timeout=self.timeout)
+        await smtp.connect()
+        try:
+            if self.username:
+                await smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        self.opened += 1
+        return smtp
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Lends a connection for the duration of the ``async with`` block.
+        """
+        async with self._slots:
+            smtp = None
+            while self._idle and smtp is None:
+                smtp, returned = self._idle.pop()
+                if not smtp.is_connected or time.monotonic() - returned > self.max_idle:
+                    smtp.close()
+                    smtp = None
+            if smtp is None:
+                smtp = await self._connect()
+            try:
+                yield smtp
+            except BaseException:
+                smtp.close()
+                raise
+            self._idle.append((smtp, time.monotonic()))
+
+    async def close(self):
+        """
+        Closes the idle connections.
+        """
+        idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+
+
+def _render(kind: str, recipient: str, payload: dict) -> EmailMessage:
+    if kind == CONFIRM_EMAIL:
+        # the token is made when the email is sent, so it is valid for its full lifetime even after retries
+        token = auth_service.create_email_token({"sub": recipient})
+        subject = "Confirm your email "
+        html = email_templates.render("email_template.html", host=payload["host"], username=payload["username"],
+                                      token=token)
+    elif kind == BIRTHDAY_DIGEST:
+        subject, html = payload["subject"], payload["html"]
+    else:
+        raise ValueError(f"Unknown email kind {kind!r}")
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = formataddr((conf.MAIL_FROM_NAME, conf.MAIL_FROM))
+    message["To"] = recipient
+    message["Message-ID"] = make_msgid()
+    message.set_content(html, subtype="html")
+    return message
+
+
+def _permanent(error: Exception) -> bool:
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(refused.code >= 500 for refused in error.recipients)
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return error.code >= 500
+    return isinstance(error, (ValueError, KeyError))
+
+
+class OutboxWorker:
+    """
+    Background task sending the emails of the outbox table (:class:`models.EmailOutbox`).
+
+    Each round claims up to ``batch_size`` due emails and sends them concurrently over the connections
+    of an :class:`SMTPPool`, then records all results in one transaction. A failed email is retried after
+    ``backoff_seconds``, doubling with every attempt up to ``backoff_max``, unless the server rejected it
+    permanently (a 5xx reply) or it failed ``max_attempts`` times. Rounds run back to back while full batches
+    are due, otherwise every ``poll_interval`` seconds or as soon as :meth:`wake` is called.
+
+    Attributes:
+        pool (SMTPPool): The SMTP connections.
+        session_factory (Callable[[], AsyncSession]): Opens the database sessions.
+        sent (int): Number of emails sent.
+        retried (int): Number of failed attempts that will be retried.
+        failed (int): Number of emails given up on.
+    """
+
+    def __init__(self, pool: SMTPPool, session_factory=SessionLocal, batch_size: int = 50,
+                 poll_interval: float = 5, max_attempts: int = 8, backoff_seconds: float = 30,
+                 backoff_max: float = 3600, lease_seconds: float = 300):
+        self.pool = pool
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self._wake = asyncio.Event()
+
+    def wake(self):
+        """
+        Starts the next round now instead of at the end of the poll interval.
+        """
+        self._wake.set()
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.backoff_seconds * 2 ** (attempts - 1), self.backoff_max)
+
+    async def _send(self, row) -> Exception | None:
+        try:
+            message = _render(row.kind, row.recipient, row.payload)
+            async with self.pool.connection() as smtp:
+                await smtp.send_message(message)
+        except Exception as error:
+            return error
+        return None
+
+    async def run_once(self) -> int:
+        """
+        Sends one batch of due emails.
+
+        :return: The number of emails claimed.
+        :rtype: int
+        """
+        async with self.session_factory() as db:
+            rows = await repository_outbox.claim_emails(db, self.batch_size, self.lease_seconds)
+        if not rows:
+            return 0
+        errors = await asyncio.gather(*(self._send(row) for row in rows))
+        sent, failures = [], []
+        for row, error in zip(rows, errors):
+            if error is None:
+                sent.append(row.id)
+            elif _permanent(error) or row.attempts >= self.max_attempts:
+                failures.append((row.id, repr(error), None))
+            else:
+                failures.append((row.id, repr(error), self.backoff(row.attempts)))
+        async with self.session_factory() as db:
+            await repository_outbox.record_results(db, sent, failures)
+        self.batches += 1
+        self.sent += len(sent)
+        self.failed += sum(1 for *_, retry_in in failures if retry_in is None)
+        self.retried += sum(1 for *_, retry_in in failures if retry_in is not None)
+        return len(rows)
+
+    async def run(self):
+        """
+        Sends emails until cancelled. Meant to run as a background task.
+        """
+        while True:
+            self._wake.clear()
+            try:
+                claimed = await self.run_once()
+            except Exception as error:
+                print(error)
+                claimed = 0
+            if claimed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "retried": self.retried, "failed": self.failed, "batches": self.batches,
+                "smtp_connections_opened": self.pool.opened}
+
+
+email_worker = OutboxWorker(
+    SMTPPool(conf.MAIL_SERVER, conf.MAIL_PORT, conf.MAIL_USERNAME if conf.USE_CREDENTIALS else None,
+             conf.MAIL_PASSWORD, use_tls=conf.MAIL_SSL_TLS, start_tls=conf.MAIL_STARTTLS,
+             validate_certs=conf.VALIDATE_CERTS, size=settings.smtp_pool_size, max_idle=settings.smtp_max_idle),
+    batch_size=settings.email_outbox_batch_size,
+    poll_interval=settings.email_outbox_poll_interval,
+    max_attempts=settings.email_outbox_max_attempts,
+    backoff_seconds=settings.email_outbox_backoff_seconds,
+    backoff_max=settings.email_outbox_backoff_max,
+    lease_seconds=settings.email_outbox_lease_seconds,
+)
+
+
+def confirmation_email(username: str, host: str) -> tuple[str, dict]:
+    """
+    Builds the outbox entry of a confirmation email, e.g. to be queued together with a new user.
 
     Args:
-        email (EmailStr): The recipient's email address.
         username (str): The username of the recipient, used in the email template.
         host (str): The base URL of the application to include in the verification link.
 
-    Raises:
-        ConnectionErrors: Raised if there is a failure in connecting to the email server.
+    Returns:
+        tuple[str, dict]: The kind and payload of the email.
     """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
+    return CONFIRM_EMAIL, {"username": username, "host": str(host)}
+
+
+async def send_email(email: EmailStr, username: str, host: str, db: AsyncSession) -> bool:
+    """
+    Queues a confirmation email to the user's email address to verify the account.
+
+    The email is stored in the outbox and sent by :data:`email_worker`, which is woken up right away. The
+    verification token is generated when the email is sent. A confirmation email still waiting to be sent to
+    the same address is not queued twice.
 
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
+    Args:
+        email (EmailStr): The recipient's email address.
+        username (str): The username of the recipient, used in the email template.
+        host (str): The base URL of the application to include in the verification link.
+        db (AsyncSession): The database session.
 
+    Returns:
+        bool: True if the email was queued, False if one was already waiting.
+    """
+    kind, payload = confirmation_email(username, host)
+    queued = await repository_outbox.enqueue_email(db, kind, email, payload)
+    email_worker.wake()
+    return queued
@@ -0,0 +1,78 @@
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+
+from conf.config import settings
+
+
+class EmailTemplates:
+    """
+    Jinja environment of the email templates, created once and shared by every email sent by the process.
+
+    Compiled templates stay in the environment's cache for the life of the process, and templates are not
+    checked for changes on disk, as they only change with a deploy. The compiled bytecode is also written
+    to ``cache_dir`` (a directory under the system temp directory by default), so other workers and later
+    restarts load it instead of compiling the templates again. HTML templates are autoescaped.
+
+    Attributes:
+        env (jinja2.Environment): The environment.
+    """
+
+    def __init__(self, folder: Path, cache_dir: str | None = None):
+        self.env = Environment(
+            loader=FileSystemLoader(folder),
+            autoescape=select_autoescape(["html", "htm", "xml"]),
+            bytecode_cache=FileSystemBytecodeCache(cache_dir),
+            auto_reload=False,
+            cache_size=-1,
+        )
+
+    def precompile(self) -> list[str]:
+        """
+        Compiles every template of the folder, so the first emails do not pay for it.
+
+        :return: The names of the templates.
+        :rtype: list[str]
+        """
+        names = self.env.list_templates()
+        for name in names:
+            self.env.get_template(name)
+        return names
+
+    def render(self, name: str, **context) -> str:
+        """
+        Renders a template.
+
+        :param name: The template's file name.
+        :type name: str
+        :param context: The template variables.
+        :return: The rendered template.
+        :rtype: str
+        """
+        return self.env.get_template(name).render(context)
+
+    def render_many(self, name: str, contexts: Iterable[dict], **shared) -> Iterator[str]:
+        """
+        Renders a template once per context, e.g. one personalized email per recipient of a mailing.
+
+        The template is looked up once and each context only costs running its compiled code.
+
+        :param name: The template's file name.
+        :type name: str
+        :param contexts: The variables of each rendering.
+        :type contexts: Iterable[dict]
+        :param shared: Variables common to all renderings, overridden by those of a context.
+        :return: The rendered templates, in the order of the contexts.
+        :rtype: Iterator[str]
+        """
+        template = self.env.get_template(name)
+        new_context, render, concat = template.new_context, template.root_render_func, self.env.concat
+        for context in contexts:
+            try:
+                yield concat(render(new_context({**shared, **context})))
+            except Exception:
+                self.env.handle_exception()
+
+
+email_templates = EmailTemplates(Path(__file__).parent / 'templates', settings.email_template_cache_dir)
@@ -0,0 +1,122 @@
+import hashlib
+import time
+
+import redis.asyncio as redis
+from fastapi import Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import replica_router
+from services.redis_client import redis_client
+
+
+class ContactsVersion:
+    """
+    Per-user version of the contacts, shared by all workers through Redis, from which contact ETags are derived.
+
+    Every repository write stores the current time in nanoseconds as the new version, so versions never
+    repeat, even if the Redis key is lost. A user without a stored version gets one on the first read.
+
+    Attributes:
+        r (redis.asyncio.Redis): Redis instance holding the versions.
+    """
+
+    def __init__(self, r: redis.Redis):
+        self.r = r
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f"contacts-version:{user_id}"
+
+    async def get(self, user_id: int) -> int:
+        """
+        Returns the contacts version of a user.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :return: The version.
+        :rtype: int
+        """
+        version = await self.r.get(self.key(user_id))
+        if version is None:
+            version = time.time_ns()
+            if not await self.r.set(self.key(user_id), version, nx=True):
+                version = await self.r.get(self.key(user_id))
+        return int(version)
+
+    async def bump(self, user_id: int) -> tuple[int | None, int]:
+        """
+        Gives the contacts of a user a new version, after they changed.
+
+        The previous version is swapped out in the same command, so a caller can tell whether another
+        write happened between its own last read of the version and this one.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :return: The previous version, or None if there was none, and the new version.
+        :rtype: tuple[int | None, int]
+        """
+        version = time.time_ns()
+        previous = await self.r.set(self.key(user_id), version, get=True)
+        return (int(previous) if previous is not None else None), version
+
+    @staticmethod
+    def etag(version: int) -> str:
+        return f'W/"{version}"'
+
+    @staticmethod
+    def can_tag(version: int, db: AsyncSession) -> bool:
+        """
+        Tells whether a response read in the session may carry the ETag of the version.
+
+        A read replica may not have replayed a write made just before, so data read from a replica shortly
+        after the version changed is not tagged: otherwise the stale data could be revalidated until the next write.
+
+        :param version: The version read before the contacts.
+        :type version: int
+        :param db: The session the contacts were read in.
+        :type db: AsyncSession
+        :return: Whether the ETag may be sent.
+        :rtype: bool
+        """
+        if db.info.get("replica") is None:
+            return True
+        return not replica_router.wrote_recently(version)
+
+
+contacts_version = ContactsVersion(redis_client)
+
+
+def user_etag(user) -> str:
+    """
+    Derives the ETag of a user profile from its cached snapshot.
+
+    :param user: The user.
+    :type user: UserSnapshot
+    :return: The ETag.
+    :rtype: str
+    """
+    return f'W/"{hashlib.sha256(user.dumps()).hexdigest()[:32]}"'
+
+
+def if_none_match(request: Request, etag: str) -> bool:
+    """
+    Tells whether the ``If-None-Match`` header of a request matches an ETag, using weak comparison.
+
+    :param request: The incoming request.
+    :type request: Request
+    :param etag: The current ETag of the resource.
+    :type etag: str
+    :return: True if the client already has the current representation.
+    :rtype: bool
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
@@ -0,0 +1,107 @@
+import json
+
+from jose import jwk, jwt, JWTError
+from jose.constants import ALGORITHMS
+
+from conf.config import settings
+
+
+class KeySet:
+    """
+    Keys used to sign and verify the JWTs issued by the API.
+
+    With an HMAC algorithm (HS256, ...) tokens are signed and verified with ``SECRET_KEY``. With an asymmetric
+    algorithm (RS256, ES256, ...) tokens are signed with a private key and carry its key id in the ``kid``
+    header; the matching public key, and any older public keys still accepted during a key rotation, are
+    published as a JWKS document so other services can verify tokens without sharing a secret.
+
+    Keys are parsed once here, not on every encode and decode.
+
+    Attributes:
+        algorithm (str): The signing algorithm.
+        key_id (str | None): The key id put in the header of issued tokens.
+        signing_key (jose.jwk.Key): The key issued tokens are signed with.
+        verification_keys (dict): Keys accepted when verifying tokens, by key id.
+    """
+
+    def __init__(self, algorithm: str, secret_key: str, private_key: str | None = None, key_id: str | None = None,
+                 public_keys: list[dict] = ()):
+        self.algorithm = algorithm
+        self.key_id = key_id
+        self.verification_keys = {}
+        if algorithm in ALGORITHMS.HMAC:
+            self.signing_key = jwk.construct(secret_key, algorithm)
+            self.verification_keys[key_id] = self.signing_key
+            return
+        if private_key is None:
+            raise ValueError(f"JWT_PRIVATE_KEY_FILE is required for the {algorithm} algorithm")
+        self.signing_key = jwk.construct(private_key, algorithm)
+        self.verification_keys[key_id] = self.signing_key.public_key()
+        for public_key in public_keys:
+            self.verification_keys[public_key.get("kid")] = jwk.construct(public_key, algorithm)
+
+    @classmethod
+    def from_settings(cls, settings) -> "KeySet":
+        """
+        Builds the key set from the application settings, reading the key files they point to.
+
+        :param settings: The application settings.
+        :type settings: conf.config.Settings
+        :return: The key set.
+        :rtype: KeySet
+        """
+        private_key = public_keys = None
+        if settings.jwt_private_key_file:
+            with open(settings.jwt_private_key_file) as file:
+                private_key = file.read()
+        if settings.jwt_public_keys_file:
+            with open(settings.jwt_public_keys_file) as file:
+                public_keys = json.load(file)["keys"]
+        return cls(settings.algorithm, settings.secret_key, private_key, settings.jwt_key_id, public_keys or ())
+
+    def encode(self, claims: dict) -> str:
+        """
+        Signs a set of claims.
+
+        :param claims: The claims to encode.
+        :type claims: dict
+        :return: The encoded JWT.
+        :rtype: str
+        """
+        headers = {"kid": self.key_id} if self.key_id else None
+        return jwt.encode(claims, self.signing_key, algorithm=self.algorithm, headers=headers)
+
+    def decode(self, token: str) -> dict:
+        """
+        Verifies a token with the key named by its ``kid`` header and returns its claims.
+
+        :param token: The encoded JWT.
+        :type token: str
+        :return: The verified claims.
+        :rtype: dict
+        :raises JWTError: If the token is malformed, expired, signed with an unknown key or badly signed.
+        """
+        key = self.verification_keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise JWTError("Unknown signing key")
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+    def jwks(self) -> dict:
+        """
+        Returns the public keys that verify the tokens, as a JWKS document. It is empty for HMAC algorithms.
+
+        :return: The JWKS document.
+        :rtype: dict
+        """
+        if self.algorithm in ALGORITHMS.HMAC:
+            return {"keys": []}
+        keys = []
+        for key_id, key in self.verification_keys.items():
+            public_key = {**key.to_dict(), "use": "sig"}
+            if key_id is not None:
+                public_key["kid"] = key_id
+            keys.append(public_key)
+        return {"keys": keys}
+
+
+key_set = KeySet.from_settings(settings)
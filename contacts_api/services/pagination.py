@@ -0,0 +1,103 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int, rank: float | None = None) -> str:
+    """
+    Encodes the position of the last row on a page into an opaque pagination cursor.
+
+    :param last_id: The id of the last contact returned on the current page.
+    :type last_id: int
+    :param rank: The relevance rank of that contact, for result sets ordered by rank.
+    :type rank: float | None
+    :return: A URL-safe cursor string.
+    :rtype: str
+    """
+    position = {"id": last_id} if rank is None else {"id": last_id, "rank": rank}
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> dict:
+    invalid_cursor = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise invalid_cursor
+    if not isinstance(position, dict) or not isinstance(position.get("id"), int):
+        raise invalid_cursor
+    if not isinstance(position.get("rank", 0.0), (int, float)):
+        raise invalid_cursor
+    return position
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Decodes a pagination cursor produced by :func:`encode_cursor`.
+
+    :param cursor: The cursor received from the client.
+    :type cursor: str
+    :return: The id of the last contact of the previous page.
+    :rtype: int
+    :raises HTTPException: If the cursor is malformed (status 400).
+    """
+    return _decode(cursor)["id"]
+
+
+def decode_ranked_cursor(cursor: str) -> tuple[float, int]:
+    """
+    Decodes a pagination cursor of a result set ordered by relevance rank.
+
+    :param cursor: The cursor received from the client.
+    :type cursor: str
+    :return: The rank and the id of the last contact of the previous page.
+    :rtype: tuple[float, int]
+    :raises HTTPException: If the cursor is malformed or has no rank (status 400).
+    """
+    position = _decode(cursor)
+    if "rank" not in position:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return float(position["rank"]), position["id"]
+
+
+def encode_sync_token(changed_at: datetime, last_id: int) -> str:
+    """
+    Encodes the position of the last change returned by ``GET /api/contacts/changes`` into an opaque sync token.
+
+    :param changed_at: The time of the last change.
+    :type changed_at: datetime
+    :param last_id: The id of the contact that changed last.
+    :type last_id: int
+    :return: A URL-safe token string.
+    :rtype: str
+    """
+    raw = json.dumps({"at": changed_at.isoformat(), "id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> tuple[datetime, int]:
+    """
+    Decodes a sync token produced by :func:`encode_sync_token`.
+
+    :param token: The token received from the client.
+    :type token: str
+    :return: The time and the contact id of the last change already synced.
+    :rtype: tuple[datetime, int]
+    :raises HTTPException: If the token is malformed (status 400).
+    """
+    invalid_token = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid sync token")
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        changed_at = datetime.fromisoformat(position["at"])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise invalid_token
+    if not isinstance(position.get("id"), int) or changed_at.tzinfo is not None:
+        raise invalid_token
+    return changed_at, position["id"]
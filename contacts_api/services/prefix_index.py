@@ -0,0 +1,244 @@
+import sys
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from conf.config import settings
+
+
+class UserPrefixIndex:
+    """
+    Sorted-array prefix index over the names and emails of one user's contacts.
+
+    Every contact is indexed under its lowercased first name, last name, "first last" full name and email.
+    A prefix lookup is a binary search followed by a scan of the keys that start with the prefix.
+
+    Attributes:
+        contacts (dict): Indexed fields of every contact, by contact id.
+        keys (list): Sorted ``(key, contact_id)`` pairs.
+        size (int): Approximate memory footprint of the index in bytes.
+    """
+
+    def __init__(self, rows=()):
+        self.contacts = {}
+        self.keys = []
+        self.size = 0
+        for contact_id, first_name, last_name, email in rows:
+            self.contacts[contact_id] = (first_name, last_name, email)
+            for key in self._keys(first_name, last_name, email):
+                self.keys.append((key, contact_id))
+                self.size += self._entry_size(key)
+        self.keys.sort()
+
+    @staticmethod
+    def _keys(first_name, last_name, email):
+        names = (first_name, last_name, email, f"{first_name or ''} {last_name or ''}".strip())
+        return {name.lower() for name in names if name}
+
+    @staticmethod
+    def _entry_size(key: str) -> int:
+        # the key string, its (key, id) tuple and list slot, and a share of the contact's fields
+        return sys.getsizeof(key) * 2 + 80
+
+    def add(self, contact_id: int, first_name: str, last_name: str, email: str):
+        """
+        Adds a contact to the index, replacing its previous entries if it is already indexed.
+
+        :param contact_id: The id of the contact.
+        :type contact_id: int
+        :param first_name: The first name of the contact.
+        :type first_name: str
+        :param last_name: The last name of the contact.
+        :type last_name: str
+        :param email: The email of the contact.
+        :type email: str
+        """
+        self.remove(contact_id)
+        self.contacts[contact_id] = (first_name, last_name, email)
+        for key in self._keys(first_name, last_name, email):
+            insort(self.keys, (key, contact_id))
+            self.size += self._entry_size(key)
+
+    def remove(self, contact_id: int):
+        """
+        Removes a contact from the index if it is indexed.
+
+        :param contact_id: The id of the contact.
+        :type contact_id: int
+        """
+        fields = self.contacts.pop(contact_id, None)
+        if fields is None:
+            return
+        for key in self._keys(*fields):
+            position = bisect_left(self.keys, (key, contact_id))
+            if position < len(self.keys) and self.keys[position] == (key, contact_id):
+                del self.keys[position]
+                self.size -= self._entry_size(key)
+
+    def search(self, prefix: str, limit: int) -> list[dict]:
+        """
+        Finds contacts with a name or email starting with the prefix, in alphabetical order of the matched key.
+
+        :param prefix: The prefix typed by the user.
+        :type prefix: str
+        :param limit: The maximum number of contacts to return.
+        :type limit: int
+        :return: The matching contacts as dicts with id, first_name, last_name and email.
+        :rtype: list[dict]
+        """
+        prefix = prefix.lower()
+        found = []
+        seen = set()
+        position = bisect_left(self.keys, (prefix,))
+        while position < len(self.keys) and len(found) < limit:
+            key, contact_id = self.keys[position]
+            if not key.startswith(prefix):
+                break
+            if contact_id not in seen:
+                seen.add(contact_id)
+                first_name, last_name, email = self.contacts[contact_id]
+                found.append({"id": contact_id, "first_name": first_name, "last_name": last_name, "email": email})
+            position += 1
+        return found
+
+
+class PrefixIndex:
+    """
+    Per-user prefix indexes kept in process memory, evicted least recently used first over a memory budget.
+
+    Indexes are built lazily by the repository on the first suggestion request of a user. Each index is
+    tagged with the user's contacts version (:data:`services.etag.contacts_version`), which is shared by all
+    workers through Redis and changes on every write. An index whose tag no longer matches the current
+    version is dropped and rebuilt, so writes handled by other workers are seen on the next request. Writes
+    handled by this worker update the index in place when no other write happened since it was tagged.
+
+    Attributes:
+        enabled (bool): Whether suggestions are served from memory.
+        memory_budget (int): Approximate total size of all indexes in bytes before eviction starts.
+    """
+
+    def __init__(self, enabled: bool, memory_budget: int):
+        self.enabled = enabled
+        self.memory_budget = memory_budget
+        self._indexes = OrderedDict()
+        self._versions = {}
+        self.size = 0
+
+    def get(self, user_id: int, version: int) -> UserPrefixIndex | None:
+        """
+        Returns the index of a user if it is up to date with the version, marking it as recently used.
+        An index built for an older version is dropped.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :param version: The current contacts version of the user.
+        :type version: int
+        :return: The index, or None if it is not loaded or out of date.
+        :rtype: UserPrefixIndex | None
+        """
+        index = self._indexes.get(user_id)
+        if index is None:
+            return None
+        if self._versions.get(user_id) != version:
+            self._discard(user_id)
+            return None
+        self._indexes.move_to_end(user_id)
+        return index
+
+    def put(self, user_id: int, rows, version: int) -> UserPrefixIndex:
+        """
+        Builds the index of a user from ``(id, first_name, last_name, email)`` rows.
+
+        If a write happens while the rows are loaded, the version changes and the index is rebuilt on the
+        next request, as the rows may not contain it.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :param rows: The contacts of the user.
+        :param version: The contacts version of the user, read before the rows were loaded.
+        :type version: int
+        :return: The built index.
+        :rtype: UserPrefixIndex
+        """
+        index = UserPrefixIndex(rows)
+        self._discard(user_id)
+        self._indexes[user_id] = index
+        self._versions[user_id] = version
+        self.size += index.size
+        self._evict()
+        return index
+
+    def _current(self, user_id: int, previous: int | None, version: int) -> UserPrefixIndex | None:
+        # the index may only be patched if it had seen every write before this one, otherwise it is dropped
+        index = self._indexes.get(user_id)
+        if index is None:
+            return None
+        if self._versions.get(user_id) != previous:
+            self._discard(user_id)
+            return None
+        self._versions[user_id] = version
+        return index
+
+    def contact_saved(self, user_id: int, contact, previous: int | None, version: int):
+        """
+        Updates the index of a user after one of their contacts was created or updated.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :param contact: The saved contact.
+        :type contact: models.Contact
+        :param previous: The contacts version replaced by the write.
+        :type previous: int | None
+        :param version: The contacts version set by the write.
+        :type version: int
+        """
+        index = self._current(user_id, previous, version)
+        if index is not None:
+            self.size -= index.size
+            index.add(contact.id, contact.first_name, contact.last_name, contact.email)
+            self.size += index.size
+            self._evict()
+
+    def contact_deleted(self, user_id: int, contact_id: int, previous: int | None, version: int):
+        """
+        Updates the index of a user after one of their contacts was deleted.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :param contact_id: The id of the deleted contact.
+        :type contact_id: int
+        :param previous: The contacts version replaced by the write.
+        :type previous: int | None
+        :param version: The contacts version set by the write.
+        :type version: int
+        """
+        index = self._current(user_id, previous, version)
+        if index is not None:
+            self.size -= index.size
+            index.remove(contact_id)
+            self.size += index.size
+
+    def invalidate(self, user_id: int):
+        """
+        Drops the index of a user after a write that may have changed any number of their contacts.
+        The index is rebuilt on the next suggestion request.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        """
+        self._discard(user_id)
+
+    def _discard(self, user_id: int):
+        self._versions.pop(user_id, None)
+        index = self._indexes.pop(user_id, None)
+        if index is not None:
+            self.size -= index.size
+
+    def _evict(self):
+        # always keep the most recently used index, even if it alone exceeds the budget
+        while self.size > self.memory_budget and len(self._indexes) > 1:
+            user_id, index = self._indexes.popitem(last=False)
+            del self._versions[user_id]
+            self.size -= index.size
+
+
+prefix_index = PrefixIndex(settings.prefix_index_enabled, settings.prefix_index_memory_budget)
@@ -0,0 +1,171 @@
+import math
+import time
+from collections import OrderedDict
+
+import redis.asyncio as redis
+from fastapi import Depends, HTTPException, Request, status
+
+import models
+from conf.config import settings
+from services.auth import auth_service
+from services.redis_client import redis_client
+
+
+class SlidingWindow:
+    """
+    Request counter approximating a sliding window from two fixed windows stored in Redis.
+
+    The count of the current window is added to the count of the previous one, weighted by the part of the
+    previous window still inside the sliding window. Each check is one pipelined round-trip (INCRBY, EXPIRE
+    and GET), without a Lua script.
+
+    A worker also keeps, per key, the count it saw at its last check, and admits requests without asking
+    Redis while it is clearly under the limit: as long as its requests since that check stay within
+    ``local_share`` of the quota that was left. Those requests are added to Redis at the next check, so each
+    worker may overshoot the limit by at most that share.
+
+    Attributes:
+        r (redis.asyncio.Redis): Redis instance holding the counters.
+        local_share (float): Share of the remaining quota a worker may admit between two checks.
+        local_size (int): Maximum number of keys whose last check is remembered.
+    """
+
+    def __init__(self, r: redis.Redis, local_share: float = 0.1, local_size: int = 10000):
+        self.r = r
+        self.local_share = local_share
+        self.local_size = local_size
+        self.redis_checks = 0
+        self.local_checks = 0
+        # key -> [window index, count at the last check, requests admitted locally since]
+        self._local = OrderedDict()
+
+    async def hit(self, key: str, limit: int, seconds: int) -> tuple[float, float]:
+        """
+        Counts a request and returns the number of requests in the sliding window, this one included.
+
+        :param key: Identifies the client and the limit.
+        :type key: str
+        :param limit: The number of requests allowed per window.
+        :type limit: int
+        :param seconds: The length of the window.
+        :type seconds: int
+        :return: The request count, and the number of seconds until the current fixed window ends.
+        :rtype: tuple[float, float]
+        """
+        now = time.time()
+        window, elapsed = divmod(now, seconds)
+        reset = seconds - elapsed
+        state = self._local.get(key)
+        if state is not None and state[0] == window:
+            budget = math.floor((limit - state[1]) * self.local_share)
+            if state[2] < budget:
+                state[2] += 1
+                self.local_checks += 1
+                return state[1] + state[2], reset
+        pending = state[2] + 1 if state is not None else 1
+
+        current, previous = f"rate:{key}:{int(window)}", f"rate:{key}:{int(window) - 1}"
+        async with self.r.pipeline(transaction=False) as pipe:
+            pipe.incrby(current, pending)
+            pipe.expire(current, seconds * 2)
+            pipe.get(previous)
+            count, _, previous_count = await pipe.execute()
+        self.redis_checks += 1
+        count += int(previous_count or 0) * (1 - elapsed / seconds)
+        self._local[key] = [window, count, 0]
+        self._local.move_to_end(key)
+        if len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+        return count, reset
+
+    def stats(self) -> dict:
+        return {"redis_checks": self.redis_checks, "local_checks": self.local_checks, "keys": len(self._local)}
+
+
+sliding_window = SlidingWindow(redis_client, settings.rate_limit_local_share)
+
+
+class RateLimit:
+    """
+    Dependency limiting the requests of each authenticated user to a route.
+
+    Limits are multiplied by the user's entry in ``settings.rate_limit_user_multipliers``, if any, so some
+    users can get a larger or smaller quota. The ``RateLimit-Limit``, ``RateLimit-Remaining`` and
+    ``RateLimit-Reset`` headers are added to the response by :class:`RateLimitHeadersMiddleware`.
+
+    Attributes:
+        times (int): The number of requests allowed per window.
+        seconds (int): The length of the window in seconds.
+    """
+
+    def __init__(self, times: int, seconds: int):
+        self.times = times
+        self.seconds = seconds
+
+    def quota(self, user: models.User) -> int:
+        return max(1, round(self.times * settings.rate_limit_user_multipliers.get(user.id, 1)))
+
+    async def __call__(self, request: Request, user: models.User = Depends(auth_service.get_current_user)):
+        await self.check(request, f"user:{user.id}", self.quota(user))
+
+    async def check(self, request: Request, client: str, limit: int):
+        """
+        Counts the request of a client and rejects it when the client is over the limit.
+
+        :param request: The incoming request.
+        :type request: Request
+        :param client: Identifies the client.
+        :type client: str
+        :param limit: The number of requests allowed per window.
+        :type limit: int
+        :raises HTTPException: If the client is over the limit (429).
+        """
+        route = request.scope.get("route")
+        path = route.path if route is not None else request.url.path
+        count, reset = await sliding_window.hit(f"{request.method}:{path}:{client}", limit, self.seconds)
+        headers = {
+            "RateLimit-Limit": str(limit),
+            "RateLimit-Remaining": str(max(0, math.floor(limit - count))),
+            "RateLimit-Reset": str(math.ceil(reset)),
+        }
+        if count > limit:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too Many Requests",
+                                headers={**headers, "Retry-After": headers["RateLimit-Reset"]})
+        request.state.rate_limit_headers = headers
+
+
+class IPRateLimit(RateLimit):
+    """
+    Dependency limiting the requests to a public route by client address.
+    """
+
+    async def __call__(self, request: Request):
+        await self.check(request, f"ip:{request.client.host if request.client else ''}", self.times)
+
+
+class RateLimitHeadersMiddleware:
+    """
+    ASGI middleware adding the headers set by :class:`RateLimit` to the response, including responses
+    returned directly by a route, which do not get the headers of FastAPI's ``Response`` parameter.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # created here, so the route and the middleware share it even if the scope gets copied on the way
+        state = scope.setdefault("state", {})
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = state.get("rate_limit_headers")
+                if headers:
+                    message["headers"] = [*message.get("headers", []),
+                                          *((name.lower().encode(), value.encode()) for name, value in headers.items())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,10 @@
+import redis.asyncio as redis
+
+from conf.config import settings
+
+
+# One connection pool per worker, shared by the rate limiter and the user cache.
+# Connections are opened on first use and closed by the application lifespan.
+pool = redis.BlockingConnectionPool(host=settings.redis_host, port=settings.redis_port, db=0,
+                                    max_connections=settings.redis_max_connections, timeout=5)
+redis_client = redis.Redis(connection_pool=pool)
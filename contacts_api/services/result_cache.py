@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+from typing import Awaitable, Callable
+
+import orjson
+import redis.asyncio as redis
+
+from conf.config import settings
+from services.redis_client import redis_client
+
+
+class ResultCache:
+    """
+    Redis cache of the JSON bodies of the read-only contact endpoints.
+
+    Entries are keyed by user, endpoint and parameters, and by the user's contacts version
+    (:class:`services.etag.ContactsVersion`), which every write to the user's contacts changes. A write
+    thus invalidates all cached results of the user at once without deleting anything: later reads look
+    under the new version, and entries of old versions expire after ``ttl`` seconds.
+
+    Concurrent misses on the same key in one worker are coalesced: the first request fills the entry and
+    the others wait for its result instead of running the same query.
+
+    Attributes:
+        r (redis.asyncio.Redis): Redis instance holding the results.
+        ttl (int): Lifetime of an entry in seconds.
+        enabled (bool): Whether results are cached at all.
+        hits (int): Number of lookups answered from Redis.
+        misses (int): Number of lookups that ran the query.
+        coalesced (int): Number of lookups that waited for a concurrent miss instead of running the query.
+    """
+
+    def __init__(self, r: redis.Redis, ttl: int = 300, enabled: bool = True):
+        self.r = r
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._flights = {}
+
+    @staticmethod
+    def key(user_id: int, version: int, endpoint: str, params: dict) -> str:
+        digest = hashlib.sha256(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()[:32]
+        return f"contacts-cache:{user_id}:{version}:{endpoint}:{digest}"
+
+    async def get_or_fill(self, key: str,
+                          fill: Callable[[], Awaitable[tuple[bytes, dict, bool]]]) -> tuple[bytes, dict]:
+        """
+        Returns the cached result under a key, or fills it.
+
+        :param key: The key, see :meth:`key`.
+        :type key: str
+        :param fill: Computes the result: the response body, its headers, and whether it may be cached.
+        :type fill: Callable[[], Awaitable[tuple[bytes, dict, bool]]]
+        :return: The response body and its headers.
+        :rtype: tuple[bytes, dict]
+        """
+        if not self.enabled:
+            body, headers, _ = await fill()
+            return body, headers
+        data = await self.r.get(key)
+        if data is not None:
+            self.hits += 1
+            headers, body = data.split(b"\n", 1)
+            return body, orjson.loads(headers)
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            try:
+                # shielded, so a cancelled waiter does not cancel the result for the others
+                return await asyncio.shield(flight)
+            except Exception:
+                # the request filling the entry failed, this one runs the query itself
+                body, headers, _ = await fill()
+                return body, headers
+
+        self.misses += 1
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            body, headers, cacheable = await fill()
+            if cacheable:
+                # orjson never writes a raw newline, so the first one ends the headers
+                await self.r.set(key, orjson.dumps(headers) + b"\n" + body, ex=self.ttl)
+        except BaseException as error:
+            flight.set_exception(error if isinstance(error, Exception) else RuntimeError("Cache fill interrupted"))
+            # marks the exception as retrieved when nobody is waiting
+            flight.exception()
+            raise
+        else:
+            flight.set_result((body, headers))
+        finally:
+            del self._flights[key]
+        return body, headers
+
+    def stats(self) -> dict:
+        """
+        Returns the lookup counters and the hit rate.
+
+        :return: Counters, plus the number of fills in progress.
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses + self.coalesced
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                "in_flight": len(self._flights)}
+
+
+result_cache = ResultCache(redis_client, settings.result_cache_ttl, settings.result_cache_enabled)
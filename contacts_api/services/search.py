@@ -0,0 +1,40 @@
+import re
+
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+def trigrams(text: str) -> set[str]:
+    """
+    Extracts the set of trigrams of a string the same way Postgres ``pg_trgm`` does.
+
+    The text is lowercased and split into alphanumeric words; each word is padded with two spaces in front
+    and one space behind before its three-character substrings are taken.
+
+    :param text: The text to split into trigrams.
+    :type text: str
+    :return: The set of trigrams.
+    :rtype: set[str]
+    """
+    result = set()
+    for word in _WORD.findall(text.lower()):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    Computes the trigram similarity of two strings, a pure-Python equivalent of ``pg_trgm.similarity``.
+
+    :param a: The first string.
+    :type a: str
+    :param b: The second string.
+    :type b: str
+    :return: The number of shared trigrams divided by the number of distinct trigrams, from 0 to 1.
+    :rtype: float
+    """
+    trigrams_a, trigrams_b = trigrams(a), trigrams(b)
+    if not trigrams_a or not trigrams_b:
+        return 0.0
+    return len(trigrams_a & trigrams_b) / len(trigrams_a | trigrams_b)
@@ -0,0 +1,42 @@
+import orjson
+from fastapi import Response
+
+import schemas
+
+
+# the fields of schemas.ContactResponse, in the order the repository selects them
+CONTACT_FIELDS = tuple(schemas.ContactResponse.model_fields)
+
+
+def contact_dicts(rows) -> list[dict]:
+    """
+    Turns contact rows selected with ``repository.contacts.CONTACT_COLUMNS`` into dicts keyed by field name.
+
+    Extra columns selected after the contact fields, such as a search rank, are left out.
+
+    :param rows: The rows.
+    :type rows: list[Row]
+    :return: A dict per row.
+    :rtype: list[dict]
+    """
+    return [dict(zip(CONTACT_FIELDS, row)) for row in rows]
+
+
+def contacts_body(rows) -> bytes:
+    """
+    Serializes a list of contact rows in one ``orjson.dumps`` call.
+
+    Rows read from the database already have the shape of :class:`schemas.ContactResponse`, so they skip the
+    per-object validation FastAPI applies to a ``response_model``, which dominates the cost of large pages.
+
+    :param rows: Rows selected with ``repository.contacts.CONTACT_COLUMNS``.
+    :type rows: list[Row]
+    :return: The JSON array of the contacts.
+    :rtype: bytes
+    """
+    return orjson.dumps(contact_dicts(rows))
+
+
+def json_response(body: bytes, headers: dict | None = None) -> Response:
+    return Response(body, media_type="application/json", headers=headers)
+
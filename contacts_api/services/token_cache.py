@@ -0,0 +1,82 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from conf.config import settings
+
+
+class TokenCache:
+    """
+    Bounded in-process cache of verified JWT claims, so a token presented many times is verified once.
+
+    Entries are keyed by the SHA-256 digest of the token, so raw tokens are never kept in memory,
+    and expire together with the token itself. The least recently used entry is evicted first.
+
+    Attributes:
+        max_size (int): Maximum number of tokens kept.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that had to verify the token.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        """
+        Returns the claims of a token verified earlier, unless the token has expired since.
+
+        :param token: The encoded JWT.
+        :type token: str
+        :return: The verified claims, or None if the token is not cached.
+        :rtype: dict | None
+        """
+        key = self.key(token)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, token: str, claims: dict) -> None:
+        """
+        Caches the claims of a verified token until its ``exp`` claim. Tokens without ``exp`` are not cached.
+
+        :param token: The encoded JWT.
+        :type token: str
+        :param claims: The claims returned by the verification.
+        :type claims: dict
+        """
+        expires = claims.get("exp")
+        if self.max_size <= 0 or not isinstance(expires, (int, float)):
+            return
+        key = self.key(token)
+        self._entries[key] = (expires, claims)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters of the cache.
+
+        :return: Counters, plus the number of tokens held.
+        :rtype: dict
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+token_cache = TokenCache(settings.token_cache_size)
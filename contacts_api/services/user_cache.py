@@ -0,0 +1,213 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+import orjson
+import redis.asyncio as redis
+
+from conf.config import settings
+from services.redis_client import redis_client
+
+
+@dataclass(slots=True, frozen=True)
+class UserSnapshot:
+    """
+    The fields of an authenticated user that request handlers need, without the password hash or tokens.
+
+    Attributes:
+        id (int): The user id.
+        username (str): The user name.
+        email (str): The user email.
+        created_at (datetime): When the user signed up.
+        avatar (str): The avatar URL.
+        confirmed (bool): Whether the email is confirmed.
+    """
+    FORMAT_VERSION = 1
+
+    id: int
+    username: str | None
+    email: str
+    created_at: datetime | None
+    avatar: str | None
+    confirmed: bool
+
+    @classmethod
+    def from_user(cls, user) -> "UserSnapshot":
+        """
+        Takes a snapshot of a user loaded from the database.
+
+        :param user: The user.
+        :type user: models.User
+        :return: The snapshot.
+        :rtype: UserSnapshot
+        """
+        return cls(user.id, user.username, user.email, user.created_at, user.avatar, bool(user.confirmed))
+
+    def dumps(self) -> bytes:
+        """
+        Serializes the snapshot to a compact JSON array.
+
+        :return: The serialized snapshot.
+        :rtype: bytes
+        """
+        return orjson.dumps([self.FORMAT_VERSION, self.id, self.username, self.email, self.created_at,
+                             self.avatar, self.confirmed])
+
+    @classmethod
+    def loads(cls, data: bytes) -> "UserSnapshot | None":
+        """
+        Deserializes a snapshot produced by :meth:`dumps`.
+
+        :param data: The serialized snapshot.
+        :type data: bytes
+        :return: The snapshot, or None if it was written in another format version.
+        :rtype: UserSnapshot | None
+        """
+        try:
+            version, id, username, email, created_at, avatar, confirmed = orjson.loads(data)
+        except (orjson.JSONDecodeError, ValueError, TypeError):
+            return None
+        if version != cls.FORMAT_VERSION:
+            return None
+        created_at = datetime.fromisoformat(created_at) if created_at is not None else None
+        return cls(id, username, email, created_at, avatar, confirmed)
+
+
+class UserCache:
+    """
+    Two-tier cache of :class:`UserSnapshot` objects by email: a small in-process LRU in front of Redis.
+
+    Redis keys carry the snapshot format version, so a deploy that changes the format never reads old entries.
+    Local entries live for a few seconds only. When a user changes, :meth:`invalidate` drops the Redis entry
+    and publishes the email on a Redis channel, and every worker running :meth:`listen` drops its local entry.
+
+    Attributes:
+        r (redis.asyncio.Redis): Redis instance holding the snapshots.
+        ttl (int): Lifetime of a snapshot in Redis in seconds.
+        local_size (int): Maximum number of snapshots kept in process memory.
+        local_ttl (float): Lifetime of a snapshot in process memory in seconds.
+        hits (dict): Number of lookups answered by each tier.
+        misses (dict): Number of lookups each tier could not answer.
+    """
+    CHANNEL = "user-cache:invalidate"
+
+    def __init__(self, r: redis.Redis, ttl: int = 900, local_size: int = 1024, local_ttl: float = 30):
+        self.r = r
+        self.ttl = ttl
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self.hits = {"local": 0, "redis": 0}
+        self.misses = {"local": 0, "redis": 0}
+        self._local = OrderedDict()
+        self._generation = 0
+
+    @staticmethod
+    def key(email: str) -> str:
+        return f"user:v{UserSnapshot.FORMAT_VERSION}:{email}"
+
+    async def get(self, email: str) -> UserSnapshot | None:
+        """
+        Returns the cached snapshot of a user, from process memory if possible, otherwise from Redis.
+
+        :param email: The user email.
+        :type email: str
+        :return: The snapshot, or None on a miss in both tiers.
+        :rtype: UserSnapshot | None
+        """
+        entry = self._local.get(email)
+        if entry is not None and entry[0] > time.monotonic():
+            self._local.move_to_end(email)
+            self.hits["local"] += 1
+            return entry[1]
+        if entry is not None:
+            del self._local[email]
+        self.misses["local"] += 1
+        generation = self._generation
+
+        data = await self.r.get(self.key(email))
+        snapshot = UserSnapshot.loads(data) if data is not None else None
+        if snapshot is None:
+            self.misses["redis"] += 1
+            return None
+        self.hits["redis"] += 1
+        self._remember(snapshot, generation)
+        return snapshot
+
+    async def set(self, snapshot: UserSnapshot) -> None:
+        """
+        Caches the snapshot of a user in both tiers. The value and its expiry are written in one round-trip.
+
+        :param snapshot: The snapshot.
+        :type snapshot: UserSnapshot
+        """
+        generation = self._generation
+        await self.r.set(self.key(snapshot.email), snapshot.dumps(), ex=self.ttl)
+        self._remember(snapshot, generation)
+
+    async def invalidate(self, email: str) -> None:
+        """
+        Drops the cached snapshot of a user from Redis and from the process memory of every worker.
+
+        :param email: The user email.
+        :type email: str
+        """
+        async with self.r.pipeline(transaction=False) as pipe:
+            pipe.delete(self.key(email))
+            pipe.publish(self.CHANNEL, email)
+            await pipe.execute()
+        self._forget(email)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters of each tier.
+
+        :return: Counters by tier, plus the number of snapshots held in process memory.
+        :rtype: dict
+        """
+        return {
+            "local": {"hits": self.hits["local"], "misses": self.misses["local"], "size": len(self._local)},
+            "redis": {"hits": self.hits["redis"], "misses": self.misses["redis"]},
+        }
+
+    async def listen(self) -> None:
+        """
+        Applies invalidations published by other workers until cancelled. Meant to run as a background task.
+
+        While the subscription is down, invalidations may be missed, so the local tier is cleared on reconnect.
+        """
+        while True:
+            try:
+                async with self.r.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.CHANNEL)
+                    async for message in pubsub.listen():
+                        self._on_invalidate(message)
+            except (redis.ConnectionError, redis.TimeoutError):
+                self._clear()
+                await asyncio.sleep(1)
+
+    def _on_invalidate(self, message: dict) -> None:
+        email = message["data"]
+        self._forget(email.decode() if isinstance(email, bytes) else email)
+
+    def _remember(self, snapshot: UserSnapshot, generation: int) -> None:
+        # An invalidation since the snapshot was read means it may be stale
+        if generation != self._generation:
+            return
+        self._local[snapshot.email] = (time.monotonic() + self.local_ttl, snapshot)
+        self._local.move_to_end(snapshot.email)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    def _forget(self, email: str) -> None:
+        self._generation += 1
+        self._local.pop(email, None)
+
+    def _clear(self) -> None:
+        self._generation += 1
+        self._local.clear()
+
+
+user_cache = UserCache(redis_client, local_size=settings.user_cache_local_size,
+                       local_ttl=settings.user_cache_local_ttl)
@@ -2,19 +2,27 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
 from main import app
 from models import Base
-from src.db import get_db
+from db import get_db, get_read_db
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# TestClient may run each request on its own event loop, so connections must not be pooled
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession,
+                                              autoflush=False, expire_on_commit=False)
+
 
 @pytest.fixture(scope="module")
 def session():
@@ -34,13 +42,12 @@ def session():
 def client(session):
     # Dependency override
 
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    async def override_get_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
 
     yield TestClient(app)
 
@@ -1,11 +1,8 @@
-from unittest.mock import MagicMock
+from models import EmailOutbox, User
+from services.email import CONFIRM_EMAIL
 
-from models import User
 
-
-def test_create_user(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("routes.auth.send_email", mock_send_email)
+def test_create_user(client, session, user):
     response = client.post(
         "/api/auth/signup",
         json=user,
@@ -14,6 +11,8 @@ def test_create_user(client, user, monkeypatch):
     data = response.json()
     assert data["user"]["email"] == user.get("email")
     assert "id" in data["user"]
+    email = session.query(EmailOutbox).filter(EmailOutbox.recipient == user.get("email")).one()
+    assert (email.kind, email.status) == (CONFIRM_EMAIL, "pending")
 
 
 def test_repeat_create_user(client, user):
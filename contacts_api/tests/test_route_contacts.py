@@ -0,0 +1,310 @@
+import csv
+import io
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from main import app
+from models import Contact
+from services.auth import auth_service
+from services.etag import contacts_version
+from services.pagination import encode_cursor
+from services.rate_limit import RateLimit
+from services.result_cache import result_cache
+
+
+class DictRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, nx=False, ex=None, get=False):
+        if nx and key in self.data:
+            return None
+        previous = self.data.get(key)
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+        return previous if get else True
+
+
+@pytest.fixture(scope="module")
+def auth_client(client):
+    overrides = {auth_service.get_current_user: lambda: SimpleNamespace(id=1)}
+    for route in app.routes:
+        for dependency in getattr(route, "dependant", SimpleNamespace(dependencies=[])).dependencies:
+            if isinstance(dependency.call, RateLimit):
+                overrides[dependency.call] = lambda: None
+    app.dependency_overrides.update(overrides)
+    redis = DictRedis()
+    with patch.object(contacts_version, "r", redis), patch.object(result_cache, "r", redis):
+        yield client
+    for dependency in overrides:
+        del app.dependency_overrides[dependency]
+
+
+def contact(n, **fields):
+    return {"first_name": f"John{n}", "last_name": "Doe", "email": f"john{n}@example.com",
+            "phone_number": "+380501234567", "birthday": "1990-05-17T00:00:00", **fields}
+
+
+def test_import_ndjson(auth_client, session, monkeypatch):
+    monkeypatch.setattr("services.contact_import.settings.contact_import_batch_size", 2)
+    lines = [json.dumps(contact(1)), json.dumps(contact(2, additional_info="friend")), "",
+             json.dumps(contact(3, email="not-an-email")), "{broken", json.dumps(contact(4)),
+             json.dumps(contact(1, first_name="Duplicate")), json.dumps(contact(5))]
+    response = auth_client.post("/api/contacts/bulk", content="\n".join(lines),
+                                headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 4
+    assert data["failed"] == 3
+    assert [error["row"] for error in data["errors"]] == [3, 4, 6]
+    assert data["errors"][1]["errors"] == ["Invalid JSON"]
+    assert data["errors"][2]["errors"] == ["email: Contact with this email already exists"]
+    contacts = session.query(Contact).order_by(Contact.id).all()
+    assert [c.first_name for c in contacts] == ["John1", "John2", "John4", "John5"]
+    assert {c.user_id for c in contacts} == {1}
+    assert contacts[1].additional_info == "friend"
+
+
+def test_import_csv(auth_client, session):
+    body = ("first_name,last_name,email,phone_number,birthday,additional_info\r\n"
+            'Jane,Roe,jane@example.com,+380501234567,1991-02-03,"met at work,\nsecond line"\r\n'
+            "Jim,Roe,jim@example.com,+380501234567,1992-03-04,\r\n"
+            "Jack,Roe,jack@example.com,+380501234567\r\n"
+            "Jill,Roe,jill@example.com,+380501234567,1993-04-05,\r\n"
+            "Joe,Roe,jill@example.com,+380501234567,1994-05-06,\r\n")
+    response = auth_client.post("/api/contacts/bulk", content=body.encode(),
+                                headers={"Content-Type": "text/csv; charset=utf-8"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 3
+    assert data["errors"] == [{"row": 3, "errors": ["Expected 6 fields, got 4"]},
+                              {"row": 5, "errors": ["email: Duplicate of row 4"]}]
+    jane = session.query(Contact).filter(Contact.email == "jane@example.com").one()
+    assert jane.additional_info == "met at work,\nsecond line"
+    jim = session.query(Contact).filter(Contact.email == "jim@example.com").one()
+    assert jim.additional_info is None
+
+
+def test_import_unsupported_type(auth_client):
+    response = auth_client.post("/api/contacts/bulk", content=b"<xml/>", headers={"Content-Type": "text/xml"})
+    assert response.status_code == 415, response.text
+
+
+@pytest.fixture
+def export_session(monkeypatch):
+    from tests.conftest import AsyncTestingSessionLocal
+    monkeypatch.setattr("routes.contacts.read_session", lambda client_key, version: AsyncTestingSessionLocal())
+
+
+def test_export_csv(auth_client, session, export_session):
+    response = auth_client.get("/api/contacts/export")
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    assert response.headers["content-disposition"] == 'attachment; filename="contacts.csv"'
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "first_name", "last_name", "email", "phone_number", "birthday", "additional_info"]
+    assert rows[1] == ["1", "John1", "Doe", "john1@example.com", "+380501234567", "1990-05-17T00:00:00", ""]
+    assert len(rows) == session.query(Contact).count() + 1
+    assert ["met at work,\nsecond line"] == [row[6] for row in rows if row[3] == "jane@example.com"]
+
+
+def test_export_ndjson(auth_client, session, export_session):
+    response = auth_client.get("/api/contacts/export", params={"format": "ndjson"})
+    assert response.status_code == 200, response.text
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [c.id for c in session.query(Contact).order_by(Contact.id)]
+    assert rows[1] == {"id": 2, **contact(2, additional_info="friend")}
+
+
+def test_export_vcard(auth_client, export_session):
+    response = auth_client.get("/api/contacts/export", params={"format": "vcard"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "text/vcard; charset=utf-8"
+    first_card = response.text.split("END:VCARD\r\n")[0]
+    assert first_card == ("BEGIN:VCARD\r\nVERSION:4.0\r\nFN:John1 Doe\r\nN:Doe;John1;;;\r\n"
+                          "EMAIL:john1@example.com\r\nTEL:+380501234567\r\nBDAY:19900517\r\n")
+    assert "NOTE:met at work\\,\\nsecond line\r\n" in response.text
+
+
+def test_export_unknown_format(auth_client):
+    response = auth_client.get("/api/contacts/export", params={"format": "xml"})
+    assert response.status_code == 422, response.text
+
+
+def test_bulk_update(auth_client, session):
+    session.add(Contact(first_name="Other", last_name="Doe", email="other@example.com", user_id=2))
+    session.commit()
+    response = auth_client.patch("/api/contacts/bulk", json={"filter": {"last_name": "Doe"},
+                                                             "values": {"additional_info": "stale"}})
+    assert response.status_code == 200, response.text
+    assert response.json() == {"affected": 4}
+    session.expire_all()
+    assert session.query(Contact).filter(Contact.additional_info == "stale").count() == 4
+    assert session.query(Contact).filter(Contact.email == "other@example.com").one().additional_info is None
+
+
+def test_bulk_update_requires_filter_and_values(auth_client):
+    response = auth_client.patch("/api/contacts/bulk", json={"filter": {}, "values": {"first_name": "x"}})
+    assert response.status_code == 422, response.text
+    response = auth_client.patch("/api/contacts/bulk", json={"filter": {"ids": [1]}, "values": {}})
+    assert response.status_code == 422, response.text
+
+
+def test_bulk_update_rejects_null_values(auth_client, session):
+    contact_id = session.query(Contact).filter(Contact.user_id == 1).first().id
+    response = auth_client.patch("/api/contacts/bulk", json={"filter": {"ids": [contact_id]},
+                                                             "values": {"first_name": None}})
+    assert response.status_code == 422, response.text
+    response = auth_client.get(f"/api/contacts/{contact_id}")
+    assert response.status_code == 200, response.text
+    assert response.json()["first_name"] is not None
+
+
+def test_bulk_delete(auth_client, session):
+    ids = [c.id for c in session.query(Contact).filter(Contact.user_id == 1, Contact.last_name == "Roe")]
+    other = session.query(Contact).filter(Contact.user_id == 2).one()
+    response = auth_client.request("DELETE", "/api/contacts/bulk", json={"ids": ids + [other.id]})
+    assert response.status_code == 200, response.text
+    assert response.json() == {"affected": len(ids)}
+    session.expire_all()
+    assert session.query(Contact).filter(Contact.id.in_(ids)).count() == 0
+    assert session.get(Contact, other.id) is not None
+
+
+def test_bulk_delete_requires_filter(auth_client):
+    response = auth_client.request("DELETE", "/api/contacts/bulk", json={})
+    assert response.status_code == 422, response.text
+
+
+def test_create_patch_update_delete(auth_client):
+    response = auth_client.post("/api/contacts/", json=contact(10))
+    assert response.status_code == 200, response.text
+    created = response.json()
+    assert created == {"id": created["id"], **contact(10), "additional_info": None}
+
+    response = auth_client.patch(f"/api/contacts/{created['id']}", json={"phone_number": "+380671112233"})
+    assert response.status_code == 200, response.text
+    assert response.json() == {**created, "phone_number": "+380671112233"}
+
+    response = auth_client.patch(f"/api/contacts/{created['id']}", json={"first_name": None})
+    assert response.status_code == 422, response.text
+
+    response = auth_client.put(f"/api/contacts/{created['id']}", json=contact(11))
+    assert response.status_code == 200, response.text
+    assert response.json() == {"id": created["id"], **contact(11), "additional_info": None}
+
+    response = auth_client.delete(f"/api/contacts/{created['id']}")
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == "john11@example.com"
+    assert auth_client.delete(f"/api/contacts/{created['id']}").status_code == 404
+    assert auth_client.patch(f"/api/contacts/{created['id']}", json={"last_name": "X"}).status_code == 404
+
+
+def test_conditional_get(auth_client):
+    contact_id = auth_client.post("/api/contacts/", json=contact(20)).json()["id"]
+    response = auth_client.get(f"/api/contacts/{contact_id}")
+    assert response.status_code == 200, response.text
+    etag = response.headers["etag"]
+    assert auth_client.get("/api/contacts/", headers={"If-None-Match": etag}).status_code == 304
+
+    response = auth_client.get(f"/api/contacts/{contact_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    assert auth_client.patch(f"/api/contacts/{contact_id}", json={"last_name": "Smith"}).status_code == 200
+    response = auth_client.get("/api/contacts/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def changes(client, since=None, limit=500):
+    params = {"limit": limit} if since is None else {"since": since, "limit": limit}
+    response = client.get("/api/contacts/changes", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_changes(auth_client, monkeypatch):
+    monkeypatch.setattr("repository.contacts.settings.contacts_sync_settle_seconds", 0)
+    existing = auth_client.post("/api/contacts/", json=contact(30)).json()["id"]
+    first = changes(auth_client)
+    assert existing in first["created"]
+    assert not first["has_more"] and not first["updated"] and not first["deleted"]
+    token = first["next_token"]
+    assert changes(auth_client, token)["created"] == []
+
+    created = [auth_client.post("/api/contacts/", json=contact(n)).json()["id"] for n in range(31, 34)]
+    auth_client.patch(f"/api/contacts/{existing}", json={"last_name": "Smith"})
+    auth_client.patch(f"/api/contacts/{created[0]}", json={"last_name": "Smith"})
+    auth_client.delete(f"/api/contacts/{created[1]}")
+    auth_client.request("DELETE", "/api/contacts/bulk", json={"ids": [created[2]]})
+
+    page = changes(auth_client, token, limit=2)
+    # created and then changed since the last sync is still new to the client
+    assert page == {"created": [created[0]], "updated": [existing], "deleted": [], "has_more": True,
+                    "next_token": page["next_token"]}
+    rest = changes(auth_client, page["next_token"])
+    assert rest == {"created": [], "updated": [], "deleted": created[1:],
+                    "has_more": False, "next_token": rest["next_token"]}
+    again = changes(auth_client, rest["next_token"])
+    assert (again["created"], again["updated"], again["deleted"]) == ([], [], [])
+
+
+def test_changes_wait_for_settle_window(auth_client, monkeypatch):
+    monkeypatch.setattr("repository.contacts.settings.contacts_sync_settle_seconds", 0)
+    token = changes(auth_client)["next_token"]
+    monkeypatch.setattr("repository.contacts.settings.contacts_sync_settle_seconds", 60)
+    auth_client.post("/api/contacts/", json=contact(40))
+    assert changes(auth_client, token)["created"] == []
+
+
+def test_changes_invalid_token(auth_client):
+    response = auth_client.get("/api/contacts/changes", params={"since": "not-a-token"})
+    assert response.status_code == 400, response.text
+
+
+def test_list_endpoints_serialize_rows(auth_client):
+    body = contact(50, additional_info="row")
+    created = auth_client.post("/api/contacts/", json=body).json()
+    assert created == {"id": created["id"], **body}
+
+    response = auth_client.get("/api/contacts/", params={"cursor": encode_cursor(created["id"] - 1), "limit": 1})
+    assert response.status_code == 200, response.text
+    assert response.json() == [created]
+    assert response.headers["x-next-cursor"] == encode_cursor(created["id"])
+    assert "etag" in response.headers
+
+    response = auth_client.get("/api/contacts/contacts/search/", params={"query": "john50"})
+    assert response.status_code == 200, response.text
+    assert response.json() == [created]
+
+    response = auth_client.get("/api/contacts/contacts/birthdays/", params={"days": 366})
+    assert response.status_code == 200, response.text
+    assert created in response.json()
+
+
+def test_search_limit_is_bounded(auth_client):
+    for limit in (0, 501):
+        response = auth_client.get("/api/contacts/contacts/search/", params={"query": "john", "limit": limit})
+        assert response.status_code == 422, response.text
+
+
+def test_list_results_cached_until_contacts_change(auth_client):
+    hits = result_cache.hits
+    first = auth_client.get("/api/contacts/", params={"limit": 1000})
+    assert first.status_code == 200, first.text
+    again = auth_client.get("/api/contacts/", params={"limit": 1000})
+    assert again.json() == first.json()
+    assert again.headers["etag"] == first.headers["etag"]
+    assert result_cache.hits == hits + 1
+
+    created = auth_client.post("/api/contacts/", json=contact(60)).json()
+    after_write = auth_client.get("/api/contacts/", params={"limit": 1000})
+    assert after_write.json() == first.json() + [created]
+    assert result_cache.hits == hits + 1
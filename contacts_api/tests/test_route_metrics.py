@@ -0,0 +1,18 @@
+from conf.config import settings
+
+
+def test_metrics_hidden_without_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "metrics_token", None)
+    response = client.get("/metrics")
+    assert response.status_code == 404, response.text
+
+
+def test_metrics_require_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "metrics_token", "s3cret")
+    response = client.get("/metrics")
+    assert response.status_code == 401, response.text
+    response = client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401, response.text
+    response = client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200, response.text
+    assert "email_outbox" in response.json()
@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from fastapi import HTTPException
+
+from services.auth import Auth
+
+
+class TestPasswordHashing(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.auth = Auth()
+
+    async def test_hash_and_verify(self):
+        hashed = await self.auth.get_password_hash("123456789")
+        self.assertTrue(await self.auth.verify_password("123456789", hashed))
+        self.assertFalse(await self.auth.verify_password("password", hashed))
+        self.assertEqual(self.auth.hash_pending, 0)
+
+    async def test_rejects_when_queue_is_full(self):
+        self.auth.hash_queue_limit = 0
+        with self.assertRaises(HTTPException) as error:
+            await self.auth.get_password_hash("123456789")
+        self.assertEqual(error.exception.status_code, 503)
+        self.assertEqual(error.exception.headers, {"Retry-After": "1"})
+
+    async def test_queue_limit_counts_running_jobs(self):
+        self.auth.hash_queue_limit = 2
+        with patch.object(self.auth.pwd_context, "hash", side_effect=lambda password: password):
+            results = await asyncio.gather(*(self.auth.get_password_hash(str(i)) for i in range(3)),
+                                           return_exceptions=True)
+        self.assertEqual(results[:2], ["0", "1"])
+        self.assertIsInstance(results[2], HTTPException)
+        self.assertEqual(self.auth.hash_pending, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
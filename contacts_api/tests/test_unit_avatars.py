@@ -0,0 +1,118 @@
+import io
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+from services.avatars import AvatarPipeline, AvatarStatus, AvatarStorage, LocalStorage, process_avatar
+
+
+class DictRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+
+def image_bytes(size=(800, 400), color=(200, 30, 30), format="PNG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format)
+    return buffer.getvalue()
+
+
+class TestAvatars(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+        (self.folder / "spool").mkdir()
+        patcher = patch("tempfile.tempdir", str(self.folder / "spool"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        self.db = object()
+
+        @asynccontextmanager
+        async def session_factory():
+            yield self.db
+
+        self.storage = LocalStorage(self.executor, str(self.folder), "/static/avatars/")
+        self.pipeline = AvatarPipeline(self.storage, self.executor, size=250, max_bytes=1024 * 1024,
+                                       queue_limit=2, session_factory=session_factory,
+                                       status=AvatarStatus(DictRedis()))
+        patcher = patch("services.avatars.repository_users.update_avatar", new_callable=AsyncMock)
+        self.update_avatar = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_process_avatar_crops_and_resizes(self):
+        with tempfile.NamedTemporaryFile(suffix=".png") as source:
+            source.write(image_bytes((800, 400)))
+            source.flush()
+            data = process_avatar(source.name, 250)
+        with Image.open(io.BytesIO(data)) as avatar:
+            self.assertEqual((avatar.format, avatar.size, avatar.mode), ("JPEG", (250, 250), "RGB"))
+
+    async def test_avatar_is_stored_and_set_in_the_background(self):
+        await self.pipeline.submit(UploadFile(io.BytesIO(image_bytes())), 7, "user@example.com")
+        self.assertEqual(self.pipeline.stats()["in_flight"], 1)
+        await self.pipeline.drain()
+        self.assertEqual(self.pipeline.stats(), {"processed": 1, "failed": 0, "in_flight": 0})
+        self.assertEqual(await self.pipeline.status.get(7), {"status": "done", "detail": None})
+        with Image.open(self.folder / "ContactsApp" / "7.jpg") as avatar:
+            self.assertEqual(avatar.size, (250, 250))
+        email, url, db = self.update_avatar.await_args.args
+        self.assertEqual((email, db), ("user@example.com", self.db))
+        self.assertTrue(url.startswith("/static/avatars/ContactsApp/7.jpg?v="))
+        # the spooled upload is removed
+        self.assertEqual(os.listdir(self.folder / "spool"), [])
+
+    async def test_rejects_files_that_are_not_images(self):
+        with self.assertRaises(HTTPException) as error:
+            await self.pipeline.submit(UploadFile(io.BytesIO(b"not an image")), 7, "user@example.com")
+        self.assertEqual(error.exception.status_code, 415)
+        self.assertEqual(self.pipeline.pending, 0)
+
+    async def test_rejects_large_files(self):
+        self.pipeline.max_bytes = 100
+        with self.assertRaises(HTTPException) as error:
+            await self.pipeline.submit(UploadFile(io.BytesIO(image_bytes())), 7, "user@example.com")
+        self.assertEqual(error.exception.status_code, 413)
+
+    async def test_rejects_uploads_when_the_queue_is_full(self):
+        for _ in range(2):
+            await self.pipeline.submit(UploadFile(io.BytesIO(image_bytes())), 7, "user@example.com")
+        with self.assertRaises(HTTPException) as error:
+            await self.pipeline.submit(UploadFile(io.BytesIO(image_bytes())), 7, "user@example.com")
+        self.assertEqual(error.exception.status_code, 503)
+        await self.pipeline.drain()
+
+    async def test_failed_storage_is_counted_logged_and_reported(self):
+        self.storage.save = AsyncMock(side_effect=RuntimeError("storage is down"))
+        await self.pipeline.submit(UploadFile(io.BytesIO(image_bytes())), 7, "user@example.com")
+        self.assertEqual((await self.pipeline.status.get(7))["status"], "processing")
+        with self.assertLogs("services.avatars", "ERROR") as logs:
+            await self.pipeline.drain()
+        self.assertIn("storage is down", logs.output[0])
+        self.assertEqual(self.pipeline.stats(), {"processed": 0, "failed": 1, "in_flight": 0})
+        self.assertEqual((await self.pipeline.status.get(7))["status"], "failed")
+        self.update_avatar.assert_not_awaited()
+
+    def test_storage_backends_must_implement_upload(self):
+        with self.assertRaises(TypeError):
+            AvatarStorage(self.executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
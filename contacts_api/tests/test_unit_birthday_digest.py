@@ -0,0 +1,80 @@
+import unittest
+from datetime import date, datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from models import Base, Contact, EmailOutbox, User
+from repository.contacts import stream_upcoming_birthdays_by_user
+from services.birthday_digest import queue_birthday_digests
+from services.email import BIRTHDAY_DIGEST, _render
+from services.serialization import CONTACT_FIELDS
+
+
+class TestBirthdayDigest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.sessions = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        async with self.sessions() as db:
+            db.add_all([
+                User(id=1, username="one", email="one@example.com", password="-", confirmed=True),
+                User(id=2, username="two", email="two@example.com", password="-", confirmed=True),
+                User(id=3, username="three", email="three@example.com", password="-", confirmed=True),
+                User(id=4, username="unconfirmed", email="four@example.com", password="-", confirmed=False),
+            ])
+            birthdays = [(1, "Ann", datetime(1990, 1, 2)), (1, "Bob", datetime(1985, 12, 30)),
+                         (1, "Cid", datetime(1980, 2, 1)), (2, "Dee", datetime(2000, 1, 1)),
+                         (2, "Eve", datetime(1999, 12, 29)), (2, "Fay", datetime(1970, 1, 3)),
+                         (3, "Gus", datetime(1991, 6, 1)), (4, "Hal", datetime(1992, 1, 1))]
+            db.add_all(Contact(first_name=name, last_name="Smith", email=f"{name.lower()}@example.com",
+                               phone_number="0000000000", birthday=birthday, user_id=user_id)
+                       for user_id, name, birthday in birthdays)
+            await db.commit()
+        self.today = date(2024, 12, 28)
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def test_groups_users_across_partitions(self):
+        async with self.sessions() as db:
+            first_name = CONTACT_FIELDS.index("first_name")
+            groups = [(user, [contact[first_name] for contact in contacts]) async for user, contacts in
+                      stream_upcoming_birthdays_by_user(db, 7, self.today, partition_size=2)]
+        self.assertEqual(groups, [((1, "one@example.com", "one"), ["Bob", "Ann"]),
+                                  ((2, "two@example.com", "two"), ["Eve", "Dee", "Fay"])])
+
+    async def test_queues_one_digest_per_user(self):
+        stats = await queue_birthday_digests(7, chunk_size=1, today=self.today,
+                                             read_session_factory=self.sessions, session_factory=self.sessions)
+        self.assertEqual((stats["users"], stats["birthdays"], stats["queued"]), (2, 5, 2))
+        self.assertGreater(stats["users_per_second"], 0)
+        async with self.sessions() as db:
+            outbox = {row.recipient: row for row in (await db.execute(select(EmailOutbox))).scalars()}
+        self.assertEqual(set(outbox), {"one@example.com", "two@example.com"})
+        digest = outbox["two@example.com"]
+        self.assertEqual(digest.kind, BIRTHDAY_DIGEST)
+        html = digest.payload["html"]
+        self.assertIn("Hi two,", html)
+        self.assertIn("next 7 days", html)
+        self.assertLess(html.index("December 29: Eve Smith"), html.index("January 01: Dee Smith"))
+        message = _render(digest.kind, digest.recipient, digest.payload)
+        self.assertEqual(message["Subject"], "Upcoming birthdays")
+
+    async def test_rerun_replaces_the_pending_digest(self):
+        await queue_birthday_digests(7, today=self.today, read_session_factory=self.sessions,
+                                     session_factory=self.sessions)
+        await queue_birthday_digests(3, today=self.today, read_session_factory=self.sessions,
+                                     session_factory=self.sessions)
+        async with self.sessions() as db:
+            rows = (await db.execute(select(EmailOutbox).filter(EmailOutbox.recipient == "two@example.com")))\
+                .scalars().all()
+        self.assertEqual(len(rows), 1)
+        self.assertIn("next 3 days", rows[0].payload["html"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import socket
+import unittest
+from datetime import timedelta
+
+from aiosmtpd.controller import Controller
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from models import Base, EmailOutbox, utcnow
+from repository import outbox as repository_outbox
+from services.email import CONFIRM_EMAIL, OutboxWorker, SMTPPool
+
+
+class RecordingHandler:
+    """
+    aiosmtpd handler keeping the delivered messages, and refusing some recipients with a fixed reply.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.refusals = {}
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refusals:
+            return self.refusals[address]
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((session.peer, envelope.rcpt_tos, envelope.content.decode()))
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestEmailOutbox(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=free_port())
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.sessions = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.pool = SMTPPool(self.controller.hostname, self.controller.port, use_tls=False, size=2)
+        self.worker = OutboxWorker(self.pool, self.sessions, batch_size=10, backoff_seconds=30, max_attempts=3)
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        await self.engine.dispose()
+
+    async def enqueue(self, recipient: str) -> bool:
+        async with self.sessions() as db:
+            return await repository_outbox.enqueue_email(db, CONFIRM_EMAIL, recipient,
+                                                         {"username": "deadpool", "host": "http://test/"})
+
+    async def outbox(self) -> dict:
+        async with self.sessions() as db:
+            return {row.recipient: row for row in (await db.execute(select(EmailOutbox))).scalars()}
+
+    async def test_repeated_requests_are_queued_once(self):
+        self.assertTrue(await self.enqueue("a@example.com"))
+        self.assertFalse(await self.enqueue("a@example.com"))
+        self.assertEqual(await self.worker.run_once(), 1)
+        self.assertEqual(len(self.handler.messages), 1)
+        # once sent, a new request queues a new email
+        self.assertTrue(await self.enqueue("a@example.com"))
+
+    async def test_batch_is_sent_over_pooled_connections(self):
+        for i in range(8):
+            await self.enqueue(f"user{i}@example.com")
+        self.assertEqual(await self.worker.run_once(), 8)
+        self.assertEqual(len(self.handler.messages), 8)
+        self.assertLessEqual(len({peer for peer, _, _ in self.handler.messages}), 2)
+        self.assertEqual(self.pool.opened, 2)
+        _, recipients, content = self.handler.messages[0]
+        self.assertIn("Subject: Confirm your email", content)
+        self.assertIn("http://test/api/auth/confirmed_email/", content)
+        self.assertTrue(all(row.status == "sent" and row.sent_at for row in (await self.outbox()).values()))
+
+        # connections are reused by later batches
+        await self.enqueue("late@example.com")
+        await self.worker.run_once()
+        self.assertEqual(self.pool.opened, 2)
+        self.assertEqual(self.worker.stats()["sent"], 9)
+
+    async def test_temporary_failure_is_retried_with_backoff(self):
+        self.handler.refusals["busy@example.com"] = "451 Try again later"
+        await self.enqueue("busy@example.com")
+        self.assertEqual(await self.worker.run_once(), 1)
+        row = (await self.outbox())["busy@example.com"]
+        self.assertEqual((row.status, row.attempts), ("pending", 1))
+        self.assertIn("451", row.last_error)
+        self.assertAlmostEqual((row.send_after - utcnow()).total_seconds(), 30, delta=5)
+        # not due again before the backoff
+        self.assertEqual(await self.worker.run_once(), 0)
+
+        async with self.sessions() as db:
+            await db.execute(update(EmailOutbox).values(send_after=utcnow() - timedelta(seconds=1)))
+            await db.commit()
+        await self.worker.run_once()
+        row = (await self.outbox())["busy@example.com"]
+        self.assertEqual(row.attempts, 2)
+        self.assertAlmostEqual((row.send_after - utcnow()).total_seconds(), 60, delta=5)
+
+        del self.handler.refusals["busy@example.com"]
+        async with self.sessions() as db:
+            await db.execute(update(EmailOutbox).values(send_after=utcnow() - timedelta(seconds=1)))
+            await db.commit()
+        await self.worker.run_once()
+        self.assertEqual((await self.outbox())["busy@example.com"].status, "sent")
+        self.assertEqual(self.worker.stats()["retried"], 2)
+
+    async def test_permanent_failure_is_not_retried(self):
+        self.handler.refusals["gone@example.com"] = "550 No such user"
+        await self.enqueue("gone@example.com")
+        await self.enqueue("ok@example.com")
+        self.assertEqual(await self.worker.run_once(), 2)
+        outbox = await self.outbox()
+        self.assertEqual(outbox["gone@example.com"].status, "failed")
+        self.assertEqual(outbox["ok@example.com"].status, "sent")
+        self.assertEqual(self.worker.stats()["failed"], 1)
+
+    async def test_gives_up_after_max_attempts(self):
+        self.handler.refusals["busy@example.com"] = "451 Try again later"
+        await self.enqueue("busy@example.com")
+        for _ in range(3):
+            async with self.sessions() as db:
+                await db.execute(update(EmailOutbox).values(send_after=utcnow() - timedelta(seconds=1)))
+                await db.commit()
+            await self.worker.run_once()
+        row = (await self.outbox())["busy@example.com"]
+        self.assertEqual((row.status, row.attempts), ("failed", 3))
+
+    def test_backoff_is_capped(self):
+        self.worker.backoff_max = 100
+        self.assertEqual([self.worker.backoff(n) for n in (1, 2, 3, 4)], [30, 60, 100, 100])
+
+
+if __name__ == '__main__':
+    unittest.main()
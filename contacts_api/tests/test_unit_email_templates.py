@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from services.email_templates import EmailTemplates, email_templates
+
+
+class TestEmailTemplates(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+        (self.folder / "templates").mkdir()
+        (self.folder / "cache").mkdir()
+        (self.folder / "templates" / "hello.html").write_text("<p>Hi {{ username }}, {{ greeting }}!</p>")
+        (self.folder / "templates" / "hello.txt").write_text("Hi {{ username }}")
+        self.templates = EmailTemplates(self.folder / "templates", str(self.folder / "cache"))
+
+    def test_precompile_writes_bytecode_for_other_processes(self):
+        self.assertEqual(self.templates.precompile(), ["hello.html", "hello.txt"])
+        self.assertEqual(len(os.listdir(self.folder / "cache")), 2)
+        # a fresh environment loads the bytecode instead of compiling the source again
+        fresh = EmailTemplates(self.folder / "templates", str(self.folder / "cache"))
+        with patch.object(fresh.env, "compile", side_effect=AssertionError("compiled")):
+            self.assertEqual(fresh.render("hello.txt", username="a"), "Hi a")
+
+    def test_templates_are_compiled_once(self):
+        self.templates.precompile()
+        with patch.object(self.templates.env, "compile", side_effect=AssertionError("compiled")):
+            self.templates.render("hello.html", username="a", greeting="hello")
+
+    def test_html_is_autoescaped(self):
+        self.assertEqual(self.templates.render("hello.html", username="<b>", greeting="hello"),
+                         "<p>Hi &lt;b&gt;, hello!</p>")
+        self.assertEqual(self.templates.render("hello.txt", username="<b>"), "Hi <b>")
+
+    def test_render_many(self):
+        contexts = [{"username": "a"}, {"username": "b", "greeting": "happy birthday"}]
+        self.assertEqual(list(self.templates.render_many("hello.html", contexts, greeting="hello")),
+                         ["<p>Hi a, hello!</p>", "<p>Hi b, happy birthday!</p>"])
+        self.assertEqual(list(self.templates.render_many("hello.html", contexts, greeting="hello")),
+                         [self.templates.render("hello.html", **{"greeting": "hello", **context})
+                          for context in contexts])
+
+    def test_app_templates(self):
+        self.assertIn("email_template.html", email_templates.precompile())
+        html = email_templates.render("email_template.html", host="http://test/", username="deadpool", token="t")
+        self.assertIn('href="http://test/api/auth/confirmed_email/t"', html)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from starlette.requests import Request
+
+from services.etag import ContactsVersion, if_none_match
+
+
+def request(if_none_match_header=None):
+    headers = [(b"if-none-match", if_none_match_header.encode())] if if_none_match_header else []
+    return Request({"type": "http", "headers": headers})
+
+
+class TestContactsVersion(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.r = MagicMock()
+        self.r.get = AsyncMock()
+        self.r.set = AsyncMock()
+        self.versions = ContactsVersion(self.r)
+
+    async def test_get_stored_version(self):
+        self.r.get.return_value = b"42"
+        self.assertEqual(await self.versions.get(1), 42)
+        self.r.get.assert_awaited_once_with("contacts-version:1")
+        self.r.set.assert_not_called()
+
+    async def test_get_initializes_missing_version(self):
+        self.r.get.return_value = None
+        self.r.set.return_value = True
+        version = await self.versions.get(1)
+        self.r.set.assert_awaited_once_with("contacts-version:1", version, nx=True)
+
+    async def test_get_reads_version_set_concurrently(self):
+        self.r.get.side_effect = [None, b"7"]
+        self.r.set.return_value = None
+        self.assertEqual(await self.versions.get(1), 7)
+
+    async def test_bump_stores_new_version(self):
+        self.r.set.return_value = b"42"
+        previous, version = await self.versions.bump(1)
+        self.assertEqual(previous, 42)
+        self.r.set.assert_awaited_once_with("contacts-version:1", version, get=True)
+        self.assertAlmostEqual(version / 1e9, time.time(), delta=5)
+
+    async def test_bump_without_previous_version(self):
+        self.r.set.return_value = None
+        previous, _ = await self.versions.bump(1)
+        self.assertIsNone(previous)
+
+    def test_replica_reads_are_tagged_once_settled(self):
+        session = MagicMock(info={"replica": object()})
+        with patch("services.etag.replica_router.sticky_seconds", 5):
+            self.assertFalse(ContactsVersion.can_tag(time.time_ns(), session))
+            self.assertTrue(ContactsVersion.can_tag(time.time_ns() - 10 ** 10, session))
+        self.assertTrue(ContactsVersion.can_tag(time.time_ns(), MagicMock(info={})))
+
+
+class TestIfNoneMatch(unittest.TestCase):
+
+    def test_matching(self):
+        etag = 'W/"123"'
+        self.assertTrue(if_none_match(request('W/"123"'), etag))
+        self.assertTrue(if_none_match(request('"1", "123"'), etag))
+        self.assertTrue(if_none_match(request("*"), etag))
+        self.assertFalse(if_none_match(request('W/"124"'), etag))
+        self.assertFalse(if_none_match(request(), etag))
+
+
+if __name__ == '__main__':
+    unittest.main()
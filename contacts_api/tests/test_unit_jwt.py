@@ -0,0 +1,105 @@
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jose import JWTError
+
+from services.auth import auth_service
+from services.jwt_keys import KeySet
+from services.token_cache import TokenCache
+
+
+def private_pem(key) -> str:
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption()).decode()
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TokenCache(max_size=2)
+        self.claims = {"sub": "deadpool@example.com", "exp": time.time() + 60}
+
+    def test_get_returns_cached_claims(self):
+        self.cache.put("token", self.claims)
+        self.assertEqual(self.cache.get("token"), self.claims)
+        self.assertIsNone(self.cache.get("other"))
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_expired_token_is_dropped(self):
+        self.cache.put("token", {**self.claims, "exp": time.time() - 1})
+        self.assertIsNone(self.cache.get("token"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_token_without_exp_is_not_cached(self):
+        self.cache.put("token", {"sub": "deadpool@example.com"})
+        self.assertIsNone(self.cache.get("token"))
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put("a", self.claims)
+        self.cache.put("b", self.claims)
+        self.cache.get("a")
+        self.cache.put("c", self.claims)
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+
+class TestKeySet(unittest.TestCase):
+
+    def test_hmac_round_trip(self):
+        keys = KeySet("HS256", "secret")
+        token = keys.encode({"sub": "deadpool@example.com"})
+        self.assertEqual(keys.decode(token), {"sub": "deadpool@example.com"})
+        self.assertEqual(keys.jwks(), {"keys": []})
+        with self.assertRaises(JWTError):
+            KeySet("HS256", "other").decode(token)
+
+    def test_asymmetric_round_trip(self):
+        for algorithm, generate in (("RS256", lambda: rsa.generate_private_key(65537, 2048)),
+                                    ("ES256", lambda: ec.generate_private_key(ec.SECP256R1()))):
+            with self.subTest(algorithm=algorithm):
+                keys = KeySet(algorithm, "unused", private_pem(generate()), key_id="2024-01")
+                token = keys.encode({"sub": "deadpool@example.com"})
+                self.assertEqual(keys.decode(token), {"sub": "deadpool@example.com"})
+                [public_key] = keys.jwks()["keys"]
+                self.assertEqual(public_key["kid"], "2024-01")
+                self.assertNotIn("d", public_key)
+
+                # after a rotation, tokens signed with the previous key still verify
+                rotated = KeySet(algorithm, "unused", private_pem(generate()), key_id="2024-02",
+                                 public_keys=[public_key])
+                self.assertEqual(rotated.decode(token), {"sub": "deadpool@example.com"})
+                self.assertEqual(len(rotated.jwks()["keys"]), 2)
+
+    def test_unknown_key_id_is_rejected(self):
+        keys = KeySet("RS256", "unused", private_pem(rsa.generate_private_key(65537, 2048)), key_id="old")
+        token = keys.encode({"sub": "deadpool@example.com"})
+        rotated = KeySet("RS256", "unused", private_pem(rsa.generate_private_key(65537, 2048)), key_id="new")
+        with self.assertRaises(JWTError):
+            rotated.decode(token)
+
+    def test_asymmetric_algorithm_requires_private_key(self):
+        with self.assertRaises(ValueError):
+            KeySet("RS256", "unused")
+
+
+class TestGetCurrentUser(unittest.IsolatedAsyncioTestCase):
+
+    async def test_token_is_verified_once(self):
+        token = await auth_service.create_access_token(data={"sub": "deadpool@example.com"})
+        user = object()
+        with patch("services.auth.token_cache", TokenCache()) as cache, \
+                patch("services.auth.user_cache", new_callable=AsyncMock) as user_cache, \
+                patch.object(auth_service.keys, "decode", wraps=auth_service.keys.decode) as decode:
+            user_cache.get.return_value = user
+            self.assertIs(await auth_service.get_current_user(token, db=None), user)
+            self.assertIs(await auth_service.get_current_user(token, db=None), user)
+        decode.assert_called_once_with(token)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+from models import Contact
+from services.prefix_index import UserPrefixIndex, PrefixIndex
+
+
+ROWS = [
+    (1, "John", "Doe", "johndoe@example.com"),
+    (2, "Jane", "Doe", "janedoe@example.com"),
+    (3, "Jake", "Smith", "jake@work.com"),
+]
+
+
+class TestUserPrefixIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = UserPrefixIndex(ROWS)
+
+    def test_search_by_name_prefix(self):
+        self.assertEqual([c["id"] for c in self.index.search("ja", 10)], [3, 2])
+        self.assertEqual([c["id"] for c in self.index.search("DOE", 10)], [1, 2])
+        self.assertEqual(self.index.search("jo", 10),
+                         [{"id": 1, "first_name": "John", "last_name": "Doe", "email": "johndoe@example.com"}])
+
+    def test_search_by_full_name_and_email(self):
+        self.assertEqual([c["id"] for c in self.index.search("jane d", 10)], [2])
+        self.assertEqual([c["id"] for c in self.index.search("jake@", 10)], [3])
+
+    def test_search_limit_and_no_match(self):
+        self.assertEqual(len(self.index.search("j", 2)), 2)
+        self.assertEqual(self.index.search("anna", 10), [])
+
+    def test_add_and_remove(self):
+        size = self.index.size
+        self.index.add(4, "Anna", "Lee", "anna@example.com")
+        self.assertEqual([c["id"] for c in self.index.search("an", 10)], [4])
+        self.index.add(4, "Hanna", "Lee", "anna@example.com")
+        self.assertEqual([c["id"] for c in self.index.search("hann", 10)], [4])
+        self.assertEqual(self.index.search("anna l", 10), [])
+        self.index.remove(4)
+        self.assertEqual(self.index.search("lee", 10), [])
+        self.assertEqual(self.index.size, size)
+
+
+class TestPrefixIndex(unittest.TestCase):
+
+    def test_put_and_sync(self):
+        cache = PrefixIndex(enabled=True, memory_budget=10 ** 6)
+        cache.put(1, ROWS, 10)
+        cache.contact_saved(1, Contact(id=4, first_name="Anna", last_name="Lee", email="anna@example.com"), 10, 11)
+        cache.contact_deleted(1, 1, 11, 12)
+        self.assertEqual([c["id"] for c in cache.get(1, 12).search("j", 10)], [3, 2])
+        self.assertEqual([c["id"] for c in cache.get(1, 12).search("anna", 10)], [4])
+
+    def test_write_by_another_worker_drops_index(self):
+        cache = PrefixIndex(enabled=True, memory_budget=10 ** 6)
+        cache.put(1, ROWS, 10)
+        self.assertIsNone(cache.get(1, 11))
+        self.assertEqual(cache.size, 0)
+
+    def test_local_write_after_unseen_write_drops_index(self):
+        cache = PrefixIndex(enabled=True, memory_budget=10 ** 6)
+        cache.put(1, ROWS, 10)
+        # another worker set version 11 before this write replaced it
+        cache.contact_saved(1, Contact(id=4, first_name="Anna", last_name="Lee", email="anna@example.com"), 11, 12)
+        self.assertIsNone(cache.get(1, 12))
+
+    def test_invalidate(self):
+        cache = PrefixIndex(enabled=True, memory_budget=10 ** 6)
+        cache.put(1, ROWS, 10)
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1, 10))
+        self.assertEqual(cache.size, 0)
+
+    def test_lru_eviction_under_budget(self):
+        size = UserPrefixIndex(ROWS).size
+        cache = PrefixIndex(enabled=True, memory_budget=size * 2)
+        cache.put(1, ROWS, 0)
+        cache.put(2, ROWS, 0)
+        cache.get(1, 0)
+        cache.put(3, ROWS, 0)
+        self.assertIsNotNone(cache.get(1, 0))
+        self.assertIsNone(cache.get(2, 0))
+        self.assertIsNotNone(cache.get(3, 0))
+        self.assertEqual(cache.size, size * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
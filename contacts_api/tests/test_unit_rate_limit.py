@@ -0,0 +1,147 @@
+import unittest
+from collections import OrderedDict
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from fastapi import Depends, FastAPI
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+
+from services import rate_limit
+from services.rate_limit import IPRateLimit, RateLimit, RateLimitHeadersMiddleware, SlidingWindow
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def incrby(self, key, amount):
+        self.commands.append(("incrby", key, amount))
+
+    def expire(self, key, seconds):
+        self.commands.append(("expire", key, seconds))
+
+    def get(self, key):
+        self.commands.append(("get", key))
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        results = []
+        for command, key, *args in self.commands:
+            if command == "incrby":
+                self.redis.data[key] = self.redis.data.get(key, 0) + args[0]
+                results.append(self.redis.data[key])
+            elif command == "expire":
+                results.append(True)
+            else:
+                value = self.redis.data.get(key)
+                results.append(str(value).encode() if value is not None else None)
+        return results
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class TestSlidingWindow(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.window = SlidingWindow(self.redis, local_share=0)
+        patcher = patch("services.rate_limit.time.time", return_value=6015.0)
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_counts_requests_in_the_current_window(self):
+        self.assertEqual(await self.window.hit("k", 10, 60), (1, 45.0))
+        self.assertEqual(await self.window.hit("k", 10, 60), (2, 45.0))
+        self.assertEqual(self.redis.data, {"rate:k:100": 2})
+
+    async def test_weights_the_previous_window(self):
+        self.redis.data["rate:k:99"] = 8
+        # a quarter of the current window has passed, so three quarters of the previous one still count
+        count, _ = await self.window.hit("k", 10, 60)
+        self.assertEqual(count, 1 + 8 * 0.75)
+
+    async def test_local_share_skips_redis_while_clearly_under_the_limit(self):
+        self.window.local_share = 0.1
+        for _ in range(10):
+            await self.window.hit("k", 100, 60)
+        # the first hit checks Redis, the next 9 (10% of the 99 requests left) are admitted locally
+        self.assertEqual(self.redis.round_trips, 1)
+        self.assertEqual(self.window.stats()["local_checks"], 9)
+        count, _ = await self.window.hit("k", 100, 60)
+        self.assertEqual(self.redis.round_trips, 2)
+        self.assertEqual(count, 11)
+        self.assertEqual(self.redis.data["rate:k:100"], 11)
+
+    async def test_near_the_limit_every_request_checks_redis(self):
+        self.window.local_share = 0.1
+        for _ in range(10):
+            await self.window.hit("k", 10, 60)
+        self.assertEqual(self.redis.round_trips, 10)
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(rate_limit.sliding_window, "r", FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(rate_limit.sliding_window, "_local", OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = FastAPI()
+        self.app.add_middleware(RateLimitHeadersMiddleware)
+        self.limit = RateLimit(times=2, seconds=60)
+
+        @self.app.get("/mine", dependencies=[Depends(self.limit)])
+        async def mine():
+            return Response(b"[]", media_type="application/json")
+
+        @self.app.get("/public", dependencies=[Depends(IPRateLimit(times=1, seconds=60))])
+        async def public():
+            return {"msg": "ok"}
+
+        self.user = SimpleNamespace(id=1)
+        self.app.dependency_overrides[rate_limit.auth_service.get_current_user] = lambda: self.user
+        self.client = TestClient(self.app)
+
+    def test_limits_each_user(self):
+        first = self.client.get("/mine")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers["ratelimit-limit"], "2")
+        self.assertEqual(first.headers["ratelimit-remaining"], "1")
+        self.assertTrue(0 < int(first.headers["ratelimit-reset"]) <= 60)
+        self.assertEqual(self.client.get("/mine").headers["ratelimit-remaining"], "0")
+        limited = self.client.get("/mine")
+        self.assertEqual(limited.status_code, 429)
+        self.assertEqual(limited.headers["retry-after"], limited.headers["ratelimit-reset"])
+        # another user behind the same address has its own quota
+        self.user = SimpleNamespace(id=2)
+        self.assertEqual(self.client.get("/mine").status_code, 200)
+
+    def test_user_multiplier(self):
+        with patch.dict(rate_limit.settings.rate_limit_user_multipliers, {1: 2.5}):
+            self.assertEqual(self.limit.quota(self.user), 5)
+            self.assertEqual(self.client.get("/mine").headers["ratelimit-limit"], "5")
+
+    def test_limits_public_routes_by_address(self):
+        self.assertEqual(self.client.get("/public").status_code, 200)
+        self.assertEqual(self.client.get("/public").status_code, 429)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,43 +1,74 @@
+import time
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from models import Contact, User
-from schemas import ContactUpdate, ContactCreate
+from pydantic import ValidationError
+
+from conf.config import MAX_CONTACT_IMPORT_BATCH_SIZE, Settings
+from schemas import ContactUpdate, ContactCreate, ContactPatch
+from services.etag import ContactsVersion
+from services.prefix_index import PrefixIndex
+from services.serialization import contact_dicts
 from repository.contacts import (
     get_contacts,
     get_contact,
     create_contact,
     delete_contact,
     update_contact,
+    patch_contact,
     search_contacts,
+    search_contacts_ranked,
     get_birthdays_in_next_7_days,
+    get_upcoming_birthdays,
+    insert_contacts,
+    month_day_window,
+    suggest_contacts,
 )
 
 
 class TestContacts(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
+        self.result = MagicMock()
+        self.session.execute.return_value = self.result
         self.user = User(id=1)
+        patcher = patch("repository.contacts.contacts_version", new_callable=AsyncMock)
+        self.contacts_version = patcher.start()
+        self.contacts_version.get.return_value = 1
+        self.contacts_version.bump.return_value = (1, 2)
+        self.contacts_version.can_tag = ContactsVersion.can_tag
+        self.addCleanup(patcher.stop)
 
     async def test_get_contacts(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().offset().limit().all.return_value = contacts
+        self.result.all.return_value = contacts
         result = await get_contacts(db=self.session, user=self.user, skip=0, limit=10)
         self.assertEqual(result, contacts)
 
+    async def test_get_contacts_after_cursor(self):
+        contacts = [Contact(id=11), Contact(id=12)]
+        self.result.all.return_value = contacts
+        result = await get_contacts(db=self.session, user=self.user, skip=50, limit=2, after_id=10)
+        self.assertEqual(result, contacts)
+        stmt = str(self.session.execute.call_args.args[0])
+        self.assertIn("contacts.id >", stmt)
+        self.assertNotIn("OFFSET", stmt)
+
     async def test_get_contact_found(self):
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
+        self.result.scalars().first.return_value = contact
         result = await get_contact(db=self.session, contact_id=1, user=self.user)
         self.assertEqual(result, contact)
 
     async def test_get_contact_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.result.scalars().first.return_value = None
         result = await get_contact(db=self.session, contact_id=1, user=self.user)
         self.assertIsNone(result)
 
@@ -45,74 +76,185 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
         body = ContactCreate(first_name="John", last_name="Doe", 
                        email="test@api.com", phone_number="0123456789",  
                        birthday="2000-01-10", additional_info="test contact")
+        contact = Contact(id=1, **body.model_dump(), user_id=self.user.id)
+        self.result.scalars().one.return_value = contact
         result = await create_contact(db=self.session, body=body, user=self.user)
-        self.assertEqual(result.first_name, body.first_name)
-        self.assertEqual(result.last_name, body.last_name)
-        self.assertEqual(result.email, body.email)
-        self.assertEqual(result.phone_number, body.phone_number)
-        self.assertEqual(result.birthday, body.birthday)
-        self.assertEqual(result.additional_info, body.additional_info)
-        self.assertTrue(hasattr(result, "id"))
+        self.assertEqual(result, contact)
+        self.session.add.assert_not_called()
+        self.session.refresh.assert_not_called()
+        self.session.commit.assert_awaited_once()
+        self.contacts_version.bump.assert_awaited_once_with(self.user.id)
+        stmt = self.session.execute.call_args.args[0]
+        self.assertIn("INSERT INTO contacts", str(stmt))
+        self.assertIn("RETURNING", str(stmt))
+        self.assertEqual(stmt.compile().params["user_id"], self.user.id)
+        self.assertEqual(stmt.compile().params["first_name"], body.first_name)
 
     async def test_delete_contact_found(self):
-        contact = Contact()
-        self.session.query().filter().first.return_value = contact
+        contact = Contact(id=1)
+        self.result.scalars().first.return_value = contact
         result = await delete_contact(db=self.session, contact_id=1, user=self.user)
         self.assertEqual(result, contact)
+        self.session.delete.assert_not_called()
+        self.session.commit.assert_awaited_once()
+        self.assertEqual(self.session.execute.await_count, 2)
+        stmt = str(self.session.execute.call_args_list[0].args[0])
+        self.assertIn("DELETE FROM contacts", stmt)
+        self.assertIn("contacts.user_id", stmt)
+        self.assertIn("RETURNING", stmt)
+        tombstone = self.session.execute.call_args_list[1].args[0]
+        self.assertIn("INSERT INTO contact_tombstones", str(tombstone))
+        self.assertIn("ON CONFLICT", str(tombstone))
 
     async def test_delete_contact_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.result.scalars().first.return_value = None
         result = await delete_contact(db=self.session, contact_id=1, user=self.user)
         self.assertIsNone(result)
+        self.session.execute.assert_awaited_once()
+        self.session.commit.assert_not_called()
+        self.contacts_version.bump.assert_not_called()
 
     async def test_update_contact_found(self):
         body = ContactUpdate(first_name="John", last_name="Doe", 
                        email="test@api.com", phone_number="0123456789",  
                        birthday="2000-01-10", additional_info="test contact")
-        contact = Contact()
-        self.session.query().filter().first.return_value = contact
+        contact = Contact(id=1)
+        self.result.scalars().first.return_value = contact
         self.session.commit.return_value = None
         result = await update_contact(db=self.session, contact_id=1, body=body, user=self.user)
         self.assertEqual(result, contact)
+        self.assertEqual(self.session.execute.await_count, 1)
+        stmt = self.session.execute.call_args.args[0]
+        self.assertIn("UPDATE contacts", str(stmt))
+        self.assertIn("RETURNING", str(stmt))
+        self.assertEqual(set(stmt.compile().params) - {"id_1", "user_id_1", "updated_at"}, set(body.model_dump()))
 
     async def test_update_contact_not_found(self):
         body = ContactUpdate(first_name="John", last_name="Doe", 
                        email="test@api.com", phone_number="0123456789",  
                        birthday="2000-01-10", additional_info="test contact")
-        self.session.query().filter().first.return_value = None
+        self.result.scalars().first.return_value = None
         self.session.commit.return_value = None
         result = await update_contact(db=self.session, contact_id=1, body=body, user=self.user)
         self.assertIsNone(result)
 
+    async def test_patch_contact_sends_only_changed_fields(self):
+        contact = Contact(id=1)
+        self.result.scalars().first.return_value = contact
+        result = await patch_contact(db=self.session, contact_id=1, body=ContactPatch(phone_number="0987654321"),
+                                     user=self.user)
+        self.assertEqual(result, contact)
+        stmt = self.session.execute.call_args.args[0]
+        self.assertEqual(set(stmt.compile().params) - {"id_1", "user_id_1", "updated_at"}, {"phone_number"})
+
+    async def test_patch_contact_without_changes(self):
+        contact = Contact(id=1)
+        self.result.scalars().first.return_value = contact
+        result = await patch_contact(db=self.session, contact_id=1, body=ContactPatch(), user=self.user)
+        self.assertEqual(result, contact)
+        self.assertNotIn("UPDATE", str(self.session.execute.call_args.args[0]))
+        self.session.commit.assert_not_called()
+
+    def test_patch_rejects_null_required_field(self):
+        with self.assertRaises(ValidationError):
+            ContactPatch(first_name=None)
+        self.assertIsNone(ContactPatch(additional_info=None).additional_info)
+
     async def test_get_birthdays_in_next_7_days_found(self):
         today = datetime.now().date()
-        # next_week = today + timedelta(days=7)
-        contacts = [Contact(birthday=today),
-                    Contact(birthday=today+timedelta(days=4)),
-                    Contact(birthday=today-timedelta(days=362)),
-                    Contact(birthday=today-timedelta(days=2)), # Birthday already passed
-                    Contact(birthday=today+timedelta(days=8)), # Birthday outside 7-day range
-                    ]
-        self.session.query().filter().all.return_value = contacts
+        contacts = [Contact(birthday=today), Contact(birthday=today+timedelta(days=4))]
+        self.result.all.return_value = contacts
         result = await get_birthdays_in_next_7_days(db=self.session, user=self.user)
-        self.assertEqual(result, [contacts[0], contacts[1], contacts[2]])
+        self.assertEqual(result, contacts)
+        self.session.execute.assert_awaited_once()
 
-    async def test_get_birthdays_in_next_7_days_not_found(self):
-        self.session.query().filter().all.return_value = None
-        result = await get_birthdays_in_next_7_days(db=self.session, user=self.user)
-        self.assertIsNone(result)
+    async def test_get_upcoming_birthdays_not_found(self):
+        self.result.all.return_value = []
+        result = await get_upcoming_birthdays(db=self.session, user=self.user, days=30)
+        self.assertEqual(result, [])
+
+    async def test_suggest_contacts_builds_index_once(self):
+        self.result.all.return_value = [(1, "John", "Doe", "johndoe@example.com")]
+        with patch("repository.contacts.prefix_index", PrefixIndex(enabled=True, memory_budget=10 ** 6)):
+            result = await suggest_contacts(db=self.session, prefix="jo", user=self.user)
+            self.assertEqual([contact["id"] for contact in result], [1])
+            result = await suggest_contacts(db=self.session, prefix="doe", user=self.user)
+            self.assertEqual([contact["id"] for contact in result], [1])
+        self.session.execute.assert_awaited_once()
+
+    async def test_suggest_contacts_does_not_keep_index_read_from_lagging_replica(self):
+        self.contacts_version.get.return_value = time.time_ns()
+        cache = PrefixIndex(enabled=True, memory_budget=10 ** 6)
+        with patch("repository.contacts.prefix_index", cache), \
+                patch("services.etag.replica_router.sticky_seconds", 5), \
+                patch("repository.contacts.replica_router.follow_writes"):
+            # the session stayed on a replica that has not replayed the contact created just before
+            self.session.info = {"replica": object()}
+            self.result.all.return_value = []
+            self.assertEqual(await suggest_contacts(db=self.session, prefix="jo", user=self.user), [])
+            self.assertIsNone(cache.get(self.user.id, self.contacts_version.get.return_value))
+            self.session.info = {}
+            self.result.all.return_value = [(1, "John", "Doe", "johndoe@example.com")]
+            result = await suggest_contacts(db=self.session, prefix="jo", user=self.user)
+            self.assertEqual([contact["id"] for contact in result], [1])
+
+    async def test_suggest_contacts_reads_recent_writes_from_primary(self):
+        self.contacts_version.get.return_value = time.time_ns()
+        self.session.info = {"replica": object()}
+        self.result.all.return_value = [(1, "John", "Doe", "johndoe@example.com")]
+        with patch("repository.contacts.prefix_index", PrefixIndex(enabled=True, memory_budget=10 ** 6)), \
+                patch("db.replica_router.sticky_seconds", 5):
+            await suggest_contacts(db=self.session, prefix="jo", user=self.user)
+        self.assertIsNone(self.session.info["replica"])
+
+    async def test_suggest_contacts_rebuilds_index_after_another_write(self):
+        self.result.all.return_value = [(1, "John", "Doe", "johndoe@example.com")]
+        with patch("repository.contacts.prefix_index", PrefixIndex(enabled=True, memory_budget=10 ** 6)):
+            await suggest_contacts(db=self.session, prefix="jo", user=self.user)
+            self.contacts_version.get.return_value = 2
+            self.result.all.return_value = [(1, "John", "Doe", "johndoe@example.com"),
+                                            (2, "Joe", "Roe", "joe@example.com")]
+            result = await suggest_contacts(db=self.session, prefix="jo", user=self.user)
+            self.assertEqual([contact["id"] for contact in result], [2, 1])
+        self.assertEqual(self.session.execute.await_count, 2)
 
+    async def test_insert_contacts_splits_large_batches(self):
+        bodies = [ContactCreate(first_name="John", last_name="Doe", email=f"john{i}@example.com",
+                                phone_number="0123456789", birthday="2000-01-10") for i in range(5)]
+        self.result.all.return_value = [(1, "John", "Doe", "john@example.com")]
+        with patch("repository.contacts.MAX_CONTACT_IMPORT_BATCH_SIZE", 2):
+            inserted = await insert_contacts(db=self.session, bodies=bodies, user=self.user)
+        self.assertEqual(self.session.execute.await_count, 3)
+        self.assertEqual(len(inserted), 3)
+        self.session.commit.assert_awaited_once()
+
+    def test_largest_batch_fits_postgres_parameter_limit(self):
+        row = {"first_name": "John", "last_name": "Doe", "email": "john@example.com", "phone_number": "0",
+               "birthday": None, "additional_info": None, "user_id": 1}
+        stmt = postgresql.insert(Contact).values([row] * MAX_CONTACT_IMPORT_BATCH_SIZE)
+        self.assertLessEqual(len(stmt.compile(dialect=postgresql.dialect()).params), 32767)
+        with self.assertRaises(ValidationError):
+            Settings(contact_import_batch_size=MAX_CONTACT_IMPORT_BATCH_SIZE + 1)
+
+    def test_month_day_window(self):
+        self.assertEqual(month_day_window(date(2023, 6, 10), 7), (610, 617))
+        # Wraps around the end of the year
+        self.assertEqual(month_day_window(date(2023, 12, 28), 7), (1228, 104))
+        # February 29th belongs to March 1st in common years
+        self.assertEqual(month_day_window(date(2023, 3, 1), 7), (229, 308))
+        self.assertEqual(month_day_window(date(2024, 3, 1), 7), (301, 308))
+        self.assertEqual(month_day_window(date(2024, 2, 25), 7), (225, 303))
+        self.assertEqual(month_day_window(date(2023, 6, 10), 365), (101, 1231))
 
     async def test_search_contact_found(self):
         contacts = [Contact(first_name="John", last_name="Doe", email="johndoe@example.com"),
                     Contact(first_name="Jake", last_name="Smith", email="jakesmith@example.com"),
                     Contact(first_name="Jane", last_name="Doe", email="janedoe@example.com")
                     ]
-        self.session.query().filter().filter().all.return_value = contacts
+        self.result.all.return_value = contacts
         # Test case 1: Search with query "Doe"
         result  = await search_contacts(db=self.session, query = "Doe", user=self.user)
-        # self.assertEqual([contact.last_name for contact in result], ["Doe"])
-        self.assertEqual(result, [contacts[0], contacts[2]])        
+        self.assertEqual(result, [contacts[0], contacts[2]])
         # Test case 2: Search with query "Jane"
         result  = await search_contacts(db=self.session, query = "Jane", user=self.user)
         self.assertEqual(result, [contacts[2]])
@@ -123,6 +265,42 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
         result  = await search_contacts(db=self.session, query = "anna", user=self.user)
         self.assertEqual(result, [])
 
+    async def test_search_contacts_ranked_pages(self):
+        contacts = [Contact(id=1, first_name="Johnny", last_name="Berg", email="jb@example.com"),
+                    Contact(id=2, first_name="John", last_name="Doe", email="jd@example.com"),
+                    Contact(id=3, first_name="John", last_name="Smith", email="js@example.com")
+                    ]
+        self.result.all.return_value = contacts
+        first_page = await search_contacts_ranked(db=self.session, query="john", user=self.user, limit=2)
+        self.assertEqual([contact for contact, _ in first_page], [contacts[1], contacts[2]])
+        self.assertEqual(first_page[0][1], 1.0)
+        last_contact, last_rank = first_page[-1]
+        second_page = await search_contacts_ranked(db=self.session, query="john", user=self.user, limit=2,
+                                                   after=(last_rank, last_contact.id))
+        self.assertEqual([contact for contact, _ in second_page], [contacts[0]])
+
+    async def test_search_contacts_postgresql(self):
+        row = ("John", "Doe", "johndoe@example.com", "0123456789", datetime(2000, 1, 10), None, 1, 1.0)
+        self.session.get_bind().dialect.name = "postgresql"
+        self.result.all.return_value = [row]
+        result = await search_contacts_ranked(db=self.session, query="Doe", user=self.user, after=(1.0, 0))
+        self.assertEqual(result, [(row, 1.0)])
+        self.assertEqual(contact_dicts([row]), [{"first_name": "John", "last_name": "Doe",
+                                                 "email": "johndoe@example.com", "phone_number": "0123456789",
+                                                 "birthday": datetime(2000, 1, 10), "additional_info": None,
+                                                 "id": 1}])
+        stmt = str(self.session.execute.call_args.args[0])
+        self.assertIn("similarity", stmt)
+        self.assertIn("ORDER BY greatest", stmt)
+
+    async def test_search_contacts_postgresql_escapes_wildcards(self):
+        self.session.get_bind().dialect.name = "postgresql"
+        self.result.all.return_value = []
+        await search_contacts_ranked(db=self.session, query="50%_off/", user=self.user)
+        stmt = self.session.execute.call_args.args[0]
+        self.assertIn("%50/%/_off//%", stmt.compile().params.values())
+        self.assertIn("ESCAPE '/'", str(stmt))
+
 
 
 if __name__ == '__main__':
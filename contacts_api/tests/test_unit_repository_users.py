@@ -1,6 +1,6 @@
 import unittest
-from unittest.mock import patch, MagicMock
-from sqlalchemy.orm import Session
+from unittest.mock import patch, MagicMock, AsyncMock
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import User
 from schemas import UserModel
 from repository.users import get_user_by_email, create_user, update_token, confirmed_email, update_avatar
@@ -10,7 +10,9 @@ class TestUserFunctions(unittest.IsolatedAsyncioTestCase):
     
     def setUp(self):
         # Мокируем сессию базы данных
-        self.db = MagicMock(spec=Session)
+        self.db = MagicMock(spec=AsyncSession)
+        self.result = MagicMock()
+        self.db.execute.return_value = self.result
         # Мокируем пользователя
         self.user = User(id=1, email="test@example.com", refresh_token=None, confirmed=False, avatar=None)
 
@@ -28,20 +30,30 @@ class TestUserFunctions(unittest.IsolatedAsyncioTestCase):
         
         # Проверяем, что пользователь был добавлен и коммит был вызван
         self.db.add.assert_called_once()
-        self.db.commit.assert_called_once()
+        self.db.commit.assert_awaited_once()
         
         # Проверяем, что аватар установлен правильно
         self.assertEqual(result.avatar, "http://gravatar.com/avatar")
+
+    @patch('repository.users.repository_outbox.enqueue_email', new_callable=AsyncMock)
+    @patch('repository.users.Gravatar')
+    async def test_create_user_queues_email_in_same_transaction(self, mock_gravatar, mock_enqueue_email):
+        body = UserModel(username="testname", email="test@example.com", password="password")
+        await create_user(body, self.db, ("confirm_email", {"username": "testname"}))
+        # Письмо добавляется в outbox без отдельного коммита
+        mock_enqueue_email.assert_awaited_once_with(self.db, "confirm_email", "test@example.com",
+                                                    {"username": "testname"}, commit=False)
+        self.db.commit.assert_awaited_once()
     
     async def test_get_user_by_email(self):
         # Мокируем поведение запроса к базе данных
-        self.db.query().filter().first.return_value = self.user
+        self.result.scalars().first.return_value = self.user
         
         # Тестируем получение пользователя по email
         result = await get_user_by_email("test@example.com", self.db)
         
         # Проверяем, что пользователь был найден
-        self.db.query().filter().first.assert_called_once()
+        self.db.execute.assert_awaited_once()
         self.assertEqual(result.email, "test@example.com")
     
     async def test_update_token(self):
@@ -50,29 +62,42 @@ class TestUserFunctions(unittest.IsolatedAsyncioTestCase):
         
         # Проверяем, что токен обновлен
         self.assertEqual(self.user.refresh_token, "new_token")
-        self.db.commit.assert_called_once()
+        self.db.commit.assert_awaited_once()
+
+    @patch('repository.users.user_cache', new_callable=AsyncMock)
+    async def test_update_token_logout(self, mock_user_cache):
+        # Сбрасываем refresh_token пользователя
+        await update_token(self.user, None, self.db)
+
+        # Проверяем, что пользователь удален из кэша
+        self.assertIsNone(self.user.refresh_token)
+        mock_user_cache.invalidate.assert_awaited_once_with("test@example.com")
     
-    async def test_confirmed_email(self):
+    @patch('repository.users.user_cache', new_callable=AsyncMock)
+    async def test_confirmed_email(self, mock_user_cache):
         # Мокируем поведение get_user_by_email
-        self.db.query().filter().first.return_value = self.user
+        self.result.scalars().first.return_value = self.user
         
         # Тестируем подтверждение email
         await confirmed_email("test@example.com", self.db)
         
         # Проверяем, что флаг confirmed установлен в True
         self.assertTrue(self.user.confirmed)
-        self.db.commit.assert_called_once()
+        self.db.commit.assert_awaited_once()
+        mock_user_cache.invalidate.assert_awaited_once_with("test@example.com")
     
-    async def test_update_avatar(self):
+    @patch('repository.users.user_cache', new_callable=AsyncMock)
+    async def test_update_avatar(self, mock_user_cache):
         # Мокируем поведение get_user_by_email
-        self.db.query().filter().first.return_value = self.user
+        self.result.scalars().first.return_value = self.user
         
         # Тестируем обновление аватара
         result = await update_avatar("test@example.com", "http://newavatar.com/avatar", self.db)
         
         # Проверяем, что аватар обновлен
         self.assertEqual(self.user.avatar, "http://newavatar.com/avatar")
-        self.db.commit.assert_called_once()
+        self.db.commit.assert_awaited_once()
+        mock_user_cache.invalidate.assert_awaited_once_with("test@example.com")
 
 
 if __name__ == "__main__":
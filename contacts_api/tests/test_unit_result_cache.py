@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from services.result_cache import ResultCache
+
+
+class TestResultCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.store = {}
+        self.r = MagicMock()
+        self.r.get = AsyncMock(side_effect=lambda key: self.store.get(key))
+        self.r.set = AsyncMock(side_effect=lambda key, value, ex=None: self.store.__setitem__(key, value))
+        self.cache = ResultCache(self.r, ttl=60)
+        self.fills = 0
+
+    async def fill(self, cacheable=True):
+        self.fills += 1
+        await asyncio.sleep(0)
+        return b'[{"id":1}]', {"X-Next-Cursor": "abc"}, cacheable
+
+    def test_key_depends_on_version_and_params(self):
+        key = ResultCache.key(1, 10, "list", {"limit": 10, "skip": 0})
+        self.assertEqual(key, ResultCache.key(1, 10, "list", {"skip": 0, "limit": 10}))
+        self.assertNotEqual(key, ResultCache.key(1, 11, "list", {"limit": 10, "skip": 0}))
+        self.assertNotEqual(key, ResultCache.key(1, 10, "list", {"limit": 20, "skip": 0}))
+        self.assertNotEqual(key, ResultCache.key(2, 10, "list", {"limit": 10, "skip": 0}))
+
+    async def test_miss_then_hit(self):
+        first = await self.cache.get_or_fill("k", self.fill)
+        second = await self.cache.get_or_fill("k", self.fill)
+        self.assertEqual(first, (b'[{"id":1}]', {"X-Next-Cursor": "abc"}))
+        self.assertEqual(second, first)
+        self.assertEqual(self.fills, 1)
+        self.r.set.assert_awaited_once()
+        self.assertEqual(self.r.set.call_args.kwargs["ex"], 60)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+        self.assertEqual(self.cache.stats()["hit_rate"], 0.5)
+
+    async def test_uncacheable_result_is_not_stored(self):
+        await self.cache.get_or_fill("k", lambda: self.fill(cacheable=False))
+        await self.cache.get_or_fill("k", lambda: self.fill(cacheable=False))
+        self.assertEqual(self.fills, 2)
+        self.r.set.assert_not_called()
+
+    async def test_concurrent_misses_fill_once(self):
+        results = await asyncio.gather(*(self.cache.get_or_fill("k", self.fill) for _ in range(5)))
+        self.assertEqual(self.fills, 1)
+        self.assertEqual(len(set(body for body, _ in results)), 1)
+        self.assertEqual(self.cache.stats()["coalesced"], 4)
+        self.assertEqual(self.cache.stats()["in_flight"], 0)
+
+    async def test_waiters_fill_themselves_when_the_first_fill_fails(self):
+        async def failing_fill():
+            await asyncio.sleep(0)
+            raise RuntimeError("database is down")
+
+        first = asyncio.create_task(self.cache.get_or_fill("k", failing_fill))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(self.cache.get_or_fill("k", self.fill))
+        with self.assertRaises(RuntimeError):
+            await first
+        self.assertEqual((await second)[0], b'[{"id":1}]')
+        self.assertEqual(self.cache.stats()["in_flight"], 0)
+
+    async def test_disabled_cache_always_fills(self):
+        self.cache.enabled = False
+        await self.cache.get_or_fill("k", self.fill)
+        await self.cache.get_or_fill("k", self.fill)
+        self.assertEqual(self.fills, 2)
+        self.r.get.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from models import User
+from services.user_cache import UserSnapshot, UserCache
+
+
+class TestUserSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User(id=1, username="deadpool", email="deadpool@example.com", password="hash",
+                         refresh_token="token", created_at=datetime(2024, 9, 26, 20, 28, 25),
+                         avatar="http://gravatar.com/avatar", confirmed=True)
+
+    def test_round_trip(self):
+        snapshot = UserSnapshot.from_user(self.user)
+        self.assertEqual(UserSnapshot.loads(snapshot.dumps()), snapshot)
+
+    def test_secrets_are_not_serialized(self):
+        data = UserSnapshot.from_user(self.user).dumps()
+        self.assertNotIn(b"hash", data)
+        self.assertNotIn(b"token", data)
+
+    def test_other_format_version_is_a_miss(self):
+        self.assertIsNone(UserSnapshot.loads(b'[0,1,"deadpool","deadpool@example.com",null,null,true]'))
+        self.assertIsNone(UserSnapshot.loads(b"\x80\x04garbage"))
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.r = MagicMock()
+        self.r.get = AsyncMock()
+        self.r.set = AsyncMock()
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.r.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.cache = UserCache(self.r, ttl=900, local_size=2, local_ttl=30)
+        self.snapshot = UserSnapshot(1, "deadpool", "deadpool@example.com", None, None, True)
+
+    async def test_set_uses_single_command_with_expiry(self):
+        await self.cache.set(self.snapshot)
+        self.r.set.assert_awaited_once_with("user:v1:deadpool@example.com", self.snapshot.dumps(), ex=900)
+
+    async def test_get_miss_and_hit(self):
+        self.r.get.return_value = None
+        self.assertIsNone(await self.cache.get("deadpool@example.com"))
+        self.r.get.return_value = self.snapshot.dumps()
+        self.assertEqual(await self.cache.get("deadpool@example.com"), self.snapshot)
+        self.assertEqual(await self.cache.get("deadpool@example.com"), self.snapshot)
+        self.assertEqual(self.r.get.await_count, 2)
+        self.assertEqual(self.cache.stats(), {"local": {"hits": 1, "misses": 2, "size": 1},
+                                              "redis": {"hits": 1, "misses": 1}})
+
+    async def test_local_entry_expires(self):
+        await self.cache.set(self.snapshot)
+        self.r.get.return_value = None
+        with patch("services.user_cache.time.monotonic", return_value=time.monotonic() + 31):
+            self.assertIsNone(await self.cache.get("deadpool@example.com"))
+        self.r.get.assert_awaited_once()
+
+    async def test_local_tier_is_lru_bounded(self):
+        for i in range(3):
+            await self.cache.set(UserSnapshot(i, "user", f"user{i}@example.com", None, None, True))
+        self.assertEqual(self.cache.stats()["local"]["size"], 2)
+        self.r.get.return_value = None
+        self.assertIsNone(await self.cache.get("user0@example.com"))
+
+    async def test_invalidate_in_one_round_trip(self):
+        await self.cache.set(self.snapshot)
+        await self.cache.invalidate("deadpool@example.com")
+        self.pipe.delete.assert_called_once_with("user:v1:deadpool@example.com")
+        self.pipe.publish.assert_called_once_with(UserCache.CHANNEL, "deadpool@example.com")
+        self.pipe.execute.assert_awaited_once()
+        self.assertEqual(self.cache.stats()["local"]["size"], 0)
+
+    async def test_invalidation_from_other_worker(self):
+        await self.cache.set(self.snapshot)
+        self.cache._on_invalidate({"channel": UserCache.CHANNEL.encode(), "data": b"deadpool@example.com"})
+        self.assertEqual(self.cache.stats()["local"]["size"], 0)
+
+    async def test_stale_read_is_not_kept_locally(self):
+        async def get_and_invalidate(key):
+            self.cache._on_invalidate({"data": b"deadpool@example.com"})
+            return self.snapshot.dumps()
+        self.r.get.side_effect = get_and_invalidate
+        self.assertEqual(await self.cache.get("deadpool@example.com"), self.snapshot)
+        self.assertEqual(self.cache.stats()["local"]["size"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()